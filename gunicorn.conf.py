@@ -0,0 +1,65 @@
+"""gunicorn の起動設定
+
+ASGI（uvicorn ワーカー）で起動する。非同期ビュー（注文画面・注文送信・ステータス確認）は
+通信の遅いスマホやロングポーリングの待ち時間中もワーカーを占有しない。
+
+    gunicorn qr_order.asgi:application -c gunicorn.conf.py
+
+既定ではアプリをマスタープロセスで読み込んでからワーカーを起動する（preload_app）。
+ワーカーは読み込み済みのアプリを引き継ぐので起動が速く、ウォームアップ（qr/warmup.py）も
+起動時に1回だけ行う。コードを更新した場合は HUP ではなく再起動すること。
+GUNICORN_PRELOAD=0 の場合はワーカーごとにアプリを読み込む（HUP で更新を反映できる）。
+"""
+import multiprocessing
+import os
+import shutil
+from pathlib import Path
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'uvicorn.workers.UvicornWorker'
+# 1ワーカーで多数の接続を捌けるので、ワーカー数は少なめでよい（SQLiteの書き込み競合も減る）
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() + 1, 4)))
+# ロングポーリング（最大25秒）より長くする
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# ワーカーごとのメトリクスを合計するためのディレクトリ（qr/metrics.py）
+METRICS_DIR = os.environ.setdefault('QR_METRICS_DIR', str(Path(__file__).resolve().parent / '.metrics'))
+
+# post_fork ではアプリを読み込む前（preload_app でない場合）でも設定を読めるようにする
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qr_order.settings')
+
+# 全ワーカーで共有するキャッシュのディレクトリ（settings.CACHES）
+CACHE_DIR = os.environ.setdefault('QR_CACHE_DIR', str(Path(__file__).resolve().parent / '.cache'))
+
+
+def on_starting(server):
+    # 前回起動時のワーカーの値が残らないように空にする
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    # 更新前のコードで作成したキャッシュ（モデルのインスタンスなど）を読まないように空にする
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def when_ready(server):
+    # preload_app の場合はアプリの読み込み後・ワーカーの起動前に呼ばれる
+    if not preload_app:
+        return
+    from qr.warmup import warm_up
+
+    try:
+        warm_up()
+    except Exception:
+        # ウォームアップに失敗してもサーバーは起動する（最初のリクエストが遅くなるだけ）
+        server.log.exception('ウォームアップに失敗しました')
+
+
+def post_fork(server, worker):
+    # メトリクスの書き出しはワーカーだけで行う（マスターの値を /metrics に含めないように）
+    from qr.metrics import reset_metrics, start_flusher
+
+    # preload_app の場合にマスターで記録した値を引き継がないように消してから起動する
+    reset_metrics()
+    start_flusher()
@@ -1,21 +1,31 @@
-from django.contrib import admin
-from .models import StoreSettings, Table, MenuCategory, MenuItem, Order, OrderItem
+from django.contrib import admin, messages
+from .models import Store, StoreSettings, Table, MenuCategory, MenuItem, Order, OrderItem, OrderStatusTransition, Task, Checkout, DailySalesRollup
+from .paginators import EstimatedCountPaginator
+from .tasks import retry_task
+from .views import apply_status_transitions
+
+@admin.register(Store)
+class StoreAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug', 'is_active', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'slug']
+    prepopulated_fields = {'slug': ['name']}
 
 @admin.register(StoreSettings)
 class StoreSettingsAdmin(admin.ModelAdmin):
-    list_display = ['id', 'wifi_ssid', 'server_ip', 'wifi_security', 'created_at', 'updated_at']
+    list_display = ['id', 'store', 'wifi_ssid', 'server_ip', 'wifi_security', 'created_at', 'updated_at']
     readonly_fields = ['created_at', 'updated_at']
 
 @admin.register(Table)
 class TableAdmin(admin.ModelAdmin):
-    list_display = ['table_number', 'is_active', 'created_at']
-    list_filter = ['is_active', 'created_at']
+    list_display = ['table_number', 'store', 'is_active', 'created_at']
+    list_filter = ['store', 'is_active', 'created_at']
     search_fields = ['table_number']
 
 @admin.register(MenuCategory)
 class MenuCategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'order', 'is_active', 'created_at']
-    list_filter = ['is_active', 'created_at']
+    list_display = ['name', 'store', 'order', 'is_active', 'created_at']
+    list_filter = ['store', 'is_active', 'created_at']
     search_fields = ['name']
     ordering = ['order', 'name']
 
@@ -27,21 +37,101 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(MenuItem)
 class MenuItemAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'is_available', 'order', 'created_at']
-    list_filter = ['category', 'is_available', 'created_at']
+    list_filter = ['store', 'category', 'is_available', 'created_at']
     search_fields = ['name', 'description']
     ordering = ['category__order', 'order', 'name']
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'table', 'status', 'total_amount', 'created_at']
-    list_filter = ['status', 'created_at', 'table']
-    search_fields = ['id', 'table__table_number', 'notes']
-    ordering = ['-created_at']
+    list_display = ['id', 'store', 'table', 'status', 'total_amount', 'created_at']
+    list_filter = ['store', 'status']
+    list_select_related = ['table', 'store']
+    # id・テーブル番号は完全一致で検索する（部分一致だと全件を走査するため）
+    search_fields = ['=id', '=table__table_number']
+    date_hierarchy = 'created_at'
+    # 件数の多い一覧なので全件の COUNT はしない
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/qr/cursor_change_list.html'
+    ordering = ['-id']
     inlines = [OrderItemInline]
     readonly_fields = ['created_at', 'updated_at']
+    raw_id_fields = ['checkout']
+    
+    def save_model(self, request, obj, form, change):
+        """ステータスの変更は厨房画面と同じく apply_status_transitions で行う
+        
+        直接保存すると遷移履歴が記録されず、顧客画面のステータスのキャッシュも更新されないため。
+        """
+        status = obj.status
+        if change and 'status' in form.changed_data:
+            obj.status = form.initial['status']
+        super().save_model(request, obj, form, change)
+        if status != obj.status:
+            _, errors = apply_status_transitions(obj.store, [(obj.id, status)])
+            for error in errors:
+                self.message_user(request, f'ステータスを変更できませんでした: {error["message"]}', messages.ERROR)
+            obj.refresh_from_db()
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'menu_item', 'quantity', 'unit_price', 'total_price']
-    list_filter = ['order__created_at', 'menu_item__category']
-    search_fields = ['order__id', 'menu_item__name']
\ No newline at end of file
+    list_filter = ['menu_item__category']
+    list_select_related = ['order__table', 'menu_item']
+    search_fields = ['=order__id', '^menu_item__name']
+    date_hierarchy = 'order__created_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/qr/cursor_change_list.html'
+    ordering = ['-id']
+    raw_id_fields = ['order', 'menu_item']
+
+@admin.register(OrderStatusTransition)
+class OrderStatusTransitionAdmin(admin.ModelAdmin):
+    list_display = ['order', 'from_status', 'to_status', 'created_at']
+    list_filter = ['to_status', 'created_at']
+    search_fields = ['order__id']
+    
+    # 追記のみの履歴なので管理画面からは変更させない
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(Checkout)
+class CheckoutAdmin(admin.ModelAdmin):
+    list_display = ['id', 'store', 'table', 'total_amount', 'order_count', 'split_method', 'settled_at']
+    list_filter = ['store', 'split_method']
+    list_select_related = ['store', 'table']
+    search_fields = ['=id', '=table__table_number']
+    date_hierarchy = 'settled_at'
+    ordering = ['-id']
+    
+    # 会計時点の記録なので管理画面からは変更させない（売上の集計と合わなくなるため）
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'store', 'checkout_count', 'order_count', 'item_count', 'total_amount', 'updated_at']
+    list_filter = ['store']
+    date_hierarchy = 'date'
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'updated_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['attempts', 'result', 'last_error', 'locked_by', 'locked_at', 'created_at', 'updated_at']
+    actions = ['retry_failed_tasks']
+    
+    @admin.action(description='失敗したタスクを再実行')
+    def retry_failed_tasks(self, request, queryset):
+        count = sum(retry_task(task_id) for task_id in queryset.filter(status='failed').values_list('id', flat=True))
+        self.message_user(request, f'{count} 件のタスクを再実行します。')
@@ -0,0 +1,351 @@
+"""キャッシュ関連のヘルパー
+
+キャッシュの保存先は settings.CACHES（既定はファイル）。ファイルの場合は gunicorn の全ワーカーで
+共有されるので、あるワーカーで行った破棄が他のワーカーにもすぐに反映される。
+
+まとめて破棄したいキャッシュ（店舗のメニュー・テーブルなど）は名前空間に入れてキーを作る。
+名前空間のバージョンを上げると、その名前空間の古いキーは参照されなくなる（期限切れで消える）。
+
+    key = versioned_key(TABLE_NAMESPACE.format(store_id), 'table:1')
+    invalidate_namespace(TABLE_NAMESPACE.format(store_id))
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .metrics import record_cache
+
+# 名前空間のバージョン
+NAMESPACE_VERSION_KEY = 'namespace_version:{}'
+
+# 注文画面用のメニュー（有効なカテゴリと提供可能な商品）のスナップショット（店舗ごとの名前空間）
+# スナップショットの項目を変えたらキーも変える（古い形式のキャッシュを読まないように）
+MENU_NAMESPACE = 'menu:{}'
+MENU_SNAPSHOT_KEY = 'snapshot:v3'
+MENU_SNAPSHOT_TIMEOUT = 60 * 60  # 1時間
+
+# 注文画面のテーブル（店舗ごとの名前空間。キーはテーブル番号）
+TABLE_NAMESPACE = 'tables:{}'
+TABLE_KEY = 'table:{}'
+TABLE_TIMEOUT = 60 * 60
+# 存在しないテーブル番号への問い合わせもキャッシュしておく
+TABLE_MISSING_TIMEOUT = 60
+
+# 店舗設定（店舗ごと）
+STORE_SETTINGS_KEY = 'store_settings:{}'
+STORE_SETTINGS_TIMEOUT = 60 * 60
+
+# 注文ステータスのキャッシュ（顧客のポーリングをDBに届かせないため）
+ORDER_STATUS_KEY = 'order_status:{}'
+# 顧客が画面を開いている間だけあればよい（消えた場合はDBから読み直す）。件数が増えると
+# ファイルのキャッシュの書き込みが遅くなるので短めにし、提供済み・キャンセルの注文はさらに短くする
+ORDER_STATUS_TIMEOUT = 60 * 60 * 2  # 2時間
+ORDER_STATUS_FINISHED_TIMEOUT = 60 * 10
+# 存在しない注文IDへの問い合わせもキャッシュしておく
+ORDER_STATUS_MISSING_TIMEOUT = 60
+
+# 店舗設定のサーバーIP（全店舗分。ホスト名の検証に使う）
+SERVER_IP_KEY = 'store_server_ips'
+# 他のプロセスで変更された場合もこの秒数以内に反映される
+SERVER_IP_TIMEOUT = 30
+
+# URLの店舗ID（slug）から引く店舗
+STORE_KEY = 'store:{}'
+STORE_TIMEOUT = 60 * 60
+
+
+def _new_version():
+    # 破棄されたバージョンを再び使わないように時刻から作る
+    return time.time_ns()
+
+
+async def _aget(key, default=None):
+    """キャッシュの読み込み（非同期ビュー用）
+
+    Django 4.1 の cache.aget は sync_to_async(thread_sensitive=True) なので、ORM と同じ1本のスレッドで
+    実行され、DBアクセスが終わるまで待たされる。キャッシュの読み込みはスレッドプールで行う。
+    """
+    return await sync_to_async(cache.get, thread_sensitive=False)(key, default)
+
+
+async def _aadd(key, value, timeout):
+    """cache.add の非同期版（_aget と同じくスレッドプールで行う）"""
+    return await sync_to_async(cache.add, thread_sensitive=False)(key, value, timeout)
+
+
+def get_namespace_version(namespace):
+    """名前空間の現在のバージョン"""
+    key = NAMESPACE_VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        # 他のプロセスが同時に作成した場合はそちらに合わせる
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_namespace_version(namespace):
+    """get_namespace_version の非同期版"""
+    key = NAMESPACE_VERSION_KEY.format(namespace)
+    version = await _aget(key)
+    if version is None:
+        version = _new_version()
+        if not await _aadd(key, version, None):
+            version = await _aget(key, version)
+    return version
+
+
+def versioned_key(namespace, key):
+    """名前空間の現在のバージョンを含めたキー"""
+    return f'{namespace}:{get_namespace_version(namespace)}:{key}'
+
+
+async def aversioned_key(namespace, key):
+    """versioned_key の非同期版"""
+    return f'{namespace}:{await aget_namespace_version(namespace)}:{key}'
+
+
+def invalidate_namespace(namespace):
+    """名前空間のバージョンを上げて、その名前空間のキャッシュをまとめて無効にする"""
+    cache.set(NAMESPACE_VERSION_KEY.format(namespace), _new_version(), None)
+
+
+def build_menu_snapshot(store_id):
+    """メニューのスナップショットをDBから作成"""
+    from django.db.models import Prefetch
+    from .models import MenuCategory, MenuItem
+    from .search import build_search_text
+
+    categories = MenuCategory.objects.filter(store_id=store_id, is_active=True).prefetch_related(
+        Prefetch('items', queryset=MenuItem.objects.filter(is_available=True))
+    )
+    return [
+        {
+            'id': category.id,
+            'name': category.name,
+            'items': [
+                {
+                    'id': item.id,
+                    'name': item.name,
+                    'description': item.description,
+                    'price': item.price,
+                    'image_url': item.image.url if item.image else '',
+                    'image_width': item.image_width,
+                    'image_height': item.image_height,
+                    'image_placeholder': item.image_placeholder,
+                    'stock': item.stock,
+                    # 注文画面の検索用（正規化済み）
+                    'search': build_search_text(item.name, item.reading, item.description),
+                }
+                for item in category.items.all()
+            ],
+        }
+        for category in categories
+    ]
+
+
+def get_menu_snapshot(store_id):
+    """メニューのスナップショットを取得（キャッシュにない場合のみDBから作成）"""
+    key = versioned_key(MENU_NAMESPACE.format(store_id), MENU_SNAPSHOT_KEY)
+    snapshot = cache.get(key)
+    record_cache('menu_snapshot', snapshot is not None)
+    if snapshot is None:
+        snapshot = build_menu_snapshot(store_id)
+        cache.set(key, snapshot, MENU_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def invalidate_menu_cache(store_id):
+    """メニューのキャッシュを破棄"""
+    invalidate_namespace(MENU_NAMESPACE.format(store_id))
+
+
+def get_menu_version(store_id):
+    """店舗のメニューのバージョン（メニューが変更されると変わる。テンプレートの断片キャッシュのキーに使う）"""
+    return get_namespace_version(MENU_NAMESPACE.format(store_id))
+
+
+def get_table(store_id, table_number):
+    """店舗の有効なテーブルを取得（キャッシュにない場合のみDBから読み込む。見つからなければ None）"""
+    key = versioned_key(TABLE_NAMESPACE.format(store_id), TABLE_KEY.format(table_number))
+    data = cache.get(key)
+    record_cache('table', data is not None)
+    if data is None:
+        from .models import Table
+
+        table = Table.objects.filter(store_id=store_id, table_number=table_number, is_active=True).first()
+        if table is None:
+            cache.set(key, {'missing': True}, TABLE_MISSING_TIMEOUT)
+        else:
+            cache.set(key, table, TABLE_TIMEOUT)
+        return table
+    if isinstance(data, dict):
+        return None
+    return data
+
+
+async def aget_table(store_id, table_number):
+    """get_table の非同期版（キャッシュにあれば ORM のスレッドを使わずに返す）"""
+    key = await aversioned_key(TABLE_NAMESPACE.format(store_id), TABLE_KEY.format(table_number))
+    data = await _aget(key)
+    if data is None:
+        return await sync_to_async(get_table)(store_id, table_number)
+    record_cache('table', True)
+    if isinstance(data, dict):
+        return None
+    return data
+
+
+def invalidate_tables(store_id):
+    """店舗のテーブルのキャッシュを破棄"""
+    invalidate_namespace(TABLE_NAMESPACE.format(store_id))
+
+
+def get_tables_version(store_id):
+    """店舗のテーブルのバージョン（テーブルが変更されると変わる。テンプレートの断片キャッシュのキーに使う）"""
+    return get_namespace_version(TABLE_NAMESPACE.format(store_id))
+
+
+def order_status_etag(data):
+    """注文ステータスのETagを生成"""
+    return '"{}-{}-{}"'.format(data['order_id'], data['status'], data['version'])
+
+
+def set_order_status(order):
+    """注文ステータスをキャッシュに書き込む"""
+    data = {
+        'order_id': order.id,
+        'store_id': order.store_id,
+        'table_number': order.table.table_number,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'version': int(order.updated_at.timestamp() * 1000),
+    }
+    timeout = ORDER_STATUS_FINISHED_TIMEOUT if order.status in order.FINISHED_STATUSES else ORDER_STATUS_TIMEOUT
+    cache.set(ORDER_STATUS_KEY.format(order.id), data, timeout)
+    return data
+
+
+def refresh_order_statuses(order_ids):
+    """まとめて更新された注文のステータスをキャッシュに反映"""
+    from .models import Order
+
+    for order in Order.objects.select_related('table').filter(id__in=order_ids):
+        set_order_status(order)
+
+
+def get_cached_order_status(order_id):
+    """キャッシュ上の注文ステータスを取得（DBにはアクセスしない）"""
+    return cache.get(ORDER_STATUS_KEY.format(order_id))
+
+
+async def aget_order_status(order_id):
+    """get_order_status の非同期版（キャッシュにあれば ORM のスレッドを使わずに返す）"""
+    data = await _aget(ORDER_STATUS_KEY.format(order_id))
+    if data is None:
+        # ヒットしなかった場合は get_order_status で記録する
+        return await sync_to_async(get_order_status)(order_id)
+    record_cache('order_status', True)
+    if data.get('missing'):
+        return None
+    return data
+
+
+def get_order_status(order_id):
+    """注文ステータスを取得（キャッシュにない場合のみDBから読み込む）"""
+    from .models import Order
+
+    data = get_cached_order_status(order_id)
+    record_cache('order_status', data is not None)
+    if data is None:
+        order = Order.objects.select_related('table').filter(id=order_id).first()
+        if order is None:
+            cache.set(ORDER_STATUS_KEY.format(order_id), {'missing': True}, ORDER_STATUS_MISSING_TIMEOUT)
+            return None
+        data = set_order_status(order)
+    if data.get('missing'):
+        return None
+    return data
+
+
+def get_server_ips():
+    """全店舗の店舗設定のサーバーIPを取得"""
+    server_ips = cache.get(SERVER_IP_KEY)
+    record_cache('server_ips', server_ips is not None)
+    if server_ips is None:
+        from .models import StoreSettings
+
+        server_ips = [ip for ip in StoreSettings.objects.values_list('server_ip', flat=True) if ip]
+        cache.set(SERVER_IP_KEY, server_ips, SERVER_IP_TIMEOUT)
+    return server_ips
+
+
+async def aget_server_ips():
+    """get_server_ips の非同期版（キャッシュにあれば ORM のスレッドを使わずに返す）"""
+    server_ips = await _aget(SERVER_IP_KEY)
+    if server_ips is None:
+        return await sync_to_async(get_server_ips)()
+    record_cache('server_ips', True)
+    return server_ips
+
+
+def get_store_settings(store_id):
+    """店舗設定を取得（キャッシュにない場合のみDBから読み込む。未設定の場合は None）
+
+    取得した設定を変更して保存しないこと（変更する画面ではDBから読み込む）。
+    """
+    key = STORE_SETTINGS_KEY.format(store_id)
+    data = cache.get(key)
+    record_cache('store_settings', data is not None)
+    if data is None:
+        from .models import StoreSettings
+
+        store_settings = StoreSettings.objects.filter(store_id=store_id).first()
+        data = store_settings or {'missing': True}
+        cache.set(key, data, STORE_SETTINGS_TIMEOUT)
+    if isinstance(data, dict):
+        return None
+    return data
+
+
+def invalidate_store_settings(store_id):
+    """店舗設定のキャッシュを破棄"""
+    cache.delete(STORE_SETTINGS_KEY.format(store_id))
+
+
+def invalidate_server_ip():
+    """サーバーIPのキャッシュを破棄"""
+    cache.delete(SERVER_IP_KEY)
+
+
+def get_store(slug):
+    """URLの店舗IDから有効な店舗を取得（{'id', 'slug', 'name'}。見つからなければ None）"""
+    data = cache.get(STORE_KEY.format(slug))
+    record_cache('store', data is not None)
+    if data is None:
+        from .models import Store
+
+        store = Store.objects.filter(slug=slug, is_active=True).values('id', 'slug', 'name').first()
+        data = store or {'missing': True}
+        cache.set(STORE_KEY.format(slug), data, STORE_TIMEOUT)
+    if data.get('missing'):
+        return None
+    return data
+
+
+async def aget_store(slug):
+    """get_store の非同期版（キャッシュにあれば ORM のスレッドを使わずに返す）"""
+    data = await _aget(STORE_KEY.format(slug))
+    if data is None:
+        return await sync_to_async(get_store)(slug)
+    record_cache('store', True)
+    if data.get('missing'):
+        return None
+    return data
+
+
+def invalidate_store(slug):
+    """店舗のキャッシュを破棄"""
+    cache.delete(STORE_KEY.format(slug))
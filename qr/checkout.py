@@ -0,0 +1,133 @@
+"""会計（テーブルの未会計の注文をまとめて締める）
+
+checkout_table() は1トランザクションで、未会計の注文を Checkout にまとめて会計済み（is_settled）にし、
+その日の売上（DailySalesRollup）に加算する。会計時点の明細と支払いの内訳は Checkout に保存するので、
+売上の集計や会計の表示で注文・注文項目を読み直す必要はない。
+
+割り勘は次の2通り。
+- 均等割り（even）: 合計を人数で割り、割り切れない端数は先頭の人から1円ずつ多く払う
+- 品目ごと（item）: 注文項目ごとに支払う人の番号（1から）を指定する。同じ項目を複数人で分けることはできない
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Checkout, DailySalesRollup, Order, OrderItem
+
+# 割り勘の人数の上限
+MAX_SPLIT_COUNT = 50
+
+
+class CheckoutError(Exception):
+    """会計できない場合のエラー（メッセージはそのまま画面に表示する）"""
+
+
+def split_evenly(total, count):
+    """合計を count 人で割った金額のリスト（端数は先頭の人から1円ずつ加える）"""
+    if not 1 <= count <= MAX_SPLIT_COUNT:
+        raise CheckoutError(f'人数は1〜{MAX_SPLIT_COUNT}人で指定してください。')
+    share, remainder = divmod(total, count)
+    return [share + 1 if i < remainder else share for i in range(count)]
+
+
+def split_by_item(lines, assignments):
+    """明細ごとの支払う人から、支払いの内訳 [{'amount', 'lines'}] を作る
+
+    assignments は {注文項目ID: 支払う人の番号（1から）}。すべての明細に指定が必要。
+    """
+    payments = {}
+    for line in lines:
+        payer = assignments.get(line['order_item_id'])
+        if payer is None:
+            raise CheckoutError(f'「{line["name"]}」を支払う人が指定されていません。')
+        if not 1 <= payer <= MAX_SPLIT_COUNT:
+            raise CheckoutError(f'支払う人は1〜{MAX_SPLIT_COUNT}の番号で指定してください。')
+        payment = payments.setdefault(payer, {'amount': 0, 'lines': []})
+        payment['amount'] += line['amount']
+        payment['lines'].append(line['order_item_id'])
+    # 番号を詰めて、番号順に並べる
+    return [payments[payer] for payer in sorted(payments)]
+
+
+def build_lines(orders):
+    """注文項目の明細（会計時点の商品名・単価で保存する）"""
+    items = (
+        OrderItem.objects.filter(order__in=orders)
+        .select_related('menu_item')
+        .order_by('order_id', 'id')
+    )
+    return [
+        {
+            'order_item_id': item.id,
+            'order_id': item.order_id,
+            'name': item.menu_item.name,
+            'quantity': item.quantity,
+            'unit_price': item.unit_price,
+            'amount': item.total_price,
+        }
+        for item in items
+    ]
+
+
+def checkout_table(table, split_method='none', split_count=1, assignments=None):
+    """テーブルの未会計の注文を会計済みにして、作成した Checkout を返す
+
+    同時に同じテーブルを会計した場合や、会計する注文がない場合は CheckoutError（何も変更しない）。
+    """
+    valid_methods = dict(Checkout.SPLIT_CHOICES)
+    if split_method not in valid_methods:
+        raise CheckoutError('会計の方法が正しくありません。')
+    now = timezone.now()
+
+    with transaction.atomic():
+        orders = list(
+            table.orders.select_for_update()
+            .filter(status__in=Order.TAB_STATUSES, is_settled=False)
+            .order_by('created_at')
+        )
+        if not orders:
+            raise CheckoutError('未会計の注文はありません。')
+
+        lines = build_lines(orders)
+        total = sum(order.total_amount for order in orders)
+        if split_method == 'item':
+            payments = split_by_item(lines, assignments or {})
+        else:
+            count = split_count if split_method == 'even' else 1
+            payments = [{'amount': amount, 'lines': []} for amount in split_evenly(total, count)]
+
+        checkout = Checkout.objects.create(
+            store_id=table.store_id,
+            table=table,
+            total_amount=total,
+            order_count=len(orders),
+            item_count=sum(line['quantity'] for line in lines),
+            split_method=split_method,
+            lines=lines,
+            payments=payments,
+            settled_at=now,
+        )
+        # 読み込んだ後に他の端末で会計された注文があれば、すべて取り消す
+        settled = Order.objects.filter(
+            id__in=[order.id for order in orders], is_settled=False
+        ).update(is_settled=True, checkout=checkout, updated_at=now)
+        if settled != len(orders):
+            raise CheckoutError('他の端末で会計されたため、会計を取り消しました。伝票を確認してください。')
+
+        add_to_daily_sales(checkout)
+    return checkout
+
+
+def add_to_daily_sales(checkout):
+    """会計をその日の売上に加算する（同時に会計しても値を失わないように F() で加算する）"""
+    rollup, _ = DailySalesRollup.objects.get_or_create(
+        store_id=checkout.store_id,
+        date=timezone.localdate(checkout.settled_at),
+    )
+    DailySalesRollup.objects.filter(id=rollup.id).update(
+        checkout_count=F('checkout_count') + 1,
+        order_count=F('order_count') + checkout.order_count,
+        item_count=F('item_count') + checkout.item_count,
+        total_amount=F('total_amount') + checkout.total_amount,
+        updated_at=timezone.now(),
+    )
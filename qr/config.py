@@ -0,0 +1,158 @@
+"""config.json の読み込みと許可するホスト名
+
+config.json はサーバー起動時だけでなく実行中にも書き換えられる（店舗設定でサーバーIPを
+変更した場合など）。毎リクエスト読み直すとディスクアクセスが増えるので、CHECK_INTERVAL 秒に
+1回だけ更新日時を確認し、変わっていた場合だけ読み直す。
+店舗設定のサーバーIP（共有キャッシュのファイル）も同じ間隔でだけ読み直す。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http.request import validate_host
+
+from .caches import aget_server_ips, get_server_ips
+
+logger = logging.getLogger(__name__)
+
+# config.json の更新日時を確認する間隔（秒）
+CHECK_INTERVAL = 2
+
+
+class ConfigFile:
+    """更新日時が変わったときだけ読み直す JSON 設定ファイル"""
+
+    def __init__(self, path, check_interval=CHECK_INTERVAL):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._data = {}
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """設定を取得（前回の確認から check_interval 秒以内なら読み込み済みの内容を返す）"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                    self._reload_if_changed()
+                    self._checked_at = now
+        return self._data
+
+    def write(self, data):
+        """設定を書き込む（読み込み中のプロセスが壊れたファイルを読まないように置き換えで書く）"""
+        tmp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        # このプロセスでは次の get() で読み直す
+        self._checked_at = None
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._data, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            # 読めない場合は前回の内容を使い続ける
+            logger.warning('config.json 読み込みエラー: %s', e)
+            return
+        self._data = data if isinstance(data, dict) else {}
+        self._mtime = mtime
+
+
+server_config = ConfigFile(settings.CONFIG_PATH)
+
+
+class ServerIps:
+    """店舗設定のサーバーIP（check_interval 秒の間はプロセス内に保持した値を返す）
+
+    共有キャッシュはファイルなので、ホスト名の検証のたびに読むとリクエストごとにディスクを読むことになる。
+    refresh=True での読み直しも check_interval 秒に1回までにする（許可されていないホスト名への
+    リクエストが続いても、そのたびに読み直さないように）。
+    """
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        # (サーバーIP, 取得した時刻) を1つの値として入れ替える（別スレッドから途中の状態が見えないように）
+        self._entry = None
+        self._refreshed_at = None
+
+    def get(self, refresh=False):
+        entry = self._entry
+        if not self._is_fresh(entry) or (refresh and self._can_refresh()):
+            return self._set(get_server_ips())
+        return entry[0]
+
+    async def aget(self, refresh=False):
+        entry = self._entry
+        if not self._is_fresh(entry) or (refresh and self._can_refresh()):
+            return self._set(await aget_server_ips())
+        return entry[0]
+
+    def clear(self):
+        self._entry = None
+        self._refreshed_at = None
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[1] < self.check_interval
+
+    def _can_refresh(self):
+        now = time.monotonic()
+        if self._refreshed_at is not None and now - self._refreshed_at < self.check_interval:
+            return False
+        self._refreshed_at = now
+        return True
+
+    def _set(self, server_ips):
+        self._entry = (server_ips, time.monotonic())
+        return server_ips
+
+
+server_ips = ServerIps()
+
+
+def get_static_hosts():
+    """設定ファイルで固定している許可ホスト"""
+    hosts = list(settings.QR_ALLOWED_HOSTS)
+    # ALLOWED_HOSTS に '*' 以外が追加されている場合（テスト時の testserver など）はそれも許可する
+    hosts += [host for host in settings.ALLOWED_HOSTS if host != '*']
+    if settings.DEBUG:
+        hosts += ['.localhost', '127.0.0.1', '[::1]']
+    return hosts
+
+
+def _with_dynamic_hosts(hosts, server_ips):
+    user_ip = server_config.get().get('USER_IP')
+    if user_ip:
+        hosts = hosts + [user_ip]
+    return hosts + list(server_ips)
+
+
+def get_allowed_hosts(refresh=False):
+    """許可するホスト名（固定のホスト + config.json と各店舗の店舗設定のサーバーIP）
+
+    refresh=True の場合はプロセス内に保持したサーバーIPを使わずに読み直す（check_interval 秒に1回まで）。
+    """
+    return _with_dynamic_hosts(get_static_hosts(), server_ips.get(refresh))
+
+
+async def aget_allowed_hosts(refresh=False):
+    """get_allowed_hosts の非同期版"""
+    return _with_dynamic_hosts(get_static_hosts(), await server_ips.aget(refresh))
+
+
+def is_allowed_host(domain, allowed_hosts):
+    return bool(domain) and validate_host(domain, allowed_hosts)
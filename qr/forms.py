@@ -76,6 +76,23 @@ class TableCountForm(forms.Form):
         label='テーブル数'
     )
 
+class MenuImportForm(forms.Form):
+    """メニュー取り込みフォーム"""
+    file = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.xlsx'
+        }),
+        label='Excelファイル（.xlsx）'
+    )
+    disable_missing = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={
+            'class': 'form-check-input'
+        }),
+        label='シートにないメニューを提供停止にする'
+    )
+
 class MenuCategoryForm(forms.ModelForm):
     """メニューカテゴリフォーム"""
     class Meta:
@@ -103,7 +120,7 @@ class MenuItemForm(forms.ModelForm):
     """メニュー項目フォーム"""
     class Meta:
         model = MenuItem
-        fields = ['category', 'name', 'description', 'price', 'image', 'is_available', 'order']
+        fields = ['category', 'name', 'reading', 'description', 'price', 'image', 'is_available', 'stock', 'order']
         widgets = {
             'category': forms.Select(attrs={
                 'class': 'form-select'
@@ -112,6 +129,10 @@ class MenuItemForm(forms.ModelForm):
                 'class': 'form-control',
                 'placeholder': 'メニュー名を入力'
             }),
+            'reading': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': '例: からあげ'
+            }),
             'description': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 3,
@@ -128,6 +149,11 @@ class MenuItemForm(forms.ModelForm):
             'is_available': forms.CheckboxInput(attrs={
                 'class': 'form-check-input'
             }),
+            'stock': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': '0',
+                'placeholder': '在庫管理しない場合は空欄'
+            }),
             'order': forms.NumberInput(attrs={
                 'class': 'form-control'
             }),
@@ -135,12 +161,20 @@ class MenuItemForm(forms.ModelForm):
         labels = {
             'category': 'カテゴリ',
             'name': 'メニュー名',
+            'reading': '読み',
             'description': '説明',
             'price': '価格（円）',
             'image': '画像',
             'is_available': '提供可能',
+            'stock': '在庫数',
             'order': '表示順',
         }
+    
+    def __init__(self, *args, store=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # カテゴリはログイン中の店舗のものだけを選べるようにする
+        if store is not None:
+            self.fields['category'].queryset = MenuCategory.objects.filter(store=store)
 
 class OrderStatusForm(forms.ModelForm):
     """注文ステータス更新フォーム"""
@@ -151,4 +185,11 @@ class OrderStatusForm(forms.ModelForm):
             'status': forms.Select(attrs={
                 'class': 'form-select'
             }),
-        }
\ No newline at end of file
+        }
+    
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        # この時点の instance.status は変更前の値
+        if self.instance.pk and status != self.instance.status and not self.instance.can_transition_to(status):
+            raise forms.ValidationError('このステータスには変更できません。')
+        return status
\ No newline at end of file
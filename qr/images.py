@@ -0,0 +1,29 @@
+"""メニュー画像の読み込み中に表示する縮小画像（LQIP）の作成
+
+Pillow は読み込みに時間がかかるので、使う時に読み込む（ワーカーや管理コマンドの起動を遅くしない）。
+"""
+import base64
+import io
+
+# 縮小画像の長辺（ピクセル）。ブラウザで引き伸ばすとぼやけた仮表示になる
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+
+def build_image_placeholder(file):
+    """画像の大きさと縮小画像の data URI を返す (幅, 高さ, data URI)
+
+    スマホで撮った写真は EXIF の向きに合わせて回転してから大きさを測る（ブラウザの表示と合わせる）。
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    data = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return width, height, f'data:image/webp;base64,{data}'
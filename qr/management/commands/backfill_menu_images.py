@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from qr.models import MenuItem
+from qr.tasks import enqueue_once, generate_image_placeholder
+
+
+class Command(BaseCommand):
+    help = '画像の大きさ・縮小画像がまだないメニューについて作成します（既定ではタスクキューに登録）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync', action='store_true', help='タスクキューを使わずにこのプロセスで作成する')
+        parser.add_argument('--force', action='store_true', help='作成済みのメニューも作り直す')
+
+    def handle(self, *args, **options):
+        items = MenuItem.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            items = items.filter(Q(image_placeholder='') | Q(image_width__isnull=True))
+
+        count = 0
+        failed = 0
+        for item_id, image in items.values_list('id', 'image').iterator():
+            if options['sync']:
+                try:
+                    generate_image_placeholder(menu_item_id=item_id, image=image)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'メニュー {item_id}（{image}）: {e}')
+                    continue
+            else:
+                enqueue_once('generate_image_placeholder', menu_item_id=item_id, image=image)
+            count += 1
+
+        action = '作成しました' if options['sync'] else 'タスクキューに登録しました'
+        self.stdout.write(self.style.SUCCESS(f'{count} 件のメニュー画像を{action}。'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} 件は画像を読み込めませんでした。'))
@@ -0,0 +1,102 @@
+import statistics
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from qr.models import Store, Table
+from qr.table_tokens import make_table_token
+
+
+class Command(BaseCommand):
+    help = (
+        '主な画面の応答時間とメモリ使用量を測定します（サーバーは起動せず、このプロセス内でリクエストを処理する）。'
+        '開発用と本番用の設定を比べる場合は QR_ENV を変えて2回実行してください: '
+        'QR_ENV=production QR_HTTPS=0 python manage.py benchmark'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', help='測定に使う店舗ID（省略時は最初の有効な店舗）')
+        parser.add_argument('--requests', type=int, default=200, help='画面ごとのリクエスト数')
+        parser.add_argument('--memory-requests', type=int, default=20, help='メモリの測定に使う画面ごとのリクエスト数')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['memory_requests'] < 1:
+            raise CommandError('リクエスト数は1以上を指定してください。')
+
+        stores = Store.objects.filter(is_active=True).order_by('id')
+        if options['store']:
+            stores = stores.filter(slug=options['store'])
+        store = stores.first()
+        if store is None:
+            raise CommandError('有効な店舗がありません。')
+        table = Table.objects.filter(store=store, is_active=True).order_by('table_number').first()
+        if table is None:
+            raise CommandError(f'店舗「{store.name}」に有効なテーブルがありません。')
+
+        client = self.build_client(store)
+        urls = [
+            ('注文画面', reverse('order_menu', args=[store.slug, table.table_number])
+             + '?' + urlencode({'t': make_table_token(table)})),
+            ('メニューAPI', reverse('menu_api', args=[store.slug])),
+            ('厨房画面', reverse('kitchen_view')),
+            ('メニュー管理', reverse('menu_management')),
+            ('テーブル管理', reverse('table_management')),
+        ]
+
+        self.stdout.write(
+            f'環境: {settings.QR_ENV}（DEBUG={settings.DEBUG}） 店舗: {store.slug} '
+            f'リクエスト数: {options["requests"]}回ずつ'
+        )
+        self.stdout.write(f'{"画面":<10}{"平均(ms)":>10}{"p50(ms)":>10}{"p95(ms)":>10}{"保持SQL数":>10}{"メモリ(KB)":>12}')
+        for label, url in urls:
+            # 1回目はキャッシュの作成などを含むので測定しない
+            self.request(client, url)
+            timings = []
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                self.request(client, url)
+                timings.append((time.perf_counter() - start) * 1000)
+            # DEBUG の場合は直前のリクエストのSQLが connection.queries に残っている
+            kept_queries = len(connection.queries_log)
+            memory = self.measure_memory(client, url, options['memory_requests'])
+
+            timings.sort()
+            self.stdout.write(
+                f'{label:<10}{statistics.mean(timings):>10.2f}{timings[len(timings) // 2]:>10.2f}'
+                f'{timings[int(len(timings) * 0.95) - 1]:>10.2f}{kept_queries:>10}{memory / 1024:>12.1f}'
+            )
+
+    def build_client(self, store):
+        """ログイン済みのクライアント（ホスト名の検証を通るように 127.0.0.1 で接続する）"""
+        client = Client(HTTP_HOST='127.0.0.1')
+        session = client.session
+        session['authenticated'] = True
+        session['store_id'] = store.id
+        session.save()
+        return client
+
+    def request(self, client, url):
+        response = client.get(url, secure=settings.SECURE_SSL_REDIRECT)
+        if response.status_code != 200:
+            raise CommandError(f'{url} の応答が {response.status_code} でした。')
+        return response
+
+    def measure_memory(self, client, url, count):
+        """1リクエストあたりに確保したメモリの最大量（tracemalloc のピーク。バイト）"""
+        tracemalloc.start()
+        try:
+            peak = 0
+            for _ in range(count):
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                self.request(client, url)
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+            return peak
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from qr.ticket_times import compute_ticket_time_stats
+
+
+class Command(BaseCommand):
+    help = '提供時間（確認・調理・提供までの時間）のパーセンタイルを1時間ごと・メニューごとに集計します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='集計する日付（YYYY-MM-DD）。省略時は今日')
+        parser.add_argument('--days', type=int, default=1, help='指定日から遡って集計する日数')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                last_day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('日付は YYYY-MM-DD 形式で指定してください。')
+        else:
+            last_day = timezone.localdate()
+        if options['days'] < 1:
+            raise CommandError('--days は1以上を指定してください。')
+        first_day = last_day - timedelta(days=options['days'] - 1)
+
+        count = compute_ticket_time_stats(first_day, last_day)
+        self.stdout.write(self.style.SUCCESS(f'{first_day}〜{last_day} の集計を {count} 件作成しました。'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from qr.tasks import run_worker
+
+
+class Command(BaseCommand):
+    help = 'バックグラウンドタスク（QRコード画像の作成など）を実行するワーカーを起動します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='実行できるタスクがなくなったら終了する')
+        parser.add_argument('--sleep', type=float, help='タスクがないときの待ち時間（秒）')
+        parser.add_argument('--stale-timeout', type=int, help='この秒数を超えて実行中のままのタスクを再実行する')
+
+    def handle(self, *args, **options):
+        if options['sleep'] is not None and options['sleep'] <= 0:
+            raise CommandError('--sleep は0より大きい値を指定してください。')
+
+        try:
+            processed = run_worker(
+                once=options['once'],
+                poll_interval=options['sleep'],
+                stale_timeout=options['stale_timeout'],
+                stdout=self.stdout,
+            )
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f'{processed} 件のタスクを実行しました。'))
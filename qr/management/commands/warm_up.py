@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from qr.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = 'URL・テンプレート・メニューなどのキャッシュを事前に読み込みます（デプロイ直後の最初のリクエストを速くする）'
+
+    def handle(self, *args, **options):
+        result = warm_up()
+        self.stdout.write(self.style.SUCCESS(
+            'URL {urls} 件・テンプレート {templates} 件・店舗 {stores} 件を読み込みました。'.format(**result)
+        ))
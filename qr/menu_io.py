@@ -0,0 +1,393 @@
+"""メニューのExcel取り込み・書き出し
+
+1行に1メニュー（メニュー名が空の行はカテゴリだけの行）のシートを読み、今のメニューとの差分を
+bulk_create / bulk_update でまとめて反映する。メニューが数百件あってもクエリは数回で済む。
+
+    rows = read_menu_workbook(file)         # シートを読む（不正な行があれば MenuImportError）
+    diff = compute_menu_diff(store, rows)   # 差分を計算（DBは変更しない）
+    apply_menu_diff(store, diff)            # 差分を反映
+
+注文履歴（OrderItem）はメニューを参照しているので、シートにないメニューは削除せず
+提供停止にする（disable_missing=True の場合）。
+
+カテゴリは「カテゴリID」列があれば ID で、なければ名前で対応付ける（同じ名前のカテゴリが
+複数ある場合は ID が必要）。ID のある行のカテゴリ名が変わっていれば、カテゴリ名を変更する。
+
+openpyxl は読み込みに時間がかかるので、取り込み・書き出しの時に読み込む。
+"""
+import tempfile
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caches import invalidate_menu_cache
+from .models import MenuCategory, MenuItem
+
+SHEET_TITLE = 'メニュー'
+
+# (キー, 見出し)
+COLUMNS = [
+    ('id', 'ID'),
+    ('category_id', 'カテゴリID'),
+    ('category', 'カテゴリ'),
+    ('category_order', 'カテゴリ表示順'),
+    ('name', 'メニュー名'),
+    ('reading', '読み'),
+    ('description', '説明'),
+    ('price', '価格'),
+    ('stock', '在庫数'),
+    ('is_available', '提供可能'),
+    ('order', '表示順'),
+]
+COLUMN_LABELS = dict(COLUMNS)
+REQUIRED_COLUMNS = ['category', 'name', 'price']
+
+# シートの値で更新するメニューのフィールド（REQUIRED_COLUMNS 以外は列がなければ変更しない）
+ITEM_FIELDS = ['name', 'reading', 'description', 'price', 'stock', 'is_available', 'order']
+OPTIONAL_ITEM_FIELDS = [field for field in ITEM_FIELDS if field not in REQUIRED_COLUMNS]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'はい', '○', '◯', '可'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'いいえ', '×', '✕', '不可'}
+
+# 取り込めるシートの最大行数
+MAX_ROWS = 5000
+
+
+class MenuImportError(Exception):
+    """シートの内容が不正（errors に行ごとのメッセージを持つ）"""
+
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _integer(value, label, errors, row_number, default=None):
+    text = _text(value)
+    if not text:
+        return default
+    try:
+        number = int(float(text))
+    except ValueError:
+        errors.append(f'{row_number}行目: {label}は数値で入力してください（{text}）')
+        return default
+    if number < 0:
+        errors.append(f'{row_number}行目: {label}は0以上で入力してください（{text}）')
+        return default
+    return number
+
+
+def _boolean(value, label, errors, row_number):
+    """○/× の値（空欄の場合は None）"""
+    if isinstance(value, bool):
+        return value
+    text = _text(value).lower()
+    if not text:
+        return None
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    errors.append(f'{row_number}行目: {label}は「○」か「×」で入力してください（{text}）')
+    return None
+
+
+def read_menu_workbook(file):
+    """Excelファイルを読んで行のリストを返す
+
+    各行は {'row': 行番号, 'id', 'category', 'category_order', 'name', ...} の dict。
+    メニュー名が空の行はカテゴリだけの行（name が空文字）。
+    """
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except Exception:
+        raise MenuImportError(['Excelファイル（.xlsx）を読み込めませんでした。'])
+
+    try:
+        sheet = workbook[SHEET_TITLE] if SHEET_TITLE in workbook.sheetnames else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        labels = {label: key for key, label in COLUMNS}
+        positions = {}
+        for index, value in enumerate(header):
+            key = labels.get(_text(value))
+            if key and key not in positions:
+                positions[key] = index
+        missing = [label for key, label in COLUMNS if key in REQUIRED_COLUMNS and key not in positions]
+        if missing:
+            raise MenuImportError([f'1行目に見出し「{label}」がありません。' for label in missing])
+
+        errors = []
+        parsed = []
+        for row_number, values in enumerate(rows, start=2):
+            if row_number - 1 > MAX_ROWS:
+                raise MenuImportError([f'取り込めるのは{MAX_ROWS}行までです。'])
+            raw = {key: values[index] if index < len(values) else None for key, index in positions.items()}
+            if not any(_text(value) for value in raw.values()):
+                continue
+
+            row = {
+                'row': row_number,
+                'id': _integer(raw.get('id'), 'ID', errors, row_number),
+                'category_id': _integer(raw.get('category_id'), 'カテゴリID', errors, row_number),
+                'category': _text(raw.get('category'))[:100],
+                'category_order': _integer(raw.get('category_order'), 'カテゴリ表示順', errors, row_number),
+                'name': _text(raw.get('name'))[:100],
+                'reading': _text(raw.get('reading'))[:200],
+                'description': _text(raw.get('description')),
+                'price': _integer(raw.get('price'), '価格', errors, row_number),
+                'stock': _integer(raw.get('stock'), '在庫数', errors, row_number),
+                'is_available': _boolean(raw.get('is_available'), '提供可能', errors, row_number),
+                'order': _integer(raw.get('order'), '表示順', errors, row_number, default=0),
+            }
+            if not row['category']:
+                errors.append(f'{row_number}行目: カテゴリを入力してください')
+            if row['name'] and not _text(raw.get('price')):
+                errors.append(f'{row_number}行目: 価格を入力してください')
+            for key in OPTIONAL_ITEM_FIELDS:
+                if key not in positions:
+                    del row[key]
+            parsed.append(row)
+    finally:
+        workbook.close()
+
+    if errors:
+        raise MenuImportError(errors)
+    return parsed
+
+
+class MenuDiff:
+    """メニューの差分"""
+
+    def __init__(self):
+        self.create_categories = []  # MenuCategory（未保存）
+        self.update_categories = []  # MenuCategory（変更済み）
+        self.create_items = []  # (MenuCategory, MenuItem（未保存、category は未設定）)
+        self.update_items = []  # (MenuItem（変更済み）, 変更したフィールド)
+        self.disable_items = []  # 提供停止にする MenuItem
+        self.changes = []  # 画面表示用 (操作, カテゴリ名, メニュー名, 変更内容)
+
+    @property
+    def has_changes(self):
+        return any([self.create_categories, self.update_categories, self.create_items, self.update_items, self.disable_items])
+
+    def summary(self):
+        return {
+            'create_categories': len(self.create_categories),
+            'update_categories': len(self.update_categories),
+            'create_items': len(self.create_items),
+            'update_items': len(self.update_items),
+            'disable_items': len(self.disable_items),
+        }
+
+
+def compute_menu_diff(store, rows, disable_missing=False):
+    """シートの行と店舗の今のメニューの差分を計算（DBは変更しない）
+
+    メニューは ID 列があれば ID で、なければ（カテゴリ, メニュー名）で既存のものと対応付ける。
+    提供可能が空欄のメニューは今の値のまま（新しいメニューは提供可能）。
+    """
+    categories = {category.id: category for category in MenuCategory.objects.filter(store=store)}
+    categories_by_name = {}
+    for category in categories.values():
+        categories_by_name.setdefault(category.name, []).append(category)
+    items = {item.id: item for item in MenuItem.objects.filter(store=store).select_related('category')}
+    items_by_key = {(item.category_id, item.name): item for item in items.values()}
+
+    diff = MenuDiff()
+    errors = []
+    new_categories = {}
+    updated_category_ids = set()
+    renamed_category_ids = {}
+    seen_item_ids = set()
+    seen_keys = set()
+
+    for row in rows:
+        # カテゴリ
+        category_id = row.get('category_id')
+        if category_id is not None:
+            category = categories.get(category_id)
+            if category is None:
+                errors.append(f'{row["row"]}行目: カテゴリID {category_id} のカテゴリが見つかりません（新しいカテゴリはカテゴリIDを空欄にしてください）')
+                continue
+            if category.name != row['category']:
+                if renamed_category_ids.setdefault(category.pk, row['category']) != row['category']:
+                    errors.append(f'{row["row"]}行目: カテゴリID {category_id} のカテゴリ名が他の行と違います')
+                    continue
+                diff.changes.append(('カテゴリ変更', row['category'], '', f'カテゴリ名: {category.name} → {row["category"]}'))
+                category.name = row['category']
+                if category.pk not in updated_category_ids:
+                    updated_category_ids.add(category.pk)
+                    diff.update_categories.append(category)
+        else:
+            matches = categories_by_name.get(row['category'], [])
+            if len(matches) > 1:
+                errors.append(f'{row["row"]}行目: 「{row["category"]}」という名前のカテゴリが複数あります（カテゴリIDを入力してください）')
+                continue
+            category = matches[0] if matches else new_categories.get(row['category'])
+        if category is None:
+            category = MenuCategory(store=store, name=row['category'], order=row['category_order'] or 0)
+            new_categories[category.name] = category
+            diff.create_categories.append(category)
+            diff.changes.append(('カテゴリ追加', category.name, '', ''))
+        elif row['category_order'] is not None and category.order != row['category_order']:
+            if category.pk:
+                diff.changes.append(('カテゴリ変更', category.name, '', f'表示順: {category.order} → {row["category_order"]}'))
+                if category.pk not in updated_category_ids:
+                    updated_category_ids.add(category.pk)
+                    diff.update_categories.append(category)
+            category.order = row['category_order']
+
+        if not row['name']:
+            continue
+
+        # 追加するカテゴリはまだ ID がないので名前で区別する（既存のカテゴリと同じ名前にはならない）
+        key = (category.pk or ('new', category.name), row['name'])
+        if key in seen_keys:
+            errors.append(f'{row["row"]}行目: 「{row["category"]}」の「{row["name"]}」が重複しています')
+            continue
+        seen_keys.add(key)
+
+        if row['id'] is not None:
+            item = items.get(row['id'])
+            if item is None:
+                errors.append(f'{row["row"]}行目: ID {row["id"]} のメニューが見つかりません（新しいメニューはIDを空欄にしてください）')
+                continue
+        else:
+            item = items_by_key.get(key)
+
+        # シートにない列・空欄の提供可能は変更しない（新しいメニューはモデルの既定値）
+        values = {field: row[field] for field in ITEM_FIELDS if field in row}
+        if values.get('is_available', False) is None:
+            del values['is_available']
+        if item is None:
+            new_item = MenuItem(store=store, **values)
+            diff.create_items.append((category, new_item))
+            diff.changes.append(('メニュー追加', row['category'], row['name'], f'{row["price"]}円'))
+            continue
+
+        if item.id in seen_item_ids:
+            errors.append(f'{row["row"]}行目: ID {item.id} のメニューが重複しています')
+            continue
+        seen_item_ids.add(item.id)
+
+        changed = []
+        if category.pk is None or item.category_id != category.pk:
+            changed.append(('category', f'カテゴリ: {item.category.name} → {row["category"]}'))
+            item.category = category
+        for field, value in values.items():
+            if getattr(item, field) != value:
+                label = COLUMN_LABELS[field]
+                changed.append((field, f'{label}: {getattr(item, field)} → {value}'))
+                setattr(item, field, value)
+        if changed:
+            diff.update_items.append((item, [field for field, _ in changed]))
+            diff.changes.append(('メニュー変更', row['category'], row['name'], '、'.join(text for _, text in changed)))
+
+    if errors:
+        raise MenuImportError(errors)
+
+    if disable_missing:
+        for item in items.values():
+            if item.id not in seen_item_ids and item.is_available:
+                item.is_available = False
+                diff.disable_items.append(item)
+                diff.changes.append(('提供停止', item.category.name, item.name, 'シートにないメニュー'))
+    return diff
+
+
+def apply_menu_diff(store, diff):
+    """差分を1トランザクションで反映し、メニューのキャッシュを1回だけ破棄する"""
+    now = timezone.now()
+    with transaction.atomic():
+        if diff.update_categories:
+            MenuCategory.objects.bulk_update(diff.update_categories, ['name', 'order'])
+        if diff.create_categories:
+            existing_ids = list(MenuCategory.objects.filter(store=store).values_list('id', flat=True))
+            MenuCategory.objects.bulk_create(diff.create_categories)
+            missing = [category for category in diff.create_categories if category.pk is None]
+            if missing:
+                # 追加したカテゴリのIDはDBによっては bulk_create で返らないので取り直す
+                # （追加したカテゴリは既存のカテゴリと名前が重複しない）
+                category_ids = dict(
+                    MenuCategory.objects.filter(store=store, name__in=[category.name for category in missing])
+                    .exclude(id__in=existing_ids).values_list('name', 'id')
+                )
+                for category in missing:
+                    category.pk = category_ids[category.name]
+
+        if diff.create_items:
+            new_items = []
+            for category, item in diff.create_items:
+                item.category = category
+                new_items.append(item)
+            MenuItem.objects.bulk_create(new_items)
+
+        for item, _ in diff.update_items:
+            # 追加したカテゴリに移したメニュー（カテゴリのIDが決まったので設定し直す）
+            item.category = item.category
+        updated_items = [item for item, _ in diff.update_items] + diff.disable_items
+        if updated_items:
+            fields = {'updated_at'}
+            for _, changed in diff.update_items:
+                fields.update(changed)
+            if diff.disable_items:
+                fields.add('is_available')
+            for item in updated_items:
+                item.updated_at = now
+            MenuItem.objects.bulk_update(updated_items, sorted(fields))
+
+        # bulk_create / bulk_update ではシグナルが送られないのでここで破棄する
+        transaction.on_commit(lambda: invalidate_menu_cache(store.id))
+    return diff.summary()
+
+
+def write_menu_workbook(store):
+    """店舗のメニューをExcelファイルに書き出す（一時ファイルを返す）
+
+    書き込み専用モードで1行ずつ書くので、メニューが多くてもメモリは一定。
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_TITLE)
+    sheet.append([label for _, label in COLUMNS])
+
+    categories_with_items = set()
+    items = (
+        MenuItem.objects.filter(store=store)
+        .select_related('category')
+        .order_by('category__order', 'category__name', 'order', 'name')
+    )
+    for item in items.iterator():
+        categories_with_items.add(item.category_id)
+        sheet.append([
+            item.id,
+            item.category_id,
+            item.category.name,
+            item.category.order,
+            item.name,
+            item.reading,
+            item.description,
+            item.price,
+            item.stock,
+            '○' if item.is_available else '×',
+            item.order,
+        ])
+    # メニューのないカテゴリはカテゴリだけの行にする
+    for category in MenuCategory.objects.filter(store=store).exclude(id__in=categories_with_items):
+        sheet.append([None, category.id, category.name, category.order] + [None] * (len(COLUMNS) - 4))
+
+    output = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    workbook.save(output)
+    output.seek(0)
+    return output
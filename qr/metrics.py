@@ -0,0 +1,372 @@
+"""動作状況のメトリクス（Prometheus のテキスト形式で /metrics から返す）
+
+注文数・処理時間・キャッシュのヒット数などはプロセス内のメモリで集計する（記録のたびに
+DBへはアクセスしない）。gunicorn でワーカーを複数起動する場合は settings.METRICS['DIR'] を
+指定すると、各ワーカーが FLUSH_INTERVAL 秒ごとに自分の集計値を DIR/<pid>.json に書き出し、
+/metrics は全プロセスのファイルを合計して返す。書き出しのスレッドはワーカーの起動時に start_flusher() で
+起動し、DIR はサーバーの起動時に空にすること（どちらも gunicorn.conf.py で行っている）。
+マスタープロセス（preload_app でアプリを読み込む）は書き出さない。
+
+未完了の注文数やタスクキューの待ち数はDBから集計するが、GAUGE_TTL 秒の間はキャッシュした値を返す
+（スクレイプのたびにDBを走査しない）。
+
+    ORDERS_SUBMITTED.inc(result='success')
+    SUBMIT_ORDER_SECONDS.observe(0.12)
+"""
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.db.utils import OperationalError
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # 複数プロセスの値を合計するためのディレクトリ（None の場合はこのプロセスの値だけを返す）
+    'DIR': None,
+    # 指定した場合は Authorization: Bearer <TOKEN> が必要（未指定の場合はサーバー自身からのみ許可）
+    'TOKEN': None,
+    'FLUSH_INTERVAL': 5,  # 秒
+    'GAUGE_TTL': 15,  # 秒
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DB_GAUGES_KEY = 'metrics:db_gauges'
+
+
+def get_metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+# メトリクス名 -> メトリクス
+_registry = {}
+_lock = threading.Lock()
+
+
+class Metric:
+    """ラベルごとの値を持つメトリクス"""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # ラベルの値のタプル -> 値
+        _registry[name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} のラベルは {self.labelnames} です: {sorted(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self):
+        """書き出し用の値 {ラベルの値のJSON: 値}"""
+        with _lock:
+            return {json.dumps(key): self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    """増えるだけの値"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not get_metrics_settings()['ENABLED']:
+            return
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _mark_dirty()
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """処理時間などの分布（バケットごとの件数・合計・件数）"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not get_metrics_settings()['ENABLED']:
+            return
+        key = self._key(labels)
+        with _lock:
+            # [バケットごとの件数..., 合計, 件数]
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[index] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+        _mark_dirty()
+
+    def _copy(self, value):
+        return list(value)
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, values):
+        for key, data in values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, data[-1]
+            yield f'{self.name}_sum', labels, data[-2]
+            yield f'{self.name}_count', labels, data[-1]
+
+
+def timed(histogram, **labels):
+    """関数（同期・非同期）の処理時間を記録するデコレータ"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+# メトリクスの定義
+
+ORDERS_SUBMITTED = Counter('qr_orders_submitted_total', '注文送信の件数（結果別）', ['result'])
+SUBMIT_ORDER_SECONDS = Histogram('qr_submit_order_seconds', '注文送信の処理時間（秒）')
+KITCHEN_POLLS = Counter('qr_kitchen_polls_total', '厨房画面の表示・更新の回数', ['view'])
+CACHE_REQUESTS = Counter('qr_cache_requests_total', 'キャッシュの参照回数（hit / miss）', ['cache', 'result'])
+TABLE_TOKEN_REJECTED = Counter('qr_table_token_rejected_total', 'テーブルのトークンが不正で拒否した回数', ['view'])
+DB_WRITE_SECONDS = Histogram(
+    'qr_db_write_seconds', 'DBへの書き込みにかかった時間（秒）。SQLiteではロック待ちの時間を含む',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5),
+)
+DB_LOCK_ERRORS = Counter('qr_db_lock_errors_total', 'DBのロック待ちがタイムアウトした回数（database is locked）')
+
+
+def record_cache(name, hit):
+    """キャッシュの参照結果を記録"""
+    CACHE_REQUESTS.inc(cache=name, result='hit' if hit else 'miss')
+
+
+def reset_metrics():
+    """このプロセスの集計値を消す（fork する前に記録した値をワーカーに引き継がないように）"""
+    with _lock:
+        for metric in _registry.values():
+            metric._values.clear()
+    _dirty.clear()
+
+
+# DBの書き込み時間
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def _db_write_wrapper(execute, sql, params, many, context):
+    if not sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError as e:
+        if 'locked' in str(e):
+            DB_LOCK_ERRORS.inc()
+        raise
+    finally:
+        DB_WRITE_SECONDS.observe(time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def install_db_metrics(sender, connection, **kwargs):
+    """DB接続ごとに書き込み時間の計測を組み込む"""
+    if get_metrics_settings()['ENABLED'] and _db_write_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_write_wrapper)
+
+
+# 複数プロセスの集計
+
+_dirty = threading.Event()
+_flusher_pid = None
+
+
+def _mark_dirty():
+    _dirty.set()
+
+
+def start_flusher():
+    """書き出し用のスレッドを起動（gunicorn の post_fork でワーカーごとに呼ぶ）
+
+    fork 後のプロセスにはスレッドが引き継がれないので、ワーカーのプロセスで起動する。
+    リクエストを受けないマスタープロセスで起動すると、マスターの値も合計されてしまう。
+    """
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='metrics-flusher', daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(get_metrics_settings()['FLUSH_INTERVAL'])
+        if _dirty.is_set():
+            try:
+                flush()
+            except OSError as e:
+                logger.warning('メトリクスの書き出しに失敗しました: %s', e)
+
+
+def _process_file(directory, pid=None):
+    return os.path.join(directory, f'{pid or os.getpid()}.json')
+
+
+def flush():
+    """このプロセスの集計値をファイルに書き出す"""
+    directory = get_metrics_settings()['DIR']
+    if not directory:
+        return
+    _dirty.clear()
+    data = {name: metric.dump() for name, metric in _registry.items()}
+    os.makedirs(directory, exist_ok=True)
+    path = _process_file(directory)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def collect():
+    """全プロセスの集計値を合計 {メトリクス名: {ラベルの値のタプル: 値}}"""
+    directory = get_metrics_settings()['DIR']
+    if not directory:
+        return {
+            name: {tuple(json.loads(key)): value for key, value in metric.dump().items()}
+            for name, metric in _registry.items()
+        }
+
+    flush()
+    totals = {name: {} for name in _registry}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # 書き込み中のファイルは次のスクレイプで読む
+            continue
+        for name, values in data.items():
+            metric = _registry.get(name)
+            if metric is None:
+                continue
+            for key, value in values.items():
+                key = tuple(json.loads(key))
+                totals[name][key] = metric.merge(totals[name].get(key), value)
+    return totals
+
+
+# DBから集計する値
+
+def collect_db_gauges():
+    """未完了の注文数とタスクキューの件数（GAUGE_TTL 秒の間はキャッシュした値を返す）"""
+    gauges = cache.get(DB_GAUGES_KEY)
+    if gauges is None:
+        from django.db.models import Count
+        from .models import Order, Task
+
+        open_orders = dict(
+            Order.objects.filter(status__in=Order.OPEN_STATUSES)
+            .values_list('status').annotate(count=Count('id')).order_by()
+        )
+        tasks = dict(
+            Task.objects.exclude(status='succeeded')
+            .values_list('status').annotate(count=Count('id')).order_by()
+        )
+        gauges = {
+            'open_orders': {status: open_orders.get(status, 0) for status in Order.OPEN_STATUSES},
+            'tasks': {status: tasks.get(status, 0) for status in ['queued', 'running', 'failed']},
+        }
+        cache.set(DB_GAUGES_KEY, gauges, get_metrics_settings()['GAUGE_TTL'])
+    return gauges
+
+
+# テキスト形式への変換
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f'{name}{{{label_text}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
+
+
+def render_metrics():
+    """Prometheus のテキスト形式で全メトリクスを返す"""
+    lines = []
+    totals = collect()
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for sample in metric.samples(totals.get(name, {})):
+            lines.append(_format_sample(*sample))
+
+    gauges = collect_db_gauges()
+    lines.append('# HELP qr_open_orders 未完了の注文数（ステータス別）')
+    lines.append('# TYPE qr_open_orders gauge')
+    for status, count in gauges['open_orders'].items():
+        lines.append(_format_sample('qr_open_orders', {'status': status}, count))
+    lines.append('# HELP qr_tasks バックグラウンドタスクの件数（ステータス別）')
+    lines.append('# TYPE qr_tasks gauge')
+    for status, count in gauges['tasks'].items():
+        lines.append(_format_sample('qr_tasks', {'status': status}, count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,42 @@
+"""ミドルウェア"""
+import asyncio
+
+from django.core.exceptions import DisallowedHost
+from django.http.request import split_domain_port
+from django.utils.decorators import sync_and_async_middleware
+
+from .config import aget_allowed_hosts, get_allowed_hosts, is_allowed_host
+
+
+def _is_allowed(request, allowed_hosts):
+    domain, port = split_domain_port(request._get_raw_host())
+    return is_allowed_host(domain, allowed_hosts)
+
+
+def _reject(request):
+    raise DisallowedHost(f'Invalid HTTP_HOST header: {request._get_raw_host()!r}.')
+
+
+@sync_and_async_middleware
+def allowed_hosts_middleware(get_response):
+    """HTTP_HOST の検証（ALLOWED_HOSTS の代わり）
+
+    サーバーIPは config.json と店舗設定から読むので、IPを変更しても再起動せずに反映される。
+    settings.ALLOWED_HOSTS は '*' にしておき、このミドルウェアを最初に置くこと。
+    サーバーIPはプロセス内に数秒保持するので、許可されていないホスト名の場合だけ読み直してから拒否する
+    （サーバーIPを変更した直後に、新しいIPへのリクエストを拒否しないように）。
+    読み直すのはプロセスごとに数秒に1回までで、それ以外は保持している値だけで拒否する。
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not _is_allowed(request, await aget_allowed_hosts()):
+                if not _is_allowed(request, await aget_allowed_hosts(refresh=True)):
+                    _reject(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            if not _is_allowed(request, get_allowed_hosts()):
+                if not _is_allowed(request, get_allowed_hosts(refresh=True)):
+                    _reject(request)
+            return get_response(request)
+    return middleware
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='is_settled',
+            field=models.BooleanField(default=False, help_text='会計済みフラグ'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['table', 'status'], name='qr_order_table_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0002_order_is_settled_table_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='stock',
+            field=models.PositiveIntegerField(blank=True, help_text='在庫数（空欄の場合は在庫管理しない）', null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0003_menuitem_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='status',
+            field=models.CharField(choices=[('waiting', '未調理'), ('preparing', '調理中'), ('prepared', '調理済み')], default='waiting', help_text='調理状況', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['menu_item', 'status'], name='qr_orderitem_menu_status_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0004_orderitem_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketTimeStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', '1時間'), ('day', '1日')], max_length=10)),
+                ('period_start', models.DateTimeField(help_text='集計期間の開始日時')),
+                ('metric', models.CharField(choices=[('confirm', '確認までの時間'), ('cook', '調理時間'), ('deliver', '提供までの時間'), ('total', '注文から提供までの時間')], max_length=20)),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('p50', models.FloatField(help_text='中央値（秒）')),
+                ('p90', models.FloatField(help_text='90パーセンタイル（秒）')),
+                ('p95', models.FloatField(help_text='95パーセンタイル（秒）')),
+                ('max_seconds', models.FloatField(help_text='最大（秒）')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('menu_item', models.ForeignKey(blank=True, help_text='空の場合は全メニュー', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ticket_time_stats', to='qr.menuitem')),
+            ],
+            options={
+                'verbose_name': '提供時間の集計',
+                'verbose_name_plural': '提供時間の集計',
+                'ordering': ['period_start', 'metric'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderStatusTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, choices=[('pending', '受注待ち'), ('confirmed', '確認済み'), ('preparing', '調理中'), ('ready', '準備完了'), ('delivered', '提供済み'), ('cancelled', 'キャンセル')], help_text='変更前のステータス（新規注文は空）', max_length=20)),
+                ('to_status', models.CharField(choices=[('pending', '受注待ち'), ('confirmed', '確認済み'), ('preparing', '調理中'), ('ready', '準備完了'), ('delivered', '提供済み'), ('cancelled', 'キャンセル')], help_text='変更後のステータス', max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='このステータスになった日時')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='qr.order')),
+            ],
+            options={
+                'verbose_name': '注文ステータス履歴',
+                'verbose_name_plural': '注文ステータス履歴',
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tickettimestat',
+            index=models.Index(fields=['granularity', 'period_start'], name='qr_ticket_stat_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tickettimestat',
+            constraint=models.UniqueConstraint(fields=('granularity', 'period_start', 'menu_item', 'metric'), name='qr_ticket_time_stat_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatustransition',
+            index=models.Index(fields=['order', 'created_at'], name='qr_transition_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatustransition',
+            index=models.Index(fields=['created_at'], name='qr_transition_created_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0005_order_status_transition_ticket_time_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='タスク名（qr/tasks.py に登録した名前）', max_length=100)),
+                ('kwargs', models.JSONField(blank=True, default=dict, help_text='タスクの引数')),
+                ('status', models.CharField(choices=[('queued', '待機中'), ('running', '実行中'), ('succeeded', '完了'), ('failed', '失敗')], default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='実行回数')),
+                ('max_attempts', models.PositiveIntegerField(default=3, help_text='最大実行回数')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, help_text='この日時以降に実行する')),
+                ('result', models.JSONField(blank=True, help_text='実行結果', null=True)),
+                ('last_error', models.TextField(blank=True, help_text='最後に発生したエラー')),
+                ('locked_by', models.CharField(blank=True, help_text='実行中のワーカー', max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'バックグラウンドタスク',
+                'verbose_name_plural': 'バックグラウンドタスク',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'run_at'], name='qr_task_status_run_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['name', 'status'], name='qr_task_name_status_idx'),
+        ),
+    ]
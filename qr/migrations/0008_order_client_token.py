@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0007_order_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='client_token',
+            field=models.CharField(blank=True, help_text='注文画面が発行する送信ID（再送時の二重注文防止）', max_length=64, null=True, unique=True),
+        ),
+    ]
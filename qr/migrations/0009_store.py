@@ -0,0 +1,64 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0008_order_client_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Store',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='店舗名', max_length=100)),
+                ('slug', models.SlugField(help_text='URLに使う店舗ID（例: shibuya）', unique=True)),
+                ('is_active', models.BooleanField(default=True, help_text='有効フラグ')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '店舗',
+                'verbose_name_plural': '店舗',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='table',
+            name='table_number',
+            field=models.IntegerField(help_text='テーブル番号（店舗内で一意）'),
+        ),
+        migrations.AddField(
+            model_name='menucategory',
+            name='store',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='menu_categories', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='store',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='menu_items', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='store',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='storesettings',
+            name='store',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='settings', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='table',
+            name='store',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tables', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='tickettimestat',
+            name='store',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ticket_time_stats', to='qr.store'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def assign_default_store(apps, schema_editor):
+    """既存のデータを既定の店舗に割り当てる"""
+    Store = apps.get_model('qr', 'Store')
+    StoreSettings = apps.get_model('qr', 'StoreSettings')
+    Table = apps.get_model('qr', 'Table')
+    MenuCategory = apps.get_model('qr', 'MenuCategory')
+    MenuItem = apps.get_model('qr', 'MenuItem')
+    Order = apps.get_model('qr', 'Order')
+    TicketTimeStat = apps.get_model('qr', 'TicketTimeStat')
+
+    has_data = any(model.objects.exists() for model in [StoreSettings, Table, MenuCategory, MenuItem, Order, TicketTimeStat])
+    if not has_data:
+        return
+
+    store, _ = Store.objects.get_or_create(slug='default', defaults={'name': '店舗'})
+    # 店舗設定はもともと1件だけ使っていたので、最初の1件を既定の店舗に割り当てる
+    first_settings = StoreSettings.objects.filter(store__isnull=True).order_by('id').first()
+    if first_settings is not None:
+        first_settings.store = store
+        first_settings.save(update_fields=['store'])
+        StoreSettings.objects.filter(store__isnull=True).delete()
+    for model in [Table, MenuCategory, MenuItem, Order, TicketTimeStat]:
+        model.objects.filter(store__isnull=True).update(store=store)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0009_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_default_store, migrations.RunPython.noop),
+    ]
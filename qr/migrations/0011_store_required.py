@@ -0,0 +1,76 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0010_default_store'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='tickettimestat',
+            name='qr_ticket_time_stat_unique',
+        ),
+        migrations.RemoveIndex(
+            model_name='tickettimestat',
+            name='qr_ticket_stat_period_idx',
+        ),
+        migrations.AlterField(
+            model_name='menucategory',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='menu_categories', to='qr.store'),
+        ),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='menu_items', to='qr.store'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='qr.store'),
+        ),
+        migrations.AlterField(
+            model_name='storesettings',
+            name='store',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='settings', to='qr.store'),
+        ),
+        migrations.AlterField(
+            model_name='table',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tables', to='qr.store'),
+        ),
+        migrations.AlterField(
+            model_name='tickettimestat',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_time_stats', to='qr.store'),
+        ),
+        migrations.AddIndex(
+            model_name='menucategory',
+            index=models.Index(fields=['store', 'is_active', 'order'], name='qr_category_store_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['store', 'is_available'], name='qr_menuitem_store_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['store', 'status', 'created_at'], name='qr_order_store_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tickettimestat',
+            index=models.Index(fields=['store', 'granularity', 'period_start'], name='qr_ticket_stat_store_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='table',
+            constraint=models.UniqueConstraint(fields=('store', 'table_number'), name='qr_table_store_number_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='tickettimestat',
+            constraint=models.UniqueConstraint(fields=('store', 'granularity', 'period_start', 'menu_item', 'metric'), name='qr_ticket_time_stat_store_unique'),
+        ),
+    ]
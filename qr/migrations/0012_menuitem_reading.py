@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0011_store_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='reading',
+            field=models.CharField(blank=True, help_text='読み（ひらがな。注文画面の検索用）', max_length=200),
+        ),
+    ]
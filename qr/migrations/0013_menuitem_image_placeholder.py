@@ -0,0 +1,33 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0012_menuitem_reading'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, help_text='画像の読み込み中に表示する縮小画像'),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='image',
+            field=models.ImageField(blank=True, height_field='image_height', null=True, upload_to='menu_images/', width_field='image_width'),
+        ),
+    ]
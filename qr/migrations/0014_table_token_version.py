@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0013_menuitem_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='token_version',
+            field=models.PositiveIntegerField(default=1, help_text='QRコードのトークンのバージョン（上げると発行済みのQRコードが使えなくなる）'),
+        ),
+    ]
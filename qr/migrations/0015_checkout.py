@@ -0,0 +1,82 @@
+# Generated by Django 4.1.2 on 2026-10-18 23:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0014_table_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(help_text='会計金額')),
+                ('order_count', models.PositiveIntegerField(help_text='注文件数')),
+                ('item_count', models.PositiveIntegerField(help_text='品数（数量の合計）')),
+                ('split_method', models.CharField(choices=[('none', '一括'), ('even', '均等割り'), ('item', '品目ごと')], default='none', max_length=10)),
+                ('lines', models.JSONField(default=list)),
+                ('payments', models.JSONField(default=list)),
+                ('settled_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': '会計',
+                'verbose_name_plural': '会計',
+                'ordering': ['-settled_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='営業日')),
+                ('checkout_count', models.PositiveIntegerField(default=0, help_text='会計件数')),
+                ('order_count', models.PositiveIntegerField(default=0, help_text='注文件数')),
+                ('item_count', models.PositiveIntegerField(default=0, help_text='品数')),
+                ('total_amount', models.PositiveIntegerField(default=0, help_text='売上金額')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '日別売上',
+                'verbose_name_plural': '日別売上',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('is_settled', False)), fields=['table', 'status'], name='qr_order_unsettled_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailysalesrollup',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='checkout',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkouts', to='qr.store'),
+        ),
+        migrations.AddField(
+            model_name='checkout',
+            name='table',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkouts', to='qr.table'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='checkout',
+            field=models.ForeignKey(blank=True, help_text='会計（会計済みの場合）', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='qr.checkout'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(fields=('store', 'date'), name='qr_daily_sales_store_date_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(fields=['store', 'settled_at'], name='qr_checkout_store_settled_idx'),
+        ),
+    ]
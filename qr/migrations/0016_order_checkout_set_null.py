@@ -0,0 +1,19 @@
+# Generated by Django 4.1.2 on 2026-10-19 00:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0015_checkout'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='checkout',
+            field=models.ForeignKey(blank=True, help_text='会計（会計済みの場合）', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='qr.checkout'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 00:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0016_order_checkout_set_null'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='menuitem',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='menu_images/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.2 on 2026-10-19 00:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0017_menuitem_image_without_dimension_fields'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='qr_order_table_status_idx',
+        ),
+    ]
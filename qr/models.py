@@ -1,8 +1,24 @@
 from django.db import models
 from django.utils import timezone
 
+class Store(models.Model):
+    """店舗（テーブル・メニュー・注文は店舗ごとに分かれる）"""
+    name = models.CharField(max_length=100, help_text="店舗名")
+    slug = models.SlugField(max_length=50, unique=True, help_text="URLに使う店舗ID（例: shibuya）")
+    is_active = models.BooleanField(default=True, help_text="有効フラグ")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "店舗"
+        verbose_name_plural = "店舗"
+        ordering = ['id']
+    
+    def __str__(self):
+        return self.name
+
 class StoreSettings(models.Model):
     """店舗設定"""
+    store = models.OneToOneField(Store, on_delete=models.CASCADE, related_name='settings')
     password = models.CharField(max_length=255, help_text="ログイン用パスワード")
     wifi_ssid = models.CharField(max_length=255, help_text="WiFiのSSID", null=True, blank=True)# default='StoreWiFi', 
     wifi_password = models.CharField(max_length=255, help_text="WiFiのパスワード", null=True, blank=True)#, default='password'
@@ -26,20 +42,27 @@ class StoreSettings(models.Model):
 
 class Table(models.Model):
     """テーブル情報"""
-    table_number = models.IntegerField(unique=True, help_text="テーブル番号")
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='tables')
+    table_number = models.IntegerField(help_text="テーブル番号（店舗内で一意）")
     is_active = models.BooleanField(default=True, help_text="有効フラグ")
+    token_version = models.PositiveIntegerField(default=1, help_text="QRコードのトークンのバージョン（上げると発行済みのQRコードが使えなくなる）")
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         verbose_name = "テーブル"
         verbose_name_plural = "テーブル"
         ordering = ['table_number']
+        constraints = [
+            # 注文画面のURL（店舗 + テーブル番号）からテーブルを引くためのインデックスも兼ねる
+            models.UniqueConstraint(fields=['store', 'table_number'], name='qr_table_store_number_unique'),
+        ]
     
     def __str__(self):
         return f"テーブル{self.table_number}"
 
 class MenuCategory(models.Model):
     """メニューカテゴリ"""
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='menu_categories')
     name = models.CharField(max_length=100, help_text="カテゴリ名")
     order = models.IntegerField(default=0, help_text="表示順")
     is_active = models.BooleanField(default=True)
@@ -49,18 +72,31 @@ class MenuCategory(models.Model):
         verbose_name = "メニューカテゴリ"
         verbose_name_plural = "メニューカテゴリ"
         ordering = ['order', 'name']
+        indexes = [
+            models.Index(fields=['store', 'is_active', 'order'], name='qr_category_store_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
 class MenuItem(models.Model):
     """メニュー項目"""
+    # 店舗はカテゴリの店舗と同じ（店舗単位で引くために持たせている）
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='menu_items')
     category = models.ForeignKey(MenuCategory, on_delete=models.CASCADE, related_name='items')
     name = models.CharField(max_length=100, help_text="メニュー名")
+    reading = models.CharField(max_length=200, blank=True, help_text="読み（ひらがな。注文画面の検索用）")
     description = models.TextField(blank=True, help_text="説明")
     price = models.PositiveIntegerField(help_text="価格（円）")
     image = models.ImageField(upload_to='menu_images/', blank=True, null=True)
+    # 画像の大きさはタスク（generate_image_placeholder）で縮小画像と一緒に保存する
+    # （ImageField の width_field / height_field を使うと、値がないメニューを読み込むたびに画像ファイルを開くため）
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # 画像の縮小版（data URI）。画像を変更すると空になり、タスクキューで作り直す
+    image_placeholder = models.TextField(blank=True, editable=False, help_text="画像の読み込み中に表示する縮小画像")
     is_available = models.BooleanField(default=True, help_text="提供可能フラグ")
+    stock = models.PositiveIntegerField(null=True, blank=True, help_text="在庫数（空欄の場合は在庫管理しない）")
     order = models.IntegerField(default=0, help_text="表示順")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -69,9 +105,28 @@ class MenuItem(models.Model):
         verbose_name = "メニュー項目"
         verbose_name_plural = "メニュー項目"
         ordering = ['category__order', 'order', 'name']
+        indexes = [
+            models.Index(fields=['store', 'is_available'], name='qr_menuitem_store_idx'),
+        ]
     
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 画像が変更されたかを save() で判定するため、読み込んだときの画像を覚えておく
+        instance._loaded_image = instance.image.name if 'image' in field_names else None
+        return instance
+    
+    def save(self, *args, **kwargs):
+        if self.category_id is not None:
+            self.store_id = self.category.store_id
+        if self.image.name != getattr(self, '_loaded_image', None):
+            self.image_placeholder = ''
+            self.image_width = self.image_height = None
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
 
 class Order(models.Model):
     """注文"""
@@ -83,11 +138,33 @@ class Order(models.Model):
         ('delivered', '提供済み'),
         ('cancelled', 'キャンセル'),
     ]
+    # 提供未了のステータス
+    OPEN_STATUSES = ['pending', 'confirmed', 'preparing', 'ready']
+    # 会計（伝票）の対象になるステータス（キャンセル以外）
+    TAB_STATUSES = OPEN_STATUSES + ['delivered']
+    # 厨房で調理対象になるステータス
+    KITCHEN_STATUSES = ['pending', 'confirmed', 'preparing']
+    # 提供済み・キャンセル（厨房画面では「完了」の一覧に表示する）
+    FINISHED_STATUSES = ['delivered', 'cancelled']
+    # 許可するステータス遷移（先へ進める・キャンセル・1つ前に戻す・提供済み/キャンセルからのやり直し）
+    STATUS_TRANSITIONS = {
+        'pending': ['confirmed', 'preparing', 'ready', 'delivered', 'cancelled'],
+        'confirmed': ['pending', 'preparing', 'ready', 'delivered', 'cancelled'],
+        'preparing': ['confirmed', 'ready', 'delivered', 'cancelled'],
+        'ready': ['preparing', 'delivered', 'cancelled'],
+        'delivered': ['ready', 'preparing'],
+        'cancelled': ['preparing'],
+    }
     
+    # 店舗はテーブルの店舗と同じ（店舗単位で引くために持たせている）
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='orders')
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='orders')
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='pending')
     total_amount = models.PositiveIntegerField(default=0)
     notes = models.TextField(blank=True, help_text="備考")
+    is_settled = models.BooleanField(default=False, help_text="会計済みフラグ")
+    checkout = models.ForeignKey('Checkout', on_delete=models.SET_NULL, null=True, blank=True, related_name='orders', help_text="会計（会計済みの場合）")
+    client_token = models.CharField(max_length=64, null=True, blank=True, unique=True, help_text="注文画面が発行する送信ID（再送時の二重注文防止）")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -95,10 +172,29 @@ class Order(models.Model):
         verbose_name = "注文"
         verbose_name_plural = "注文"
         ordering = ['-created_at']
+        indexes = [
+            # 管理画面の日付での絞り込み（date_hierarchy）用
+            models.Index(fields=['created_at'], name='qr_order_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='qr_order_status_created_idx'),
+            # 店舗ごとの厨房画面・管理画面用
+            models.Index(fields=['store', 'status', 'created_at'], name='qr_order_store_status_idx'),
+            # テーブル別の未会計の伝票（ホール画面・会計）用。テーブルと状態で引くのは未会計の注文だけなので
+            # 会計済みの注文は含めない（注文が増えても小さいまま）
+            models.Index(fields=['table', 'status'], condition=models.Q(is_settled=False), name='qr_order_unsettled_idx'),
+        ]
     
     def __str__(self):
         return f"注文#{self.id} - テーブル{self.table.table_number}"
     
+    def save(self, *args, **kwargs):
+        if self.table_id is not None and self.store_id is None:
+            self.store_id = self.table.store_id
+        super().save(*args, **kwargs)
+    
+    def can_transition_to(self, status):
+        """指定したステータスに変更できるか"""
+        return status in self.STATUS_TRANSITIONS.get(self.status, [])
+    
     def get_status_display_color(self):
         colors = {
             'pending': 'warning',
@@ -110,21 +206,186 @@ class Order(models.Model):
         }
         return colors.get(self.status, 'secondary')
 
+class OrderStatusTransition(models.Model):
+    """注文ステータスの遷移履歴（追記のみ）"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='transitions')
+    from_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS_CHOICES, blank=True, help_text="変更前のステータス（新規注文は空）")
+    to_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS_CHOICES, help_text="変更後のステータス")
+    created_at = models.DateTimeField(default=timezone.now, help_text="このステータスになった日時")
+    
+    class Meta:
+        verbose_name = "注文ステータス履歴"
+        verbose_name_plural = "注文ステータス履歴"
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='qr_transition_order_idx'),
+            models.Index(fields=['created_at'], name='qr_transition_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"注文#{self.order_id}: {self.from_status or '-'} → {self.to_status}"
+    
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('ステータス履歴は変更できません。')
+        super().save(*args, **kwargs)
+
+class TicketTimeStat(models.Model):
+    """提供時間の集計（compute_ticket_metrics コマンドで事前計算）"""
+    GRANULARITY_CHOICES = [
+        ('hour', '1時間'),
+        ('day', '1日'),
+    ]
+    METRIC_CHOICES = [
+        ('confirm', '確認までの時間'),
+        ('cook', '調理時間'),
+        ('deliver', '提供までの時間'),
+        ('total', '注文から提供までの時間'),
+    ]
+    
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='ticket_time_stats')
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    period_start = models.DateTimeField(help_text="集計期間の開始日時")
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, null=True, blank=True, related_name='ticket_time_stats', help_text="空の場合は全メニュー")
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    sample_count = models.PositiveIntegerField(default=0)
+    p50 = models.FloatField(help_text="中央値（秒）")
+    p90 = models.FloatField(help_text="90パーセンタイル（秒）")
+    p95 = models.FloatField(help_text="95パーセンタイル（秒）")
+    max_seconds = models.FloatField(help_text="最大（秒）")
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "提供時間の集計"
+        verbose_name_plural = "提供時間の集計"
+        ordering = ['period_start', 'metric']
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'granularity', 'period_start', 'menu_item', 'metric'], name='qr_ticket_time_stat_store_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'granularity', 'period_start'], name='qr_ticket_stat_store_idx'),
+        ]
+
 class OrderItem(models.Model):
     """注文項目"""
+    LINE_STATUS_CHOICES = [
+        ('waiting', '未調理'),
+        ('preparing', '調理中'),
+        ('prepared', '調理済み'),
+    ]
+    
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.PositiveIntegerField(help_text="注文時の単価")
     notes = models.TextField(blank=True, help_text="備考")
+    status = models.CharField(max_length=20, choices=LINE_STATUS_CHOICES, default='waiting', help_text="調理状況")
     
     class Meta:
         verbose_name = "注文項目"
         verbose_name_plural = "注文項目"
+        indexes = [
+            # 料理ごとの調理状況をまとめて引くためのインデックス
+            models.Index(fields=['menu_item', 'status'], name='qr_orderitem_menu_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.menu_item.name} x {self.quantity}"
     
     @property
     def total_price(self):
-        return self.unit_price * self.quantity
\ No newline at end of file
+        return self.unit_price * self.quantity
+
+class Checkout(models.Model):
+    """会計（テーブルの未会計の注文をまとめて締める。qr/checkout.py）
+    
+    会計時点の明細と支払いの内訳を保存するので、後からメニューや注文が変わっても金額は変わらない。
+    """
+    SPLIT_CHOICES = [
+        ('none', '一括'),
+        ('even', '均等割り'),
+        ('item', '品目ごと'),
+    ]
+    
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='checkouts')
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='checkouts')
+    total_amount = models.PositiveIntegerField(help_text="会計金額")
+    order_count = models.PositiveIntegerField(help_text="注文件数")
+    item_count = models.PositiveIntegerField(help_text="品数（数量の合計）")
+    split_method = models.CharField(max_length=10, choices=SPLIT_CHOICES, default='none')
+    # 明細 [{'order_item_id', 'name', 'quantity', 'unit_price', 'amount'}]
+    lines = models.JSONField(default=list)
+    # 支払いの内訳 [{'amount': 金額, 'lines': [明細の order_item_id, ...]}]（一括の場合は1件）
+    payments = models.JSONField(default=list)
+    settled_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "会計"
+        verbose_name_plural = "会計"
+        ordering = ['-settled_at']
+        indexes = [
+            models.Index(fields=['store', 'settled_at'], name='qr_checkout_store_settled_idx'),
+        ]
+    
+    def __str__(self):
+        return f"会計#{self.id} - テーブル{self.table.table_number}"
+
+class DailySalesRollup(models.Model):
+    """日ごとの売上（会計のたびに同じトランザクションで加算する）"""
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField(help_text="営業日")
+    checkout_count = models.PositiveIntegerField(default=0, help_text="会計件数")
+    order_count = models.PositiveIntegerField(default=0, help_text="注文件数")
+    item_count = models.PositiveIntegerField(default=0, help_text="品数")
+    total_amount = models.PositiveIntegerField(default=0, help_text="売上金額")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "日別売上"
+        verbose_name_plural = "日別売上"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'date'], name='qr_daily_sales_store_date_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.store} {self.date}"
+
+class Task(models.Model):
+    """バックグラウンドタスク（qr/tasks.py のキューで実行）"""
+    STATUS_CHOICES = [
+        ('queued', '待機中'),
+        ('running', '実行中'),
+        ('succeeded', '完了'),
+        ('failed', '失敗'),
+    ]
+    
+    name = models.CharField(max_length=100, help_text="タスク名（qr/tasks.py に登録した名前）")
+    kwargs = models.JSONField(default=dict, blank=True, help_text="タスクの引数")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0, help_text="実行回数")
+    max_attempts = models.PositiveIntegerField(default=3, help_text="最大実行回数")
+    run_at = models.DateTimeField(default=timezone.now, help_text="この日時以降に実行する")
+    result = models.JSONField(null=True, blank=True, help_text="実行結果")
+    last_error = models.TextField(blank=True, help_text="最後に発生したエラー")
+    locked_by = models.CharField(max_length=100, blank=True, help_text="実行中のワーカー")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "バックグラウンドタスク"
+        verbose_name_plural = "バックグラウンドタスク"
+        ordering = ['-created_at']
+        indexes = [
+            # ワーカーが次のタスクを取り出すためのインデックス
+            models.Index(fields=['status', 'run_at'], name='qr_task_status_run_at_idx'),
+            models.Index(fields=['name', 'status'], name='qr_task_name_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
+    
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
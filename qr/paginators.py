@@ -0,0 +1,38 @@
+"""件数の多い一覧用のページネーター"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# 絞り込みがある場合に数える件数の上限（これ以上は数えない）
+COUNT_LIMIT = 10000
+
+
+def estimate_row_count(model, using='default'):
+    """テーブルのおおよその行数（PostgreSQL の統計情報を使う。取れない場合は None）"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """全件を COUNT しないページネーター
+
+    絞り込みのない一覧ではDBの統計情報の推定件数を使い、絞り込みがある場合は
+    COUNT_LIMIT 件までしか数えない。上限より先の行は一覧の「これより古い」リンク
+    （id によるカーソル）でたどる。
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > COUNT_LIMIT:
+                return estimate
+        return queryset[:COUNT_LIMIT].count()
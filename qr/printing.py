@@ -0,0 +1,186 @@
+"""厨房伝票の印刷
+
+注文送信（submit_order）のトランザクションで印刷タスク（print_ticket）をタスクキューに登録し、
+タスクのワーカー（python manage.py run_tasks）が ESC/POS（またはテキスト）に変換して出力先に書き出す。
+プリンターが遅い・止まっていても注文送信の応答時間には影響しない。
+
+伝票はDB（Task）に残るので、ワーカーの再起動やデプロイで失われない。印刷できなかった場合は
+タスクキューの間隔（失敗するたびに倍）で MAX_ATTEMPTS 回まで印刷し直し、それでも印刷できなかった
+伝票は厨房画面に表示して再印刷できるようにする。プリンターにはワーカーだけが接続し、
+その時点で印刷待ちの伝票を BATCH_SIZE 件まで1回の接続でまとめて送る。
+
+出力先は settings.TICKET_PRINTER で設定する。
+    'file'    : PATH のディレクトリに1伝票1ファイルで書き出す（動作確認用の代替プリンター）
+    'socket'  : HOST:PORT のネットワークプリンター（RAW 9100番）に送る
+    'console' : ログに出力する
+    ''        : 印刷しない
+"""
+import logging
+import socket
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SINK': '',
+    'FORMAT': 'escpos',
+    'PATH': Path(settings.BASE_DIR) / 'tickets',
+    'HOST': '127.0.0.1',
+    'PORT': 9100,
+    'TIMEOUT': 5,
+    'ENCODING': 'cp932',
+    'WIDTH': 42,
+    # 印刷を試みる回数（タスクキューの RETRY_DELAY から倍々で待つ。既定の5秒なら最後の失敗まで約10分）
+    'MAX_ATTEMPTS': 8,
+    'BATCH_SIZE': 10,
+}
+
+PRINT_TASK = 'print_ticket'
+
+
+# ESC/POS コマンド
+ESC_INIT = b'\x1b@'
+ESC_KANJI_ON = b'\x1c&'
+ESC_BOLD_ON = b'\x1bE\x01'
+ESC_BOLD_OFF = b'\x1bE\x00'
+ESC_DOUBLE_SIZE = b'\x1d!\x11'
+ESC_NORMAL_SIZE = b'\x1d!\x00'
+ESC_FEED_CUT = b'\x1bd\x04\x1dV\x01'
+
+
+def get_printer_settings():
+    return {**DEFAULTS, **getattr(settings, 'TICKET_PRINTER', {})}
+
+
+def build_ticket(order, lines):
+    """注文から伝票データを作成"""
+    return {
+        'order_id': order.id,
+        'table_number': order.table.table_number,
+        'created_at': order.created_at,
+        'notes': order.notes,
+        'lines': [
+            {'name': line.menu_item.name, 'quantity': line.quantity, 'notes': line.notes}
+            for line in lines
+        ],
+    }
+
+
+def render_text(ticket, width):
+    """伝票をテキストに変換"""
+    from django.utils import timezone
+
+    rows = [
+        f"テーブル {ticket['table_number']}",
+        f"注文 #{ticket['order_id']}  {timezone.localtime(ticket['created_at']):%m/%d %H:%M}",
+        '-' * width,
+    ]
+    for line in ticket['lines']:
+        rows.append(f"{line['name']}  x{line['quantity']}")
+        if line['notes']:
+            rows.append(f"  備考: {line['notes']}")
+    if ticket['notes']:
+        rows.append('-' * width)
+        rows.append(f"全体備考: {ticket['notes']}")
+    return '\n'.join(rows) + '\n'
+
+
+def render_escpos(ticket, encoding, width):
+    """伝票を ESC/POS のバイト列に変換"""
+    def encode(text):
+        return text.encode(encoding, errors='replace')
+
+    header, order_line, *body = render_text(ticket, width).splitlines()
+    data = ESC_INIT + ESC_KANJI_ON
+    data += ESC_DOUBLE_SIZE + ESC_BOLD_ON + encode(header + '\n') + ESC_BOLD_OFF + ESC_NORMAL_SIZE
+    data += encode(order_line + '\n')
+    for row in body:
+        if row.startswith('  ') or set(row) == {'-'}:
+            data += encode(row + '\n')
+        else:
+            data += ESC_DOUBLE_SIZE + encode(row + '\n') + ESC_NORMAL_SIZE
+    return data + ESC_FEED_CUT
+
+
+class FileSink:
+    """ディレクトリに1伝票1ファイルで書き出す"""
+    def __init__(self, config):
+        self.path = Path(config['PATH'])
+        self.suffix = '.bin' if config['FORMAT'] == 'escpos' else '.txt'
+
+    def write(self, batch):
+        self.path.mkdir(parents=True, exist_ok=True)
+        for ticket, payload in batch:
+            (self.path / f"order_{ticket['order_id']}{self.suffix}").write_bytes(payload)
+
+
+class SocketSink:
+    """ネットワークプリンター（RAW 9100番）に1回の接続でまとめて送る"""
+    def __init__(self, config):
+        self.address = (config['HOST'], int(config['PORT']))
+        self.timeout = config['TIMEOUT']
+
+    def write(self, batch):
+        with socket.create_connection(self.address, timeout=self.timeout) as conn:
+            for _, payload in batch:
+                conn.sendall(payload)
+
+
+class ConsoleSink:
+    """ログに出力する"""
+    def __init__(self, config):
+        self.encoding = config['ENCODING']
+
+    def write(self, batch):
+        for ticket, payload in batch:
+            logger.info('伝票 注文#%s\n%s', ticket['order_id'], payload.decode(self.encoding, errors='replace'))
+
+
+SINKS = {
+    'file': FileSink,
+    'socket': SocketSink,
+    'console': ConsoleSink,
+}
+
+
+def render_ticket(ticket, config):
+    """伝票を出力先に送るバイト列に変換"""
+    if config['FORMAT'] == 'escpos':
+        return render_escpos(ticket, config['ENCODING'], config['WIDTH'])
+    return render_text(ticket, config['WIDTH']).encode(config['ENCODING'], errors='replace')
+
+
+def print_tickets(tickets):
+    """伝票をまとめて出力先に書き出す（失敗した場合は例外。タスクキューで印刷し直す）"""
+    config = get_printer_settings()
+    sink = SINKS[config['SINK']](config)
+    sink.write([(ticket, render_ticket(ticket, config)) for ticket in tickets])
+
+
+def enqueue_ticket(order):
+    """伝票の印刷をタスクキューに登録（印刷しない設定の場合は None）
+
+    注文と同じトランザクションで登録するので、注文が確定すれば伝票も必ず残る。
+    """
+    config = get_printer_settings()
+    if not config['SINK']:
+        return None
+    from .tasks import enqueue
+
+    return enqueue(PRINT_TASK, max_attempts=config['MAX_ATTEMPTS'], order_id=order.id, store_id=order.store_id)
+
+
+def get_failed_tickets(store_id):
+    """印刷できなかった伝票のタスク（再試行の回数を使い切ったもの）"""
+    return Task.objects.filter(name=PRINT_TASK, status='failed', kwargs__store_id=store_id).order_by('id')
+
+
+def reprint_failed_tickets(store_id):
+    """印刷できなかった伝票を印刷し直す（登録し直した件数を返す）"""
+    from .tasks import retry_task
+
+    return sum(retry_task(task_id) for task_id in get_failed_tickets(store_id).values_list('id', flat=True))
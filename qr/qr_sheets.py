@@ -0,0 +1,217 @@
+"""テーブル用のQRコード画像（WiFi接続用と注文用）の作成
+
+qrcode と Pillow は読み込みに時間がかかるので、画像を作成する時に読み込む
+（パスの計算だけを使う画面やシグナルで読み込まないように）。
+"""
+import hashlib
+import io
+
+from django.core.files.storage import default_storage
+
+from .table_tokens import make_table_token
+
+# 作成した画像の保存先（MEDIA_ROOT からの相対パス）
+QR_SHEET_DIR = 'qr_sheets'
+
+
+def qr_sheet_path(store, table, store_settings):
+    """QRコード画像の保存パス（画像の内容に関わる設定が変わるとパスも変わる）"""
+    source = '|'.join(str(value) for value in [
+        store.slug,
+        table.table_number,
+        table.token_version,
+        store_settings.wifi_security,
+        store_settings.wifi_ssid,
+        store_settings.wifi_password,
+        store_settings.server_ip,
+    ])
+    key = hashlib.sha256(source.encode()).hexdigest()[:12]
+    return f'{QR_SHEET_DIR}/{store.slug}/table_{table.table_number}_{key}.png'
+
+
+def delete_qr_sheets(store_slug, keep=()):
+    """店舗のQRコード画像を削除（keep のパスは残す）。削除した件数を返す"""
+    directory = f'{QR_SHEET_DIR}/{store_slug}'
+    try:
+        _, filenames = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    
+    deleted = 0
+    for filename in filenames:
+        path = f'{directory}/{filename}'
+        if path not in keep:
+            default_storage.delete(path)
+            deleted += 1
+    return deleted
+
+
+def render_qr_sheet(store, table, store_settings):
+    """QRコード画像を作成してPNGのバイト列で返す"""
+    import qrcode
+    from PIL import Image, ImageDraw, ImageFont
+    
+    # WiFi接続用QRコード（WIFI形式）
+    wifi_data = f"WIFI:T:{store_settings.wifi_security};S:{store_settings.wifi_ssid};P:{store_settings.wifi_password};;"
+    
+    # 注文用QRコード
+    order_url = f"http://{store_settings.server_ip}:8000/s/{store.slug}/order/{table.table_number}/?t={make_table_token(table)}"
+    
+    # QRコード画像生成
+    wifi_qr = qrcode.QRCode(version=1, box_size=8, border=3)
+    wifi_qr.add_data(wifi_data)
+    wifi_qr.make(fit=True)
+    wifi_img = wifi_qr.make_image(fill_color="black", back_color="white")
+    
+    order_qr = qrcode.QRCode(version=1, box_size=8, border=3)
+    order_qr.add_data(order_url)
+    order_qr.make(fit=True)
+    order_img = order_qr.make_image(fill_color="black", back_color="white")
+    
+    # キャンバスサイズ（A4サイズに近い比率）
+    img_width = 1000
+    img_height = 1400
+    
+    # 背景色（明るいグレー）
+    combined_img = Image.new('RGB', (img_width, img_height), '#f8f9fa')
+    draw = ImageDraw.Draw(combined_img)
+    
+    # タイトル背景（上部バー）
+    draw.rectangle([(0, 0), (img_width, 100)], fill='#4a90e2')
+    
+    # フォント設定
+    try:
+        # 日本語フォントの読み込みを試みる（環境に応じて調整が必要）
+        title_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 40)
+        large_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 32)
+        medium_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 28)
+        small_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 24)
+    except:
+        # フォントが見つからない場合はデフォルト
+        title_font = ImageFont.load_default()
+        large_font = ImageFont.load_default()
+        medium_font = ImageFont.load_default()
+        small_font = ImageFont.load_default()
+    
+    # タイトル（テーブル番号）
+    title_text = f"テーブル {table.table_number}"
+    # テキストサイズを取得（PIL 10.0.0以降）
+    try:
+        title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
+        title_width = title_bbox[2] - title_bbox[0]
+    except:
+        title_width = len(title_text) * 20
+    
+    draw.text(((img_width - title_width) // 2, 30), title_text, fill='white', font=title_font)
+    
+    # メインメッセージ
+    y_pos = 130
+    message1 = "当店では、QRコードによる注文も可能です。"
+    message2 = "下記の手順でスマホから注文できます。"
+    
+    try:
+        msg1_bbox = draw.textbbox((0, 0), message1, font=medium_font)
+        msg1_width = msg1_bbox[2] - msg1_bbox[0]
+        msg2_bbox = draw.textbbox((0, 0), message2, font=medium_font)
+        msg2_width = msg2_bbox[2] - msg2_bbox[0]
+    except:
+        msg1_width = len(message1) * 12
+        msg2_width = len(message2) * 12
+    
+    draw.text(((img_width - msg1_width) // 2, y_pos), message1, fill='#333333', font=medium_font)
+    draw.text(((img_width - msg2_width) // 2, y_pos + 40), message2, fill='#333333', font=medium_font)
+    
+    # STEP 1 セクション
+    y_pos = 230
+    # 背景ボックス
+    draw.rectangle([(80, y_pos), (img_width - 80, y_pos + 500)], fill='white', outline='#4a90e2', width=3)
+    
+    # STEP 1 ラベル
+    draw.ellipse([(120, y_pos + 20), (200, y_pos + 100)], fill='#ff6b6b')
+    step1_text = "STEP"
+    step1_num = "1"
+    try:
+        step_bbox = draw.textbbox((0, 0), step1_text, font=small_font)
+        step_width = step_bbox[2] - step_bbox[0]
+        num_bbox = draw.textbbox((0, 0), step1_num, font=large_font)
+        num_width = num_bbox[2] - num_bbox[0]
+    except:
+        step_width = 40
+        num_width = 20
+    
+    draw.text(((160 - step_width // 2), y_pos + 35), step1_text, fill='white', font=small_font)
+    draw.text(((160 - num_width // 2), y_pos + 55), step1_num, fill='white', font=large_font)
+    
+    # STEP 1 説明
+    step1_desc = "まずは、下のQRコードを読み込んで店のWiFiに"
+    step1_desc2 = "接続してください"
+    draw.text((230, y_pos + 40), step1_desc, fill='#333333', font=medium_font)
+    draw.text((230, y_pos + 70), step1_desc2, fill='#333333', font=medium_font)
+    
+    # WiFi QRコード配置
+    wifi_img = wifi_img.resize((375, 375))
+    combined_img.paste(wifi_img, ((img_width - 375) // 2, y_pos + 110))
+    
+    # SSID表示 いらない
+    #ssid_text = f"WiFi名: {store_settings.wifi_ssid}"
+    #try:
+    #    ssid_bbox = draw.textbbox((0, 0), ssid_text, font=small_font)
+    #    ssid_width = ssid_bbox[2] - ssid_bbox[0]
+    #except:
+    #    ssid_width = len(ssid_text) * 10
+    #
+    #draw.text(((img_width - ssid_width) // 2, y_pos + 390), ssid_text, fill='#666666', font=small_font)
+    
+    # STEP 2 セクション
+    y_pos = 750
+    # 背景ボックス
+    draw.rectangle([(80, y_pos), (img_width - 80, y_pos + 500)], fill='white', outline='#4a90e2', width=3)
+    
+    # STEP 2 ラベル
+    draw.ellipse([(120, y_pos + 20), (200, y_pos + 100)], fill='#51cf66')
+    step2_num = "2"
+    try:
+        num2_bbox = draw.textbbox((0, 0), step2_num, font=large_font)
+        num2_width = num2_bbox[2] - num2_bbox[0]
+    except:
+        num2_width = 20
+    
+    draw.text(((160 - step_width // 2), y_pos + 35), step1_text, fill='white', font=small_font)
+    draw.text(((160 - num2_width // 2), y_pos + 55), step2_num, fill='white', font=large_font)
+    
+    # STEP 2 説明
+    step2_desc = "次に注文用の下のQRコードを読み取って"
+    step2_desc2 = "注文してください"
+    draw.text((230, y_pos + 40), step2_desc, fill='#333333', font=medium_font)
+    draw.text((230, y_pos + 70), step2_desc2, fill='#333333', font=medium_font)
+    
+    # 注文用QRコード配置
+    order_img = order_img.resize((375, 375))
+    combined_img.paste(order_img, ((img_width - 375) // 2, y_pos + 110))
+    
+    # 注意事項セクション
+    y_pos = 1280
+
+    draw.rectangle([(80, y_pos), (img_width - 80, y_pos + 80)], fill='#fff9e6', outline='#ffd43b', width=2)
+    
+    notice_icon = "※"
+    notice_text = "※送信した注文をキャンセルしたい場合は店員にお申し付けください。"
+    notice_text2 = ""
+    
+    #draw.text((120, y_pos + 20), notice_icon, fill='#ff6b6b', font=large_font)
+    draw.text((110, y_pos + 30), notice_text, fill='#666666', font=small_font)
+    #draw.text((160, y_pos + 60), notice_text2, fill='#666666', font=small_font)
+    
+    # フッター　いらない
+    #footer_text = "ご不明な点がございましたら、お気軽にスタッフまでお声がけください。"
+    #try:
+    #    footer_bbox = draw.textbbox((0, 0), footer_text, font=small_font)
+    #    footer_width = footer_bbox[2] - footer_bbox[0]
+    #except:
+    #    footer_width = len(footer_text) * 10
+    #
+    #draw.text(((img_width - footer_width) // 2, 1320), footer_text, fill='#999999', font=small_font)
+    
+    buffer = io.BytesIO()
+    combined_img.save(buffer, "PNG")
+    return buffer.getvalue()
@@ -0,0 +1,104 @@
+"""注文送信のレート制限（トークンバケット）
+
+テーブルごと・送信元IPごとにバケットを持ち、注文を1件受け付けるたびにトークンを1つ使う。
+トークンは1分あたり PER_MINUTE 個ずつ、CAPACITY 個まで補充される。
+
+バケットはプロセス内のメモリに持つ（DBやキャッシュにはアクセスしない）。gunicorn の
+ワーカーを複数起動している場合、上限はワーカーごとに適用される。
+
+設定は settings.ORDER_RATE_LIMIT で行う。
+"""
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'TABLE': {'CAPACITY': 10, 'PER_MINUTE': 10},
+    'IP': {'CAPACITY': 20, 'PER_MINUTE': 30},
+    # プロキシの背後で動かす場合にクライアントのIPを取るヘッダー（例: 'HTTP_X_FORWARDED_FOR'）
+    'IP_HEADER': None,
+}
+
+# バケットの数がこれを超えたら満タンのバケットを捨てる
+MAX_KEYS = 10000
+
+
+def get_rate_limit_settings():
+    return {**DEFAULTS, **getattr(settings, 'ORDER_RATE_LIMIT', {})}
+
+
+class TokenBucket:
+    """キーごとのトークンバケット"""
+
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.rate = per_minute / 60  # 1秒あたりの補充数
+        self._buckets = {}  # キー -> (トークン数, 最終更新時刻)
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        """トークンを使う（使えた場合は 0、足りない場合は使えるようになるまでの秒数を返す）"""
+        now = time.monotonic()
+        with self._lock:
+            available, updated_at = self._buckets.get(key, (self.capacity, now))
+            available = min(self.capacity, available + (now - updated_at) * self.rate)
+            if available >= tokens:
+                self._buckets[key] = (available - tokens, now)
+                if len(self._buckets) > MAX_KEYS:
+                    self._prune(now)
+                    if len(self._buckets) > MAX_KEYS:
+                        # 回復途中のバケットばかりの場合は全て捨てる（一時的に制限が緩くなるだけ）
+                        self._buckets = {}
+                return 0
+            self._buckets[key] = (available, now)
+            if self.rate <= 0:
+                # 補充しない設定の場合は1分後を目安にする
+                return 60
+            return (tokens - available) / self.rate
+
+    def _prune(self, now):
+        """満タンまで回復したバケットを捨てる（捨てても次回は満タンから始まるので結果は同じ）"""
+        self._buckets = {
+            key: (available, updated_at)
+            for key, (available, updated_at) in self._buckets.items()
+            if available + (now - updated_at) * self.rate < self.capacity
+        }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(name):
+    """設定に合わせたバケットを取得（設定が変わった場合は新しいバケットを作る）"""
+    config = get_rate_limit_settings()[name]
+    key = (name, config['CAPACITY'], config['PER_MINUTE'])
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(key, TokenBucket(config['CAPACITY'], config['PER_MINUTE']))
+    return bucket
+
+
+def get_client_ip(request):
+    """送信元のIPアドレス"""
+    header = get_rate_limit_settings()['IP_HEADER']
+    if header and request.META.get(header):
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def check_ip_rate(request):
+    """送信元IPごとの制限（受け付ける場合は 0、超えている場合は再送までの秒数を返す）"""
+    if not get_rate_limit_settings()['ENABLED']:
+        return 0
+    return get_bucket('IP').consume(get_client_ip(request))
+
+
+def check_table_rate(table):
+    """テーブルごとの制限（受け付ける場合は 0、超えている場合は再送までの秒数を返す）"""
+    if not get_rate_limit_settings()['ENABLED']:
+        return 0
+    return get_bucket('TABLE').consume(table.id)
@@ -0,0 +1,24 @@
+"""注文画面のメニュー検索用の文字列の正規化
+
+全角・半角の違い（NFKC）、大文字・小文字、カタカナ・ひらがなの違いをなくして比較する。
+漢字の読みは自動では分からないので、メニューの「読み」に入力されたひらがなで検索できるようにする。
+注文画面の JavaScript（normalizeSearchText）も同じ規則で正規化すること。
+"""
+import re
+import unicodedata
+
+# カタカナ（ァ〜ヶ）をひらがなに変換する表
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_search_text(text):
+    """検索用に正規化した文字列"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return WHITESPACE.sub('', text.translate(KATAKANA_TO_HIRAGANA))
+
+
+def build_search_text(*values):
+    """メニューの検索対象の文字列（メニュー名・読み・説明を区切り文字でつなぐ）"""
+    return '\n'.join(normalize_search_text(value) for value in values if value)
@@ -0,0 +1,64 @@
+"""キャッシュ破棄などのシグナル処理"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caches import (
+    invalidate_menu_cache, invalidate_server_ip, invalidate_store, invalidate_store_settings, invalidate_tables,
+)
+from .config import server_ips
+from .models import MenuCategory, MenuItem, Store, StoreSettings, Table
+from .qr_sheets import delete_qr_sheets, qr_sheet_path
+from .tasks import enqueue_once
+
+
+@receiver([post_save, post_delete], sender=MenuCategory)
+@receiver([post_save, post_delete], sender=MenuItem)
+def menu_changed(sender, instance, **kwargs):
+    """メニューが変更されたらその店舗のスナップショットを破棄"""
+    invalidate_menu_cache(instance.store_id)
+
+
+@receiver(post_save, sender=MenuItem)
+def menu_image_changed(sender, instance, **kwargs):
+    """画像の縮小版がないメニューは作成をタスクキューに登録（画像を変更すると空になる）"""
+    if instance.image and not instance.image_placeholder:
+        enqueue_once('generate_image_placeholder', menu_item_id=instance.id, image=instance.image.name)
+
+
+@receiver([post_save, post_delete], sender=Table)
+def table_changed(sender, instance, **kwargs):
+    """テーブルが変更されたらその店舗のテーブルのキャッシュを破棄"""
+    invalidate_tables(instance.store_id)
+
+
+@receiver([post_save, post_delete], sender=StoreSettings)
+def store_settings_changed(sender, instance, **kwargs):
+    """店舗設定が変更されたら店舗設定とサーバーIPのキャッシュを破棄（このプロセスではすぐに読み直す）"""
+    invalidate_store_settings(instance.store_id)
+    invalidate_server_ip()
+    server_ips.clear()
+
+
+@receiver(post_save, sender=StoreSettings)
+def store_settings_saved(sender, instance, **kwargs):
+    """店舗設定が変更されたら古い設定で作成したQRコード画像を削除（今の設定の画像は残す）"""
+    store = instance.store
+    keep = {qr_sheet_path(store, table, instance) for table in store.tables.all()}
+    delete_qr_sheets(store.slug, keep)
+
+
+@receiver([post_save, post_delete], sender=Store)
+def store_changed(sender, instance, **kwargs):
+    """店舗が変更されたらURLの店舗IDのキャッシュを破棄"""
+    invalidate_store(instance.slug)
+
+
+@receiver(pre_save, sender=Store)
+def store_slug_changing(sender, instance, **kwargs):
+    """店舗IDを変更する場合は変更前の店舗IDのキャッシュとQRコード画像も破棄"""
+    if instance.pk is not None:
+        old_slug = Store.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+        if old_slug and old_slug != instance.slug:
+            invalidate_store(old_slug)
+            # QRコード画像は店舗IDごとのフォルダにあり、古いURLが入っているので削除する
+            delete_qr_sheets(old_slug)
@@ -0,0 +1,58 @@
+"""注文画面のURLに付けるテーブルごとのトークン（署名付き）
+
+注文画面のURLは /s/<店舗ID>/order/<テーブル番号>/?t=<トークン>。トークンは "<バージョン>.<署名>" で、
+署名は店舗・テーブル番号・バージョンの HMAC（SECRET_KEY を使う）なのでDBを見ずに検証できる。
+テーブル番号を書き換えただけのURLや不正なトークンは、DB・キャッシュに問い合わせる前に拒否する。
+
+テーブルの token_version を上げる（rotate_table_token）と、それまでに印刷したQRコードは使えなくなる。
+印刷済みのQRコードから移行する間は settings.TABLE_TOKENS['REQUIRED'] を False にすると
+トークンのないURLも受け付ける。
+"""
+from django.conf import settings
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .caches import invalidate_tables
+from .models import Table
+
+DEFAULTS = {
+    'REQUIRED': True,
+}
+
+TOKEN_SALT = 'qr.table_token'
+# 署名の長さ（16進数の文字数）。QRコードが大きくなりすぎないように切り詰める
+SIGNATURE_LENGTH = 20
+
+
+def get_table_token_settings():
+    return {**DEFAULTS, **getattr(settings, 'TABLE_TOKENS', {})}
+
+
+def _signature(store_id, table_number, version):
+    value = f'{store_id}:{table_number}:{version}'
+    return salted_hmac(TOKEN_SALT, value, algorithm='sha256').hexdigest()[:SIGNATURE_LENGTH]
+
+
+def make_table_token(table):
+    """テーブルの現在のトークン"""
+    return f'{table.token_version}.{_signature(table.store_id, table.table_number, table.token_version)}'
+
+
+def parse_table_token(store_id, table_number, token):
+    """署名が正しければトークンのバージョン、正しくなければ None を返す（DBにはアクセスしない）"""
+    version, _, signature = str(token or '').partition('.')
+    if not version.isdigit() or len(version) > 9 or not signature:
+        return None
+    if not constant_time_compare(signature, _signature(store_id, table_number, int(version))):
+        return None
+    return int(version)
+
+
+def rotate_table_token(table):
+    """トークンのバージョンを上げる（発行済みのQRコードは使えなくなる）"""
+    # 同時に再発行しても回数を失わないようにDBで加算する
+    Table.objects.filter(pk=table.pk).update(token_version=F('token_version') + 1)
+    table.refresh_from_db(fields=['token_version'])
+    # update() では post_save が送られないので、テーブルのキャッシュはここで破棄する
+    invalidate_tables(table.store_id)
+    return make_table_token(table)
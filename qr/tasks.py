@@ -0,0 +1,298 @@
+"""バックグラウンドタスクのキュー
+
+QRコード画像の作成や config.json の書き出しなど、時間のかかる処理をリクエストの外で
+実行するための簡易キュー。タスクは Task モデルとしてDBに保存するので、外部のブローカーは
+不要。`python manage.py run_tasks` のワーカーがDBからタスクを取り出して実行する。
+
+    @task()
+    def render_qr_sheet(table_id, path): ...
+
+    enqueue('render_qr_sheet', table_id=1, path='...')   # タスクを登録
+    get_task_status(task_id)                            # 状態を取得
+    retry_task(task_id)                                 # 失敗したタスクを再実行
+
+設定は settings.TASK_QUEUE で行う。EAGER が True の場合はワーカーを使わず、
+トランザクションの確定後にその場で実行する（開発用）。
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caches import get_store_settings, invalidate_menu_cache
+from .config import server_config
+from .images import build_image_placeholder
+from .models import MenuItem, Order, Table, Task
+from .printing import PRINT_TASK, build_ticket, get_printer_settings, print_tickets
+from .qr_sheets import render_qr_sheet as draw_qr_sheet
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'EAGER': False,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 5,  # 秒（失敗するたびに倍にする）
+    'POLL_INTERVAL': 1.0,  # 秒
+    'STALE_TIMEOUT': 600,  # 秒（これより長く実行中のままのタスクはワーカーが落ちたとみなす）
+}
+
+# タスク名 -> (関数, 最大実行回数)
+_registry = {}
+
+
+def get_task_settings():
+    return {**DEFAULTS, **getattr(settings, 'TASK_QUEUE', {})}
+
+
+def task(name=None, max_attempts=None):
+    """タスクとして登録するデコレータ"""
+    def decorator(func):
+        _registry[name or func.__name__] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, run_at=None, max_attempts=None, **kwargs):
+    """タスクをキューに登録"""
+    if name not in _registry:
+        raise KeyError(f'未登録のタスクです: {name}')
+
+    options = get_task_settings()
+    task_obj = Task.objects.create(
+        name=name,
+        kwargs=kwargs,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or _registry[name][1] or options['MAX_ATTEMPTS'],
+    )
+
+    if options['EAGER']:
+        transaction.on_commit(lambda: execute_task(task_obj.id))
+    return task_obj
+
+
+def enqueue_once(name, **kwargs):
+    """同じ引数のタスクが待機中・実行中であればそれを返し、なければ登録"""
+    existing = Task.objects.filter(
+        name=name, status__in=['queued', 'running'], kwargs=kwargs,
+    ).order_by('id').first()
+    return existing or enqueue(name, **kwargs)
+
+
+def get_task_status(task_id):
+    """タスクの状態（見つからなければ None）"""
+    task_obj = Task.objects.filter(id=task_id).first()
+    if task_obj is None:
+        return None
+    return {
+        'id': task_obj.id,
+        'name': task_obj.name,
+        'status': task_obj.status,
+        'status_display': task_obj.get_status_display(),
+        'attempts': task_obj.attempts,
+        'max_attempts': task_obj.max_attempts,
+        'result': task_obj.result,
+        'last_error': task_obj.last_error.strip().splitlines()[-1] if task_obj.last_error else '',
+        'updated_at': task_obj.updated_at.isoformat(),
+    }
+
+
+def retry_task(task_id):
+    """失敗したタスクを再実行（再登録できたら True）"""
+    updated = Task.objects.filter(id=task_id, status='failed').update(
+        status='queued', attempts=0, run_at=timezone.now(), updated_at=timezone.now(),
+    )
+    if updated and get_task_settings()['EAGER']:
+        transaction.on_commit(lambda: execute_task(task_id))
+    return bool(updated)
+
+
+def claim_task(task_id, worker_id):
+    """待機中のタスクを実行中にする（他のワーカーが先に取った場合は None）
+
+    SELECT FOR UPDATE が使えない SQLite でも二重に実行しないように、
+    status を条件にした UPDATE の件数で取れたかどうかを判定する。
+    """
+    now = timezone.now()
+    claimed = Task.objects.filter(id=task_id, status='queued', run_at__lte=now).update(
+        status='running',
+        attempts=F('attempts') + 1,
+        locked_by=worker_id,
+        locked_at=now,
+        updated_at=now,
+    )
+    if not claimed:
+        return None
+    return Task.objects.get(id=task_id)
+
+
+def claim_next(worker_id, batch=10):
+    """実行できるタスクを1件取り出す"""
+    candidates = Task.objects.filter(
+        status='queued', run_at__lte=timezone.now(),
+    ).order_by('run_at', 'id').values_list('id', flat=True)[:batch]
+    for task_id in candidates:
+        task_obj = claim_task(task_id, worker_id)
+        if task_obj is not None:
+            return task_obj
+    return None
+
+
+def run_task(task_obj):
+    """取り出したタスクを実行して結果を保存"""
+    func, _ = _registry.get(task_obj.name, (None, None))
+    try:
+        if func is None:
+            raise KeyError(f'未登録のタスクです: {task_obj.name}')
+        result = func(**task_obj.kwargs)
+    except Exception:
+        logger.exception('タスク %s #%s の実行に失敗しました', task_obj.name, task_obj.id)
+        return finish_task(task_obj, error=traceback.format_exc(), retry=func is not None)
+    return finish_task(task_obj, result=result)
+
+
+def finish_task(task_obj, result=None, error=None, retry=True):
+    """実行中のタスクの結果を保存（error がある場合は、回数が残っていれば待ち時間を倍にして再実行）"""
+    if error is None:
+        task_obj.status = 'succeeded'
+        task_obj.result = result
+        task_obj.last_error = ''
+    else:
+        task_obj.last_error = error
+        if retry and task_obj.attempts < task_obj.max_attempts:
+            delay = get_task_settings()['RETRY_DELAY'] * 2 ** (task_obj.attempts - 1)
+            task_obj.status = 'queued'
+            task_obj.run_at = timezone.now() + timedelta(seconds=delay)
+        else:
+            task_obj.status = 'failed'
+
+    task_obj.locked_by = ''
+    task_obj.locked_at = None
+    task_obj.save(update_fields=['status', 'result', 'last_error', 'run_at', 'locked_by', 'locked_at', 'updated_at'])
+    return task_obj
+
+
+def execute_task(task_id):
+    """指定したタスクをその場で実行（EAGER 用）"""
+    task_obj = claim_task(task_id, worker_id=f'eager:{os.getpid()}')
+    if task_obj is not None:
+        run_task(task_obj)
+
+
+def recover_stale_tasks(timeout):
+    """ワーカーが落ちて実行中のまま残ったタスクを待機中に戻す"""
+    return Task.objects.filter(
+        status='running', locked_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status='queued', locked_by='', locked_at=None, run_at=timezone.now(), updated_at=timezone.now())
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_worker(once=False, poll_interval=None, stale_timeout=None, stdout=None):
+    """タスクを取り出して実行し続ける（once の場合は実行できるタスクがなくなったら終了）"""
+    options = get_task_settings()
+    poll_interval = options['POLL_INTERVAL'] if poll_interval is None else poll_interval
+    stale_timeout = options['STALE_TIMEOUT'] if stale_timeout is None else stale_timeout
+    worker_id = get_worker_id()
+    processed = 0
+
+    recover_stale_tasks(stale_timeout)
+    while True:
+        task_obj = claim_next(worker_id)
+        if task_obj is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            recover_stale_tasks(stale_timeout)
+            continue
+
+        run_task(task_obj)
+        processed += 1
+        if stdout is not None:
+            stdout.write(f'{task_obj.name} #{task_obj.id}: {task_obj.get_status_display()}')
+
+
+# タスク定義
+
+@task()
+def render_qr_sheet(table_id, path):
+    """テーブルのQRコード画像を作成して保存"""
+    if default_storage.exists(path):
+        return {'path': path}
+
+    table = Table.objects.select_related('store').get(id=table_id)
+    store_settings = get_store_settings(table.store_id)
+    if store_settings is None:
+        raise ValueError('店舗設定が完了していません。')
+
+    saved_path = default_storage.save(path, ContentFile(draw_qr_sheet(table.store, table, store_settings)))
+    return {'path': saved_path}
+
+
+@task()
+def write_server_config(server_ip):
+    """config.jsonにサーバーIPを保存（実行中のサーバーにも再起動なしで反映される）"""
+    server_config.write({"USER_IP": server_ip})
+    return {'server_ip': server_ip}
+
+
+@task()
+def generate_image_placeholder(menu_item_id, image):
+    """メニュー画像の大きさと読み込み中に表示する縮小画像を保存"""
+    item = MenuItem.objects.filter(id=menu_item_id, image=image).first()
+    if item is None:
+        # 削除されたか、画像が変更された（変更後の画像のタスクが別に登録されている）
+        return {'skipped': True}
+
+    with item.image.open('rb') as f:
+        width, height, placeholder = build_image_placeholder(f)
+    # save() を使うと縮小画像を作り直すタスクが再び登録されるので update で書き込む（シグナルは送られない）
+    MenuItem.objects.filter(id=menu_item_id, image=image).update(
+        image_width=width, image_height=height, image_placeholder=placeholder,
+    )
+    invalidate_menu_cache(item.store_id)
+    return {'width': width, 'height': height}
+
+
+@task(name=PRINT_TASK)
+def print_ticket(order_id, store_id):
+    """厨房伝票を印刷（印刷待ちの他の伝票も BATCH_SIZE 件まで取り出して、1回の接続でまとめて送る）
+
+    まとめて取り出した伝票のタスクにも、このタスクと同じ結果（成功・失敗して再試行）を記録する。
+    """
+    config = get_printer_settings()
+    if not config['SINK']:
+        return {'skipped': True}
+
+    worker_id = get_worker_id()
+    candidates = Task.objects.filter(
+        name=PRINT_TASK, status='queued', run_at__lte=timezone.now(),
+    ).order_by('run_at', 'id').values_list('id', flat=True)[:max(config['BATCH_SIZE'] - 1, 0)]
+    batched = [task_obj for task_obj in (claim_task(task_id, worker_id) for task_id in candidates) if task_obj]
+
+    order_ids = [order_id] + [task_obj.kwargs['order_id'] for task_obj in batched]
+    orders = Order.objects.select_related('table').prefetch_related('items__menu_item').in_bulk(order_ids)
+    try:
+        # 削除された注文は印刷しない
+        print_tickets([
+            build_ticket(orders[ticket_order_id], orders[ticket_order_id].items.all())
+            for ticket_order_id in order_ids if ticket_order_id in orders
+        ])
+    except Exception:
+        error = traceback.format_exc()
+        for task_obj in batched:
+            finish_task(task_obj, error=error)
+        raise
+    for task_obj in batched:
+        finish_task(task_obj, result={'printed_with': order_id})
+    return {'order_ids': order_ids}
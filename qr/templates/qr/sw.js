@@ -0,0 +1,72 @@
+{% load static %}// 注文画面のサービスワーカー
+// 注文画面とメニューAPIは通信を優先してキャッシュを更新し、つながらないときはキャッシュを返す。
+// 静的ファイルとメニュー画像はキャッシュを優先する（静的ファイルはファイル名にハッシュが付く）。
+const CACHE_NAME = 'qr-order-v{{ cache_version }}';
+const STATIC_URL = '{% get_static_prefix %}';
+const MEDIA_URL = '{% get_media_prefix %}';
+const PRECACHE_URLS = [
+    '{% static "qr/vendor/bootstrap/css/bootstrap.min.css" %}',
+    '{% static "qr/vendor/fontawesome/css/all.min.css" %}',
+    '{% static "qr/vendor/jquery/jquery-3.7.1.min.js" %}',
+    '{% static "qr/vendor/bootstrap/js/popper.min.js" %}',
+    '{% static "qr/vendor/bootstrap/js/bootstrap.min.js" %}',
+];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // 古いバージョンのキャッシュを削除
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name.startsWith('qr-order-') && name !== CACHE_NAME)
+                    .map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+function networkFirst(request) {
+    return fetch(request)
+        .then(response => {
+            if (response.ok) {
+                const copy = response.clone();
+                caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+            }
+            return response;
+        })
+        .catch(() => caches.match(request).then(cached => cached || Promise.reject(new Error('offline'))));
+}
+
+function cacheFirst(request) {
+    return caches.match(request).then(cached => cached || fetch(request).then(response => {
+        if (response.ok) {
+            const copy = response.clone();
+            caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+        }
+        return response;
+    }));
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin) {
+        return;
+    }
+
+    // 注文画面（/s/<店舗ID>/order/<テーブル番号>/）。注文ステータスのAPIはキャッシュしない
+    if (request.mode === 'navigate' && /^\/s\/[^/]+\/order\/\d+\/$/.test(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    } else if (/^\/s\/[^/]+\/api\/menu\/$/.test(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    } else if (url.pathname.startsWith(STATIC_URL) || url.pathname.startsWith(MEDIA_URL)) {
+        event.respondWith(cacheFirst(request));
+    }
+});
@@ -0,0 +1,25 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def duration(seconds):
+    """秒数を「7分05秒」の形式で表示"""
+    if seconds is None or seconds == '':
+        return '-'
+    minutes, seconds = divmod(int(round(float(seconds))), 60)
+    if minutes:
+        return f'{minutes}分{seconds:02d}秒'
+    return f'{seconds}秒'
+
+
+@register.simple_tag
+def admin_cursor_url(cl):
+    """管理画面の一覧で、表示中の最後の行より古い行を表示するURL（id の降順の一覧用）"""
+    from django.contrib.admin.views.main import PAGE_VAR
+
+    rows = list(cl.result_list)
+    if len(rows) < cl.list_per_page:
+        return ''
+    return cl.get_query_string({'id__lt': rows[-1].pk}, [PAGE_VAR])
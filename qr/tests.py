@@ -1,3 +1,869 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.forms import modelform_factory
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import config, ratelimit, tasks
+from .caches import (
+    ORDER_STATUS_FINISHED_TIMEOUT, ORDER_STATUS_TIMEOUT, build_menu_snapshot, get_cached_order_status,
+)
+from .checkout import CheckoutError, checkout_table, split_evenly
+from .menu_io import COLUMNS, MenuImportError, apply_menu_diff, compute_menu_diff, read_menu_workbook, write_menu_workbook
+from .metrics import ORDERS_SUBMITTED, flush, start_flusher
+from .models import (
+    Checkout, DailySalesRollup, MenuCategory, MenuItem, Order, OrderItem, OrderStatusTransition, Store, StoreSettings, Table,
+    Task, TicketTimeStat,
+)
+from .paginators import EstimatedCountPaginator, estimate_row_count
+from .printing import FileSink
+from .search import build_search_text, normalize_search_text
+from .table_tokens import make_table_token, rotate_table_token
+from .tasks import claim_next, claim_task, enqueue, recover_stale_tasks, retry_task, run_task, run_worker
+from .ticket_times import compute_ticket_time_stats, local_day_range, percentile
+from .views import apply_status_transitions
+
+# テストでは開発・本番と共有するファイルのキャッシュ（.cache）を使わない
+# （cache.clear() で共有のキャッシュを消したり、テスト用DBの内容を残したりしないように）
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'qr-tests',
+    }
+}
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    ORDER_RATE_LIMIT={'ENABLED': False},
+)
+class QrTestCase(TestCase):
+    """テスト共通の設定（共有しないキャッシュ・レート制限なし）と、店舗・テーブル1・カテゴリ"""
+
+    def setUp(self):
+        cache.clear()
+        self.store = Store.objects.create(name='店舗', slug='default')
+        self.table = Table.objects.create(store=self.store, table_number=1)
+        self.category = MenuCategory.objects.create(store=self.store, name='ドリンク')
+
+    def login(self):
+        """店舗の管理者としてログインする"""
+        session = self.client.session
+        session['authenticated'] = True
+        session['store_id'] = self.store.id
+        session.save()
+
+    def post_order(self, items, table=None, token=None, client_token=None, **extra):
+        """注文を送信する（items は [(メニュー, 数量)]。token を省略した場合はテーブルの正しいトークン）"""
+        table = table or self.table
+        return self.client.post(
+            '/s/default/submit-order/',
+            json.dumps({
+                'table_number': table.table_number,
+                'table_token': make_table_token(table) if token is None else token,
+                'client_token': client_token,
+                'items': [{'id': menu_item.id, 'quantity': quantity} for menu_item, quantity in items],
+            }),
+            content_type='application/json',
+            **extra,
+        )
+
+
+def parse_metrics(text):
+    """/metrics の出力を {サンプル名（ラベル付き）: 値} にする"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class MetricsTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.menu_item = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+
+    def scrape(self, **extra):
+        response = self.client.get('/metrics', **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return parse_metrics(response.content.decode())
+
+    def submit_order(self):
+        return self.post_order([(self.menu_item, 2)])
+
+    def test_scrape_counts_submitted_orders(self):
+        before = self.scrape()
+        response = self.client.get('/s/default/order/1/', {'t': make_table_token(self.table)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.submit_order().json()['status'], 'success')
+        cache.delete('metrics:db_gauges')
+        after = self.scrape()
+
+        success = 'qr_orders_submitted_total{result="success"}'
+        self.assertEqual(after[success] - before.get(success, 0), 1)
+        latency = 'qr_submit_order_seconds_count'
+        self.assertEqual(after[latency] - before.get(latency, 0), 1)
+        self.assertEqual(after['qr_submit_order_seconds_bucket{le="+Inf"}'], after[latency])
+        self.assertEqual(after['qr_open_orders{status="pending"}'], 1)
+        self.assertIn('qr_cache_requests_total{cache="menu_snapshot",result="miss"}', after)
+        self.assertGreater(after['qr_db_write_seconds_count'], before.get('qr_db_write_seconds_count', 0))
+
+    def test_open_orders_are_cached_between_scrapes(self):
+        self.scrape()
+        self.submit_order()
+        with self.assertNumQueries(0):
+            samples = self.scrape()
+        self.assertEqual(samples['qr_open_orders{status="pending"}'], 0)
+
+    def test_remote_scrape_requires_token(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='192.168.1.20')
+        self.assertEqual(response.status_code, 403)
+
+        with self.settings(METRICS={'TOKEN': 'secret'}):
+            response = self.client.get('/metrics', REMOTE_ADDR='192.168.1.20', HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, 403)
+            self.scrape(REMOTE_ADDR='192.168.1.20', HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_values_of_other_processes_are_added(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS={'DIR': directory}):
+            ORDERS_SUBMITTED.inc(result='sold_out')
+            flush()
+            with open(os.path.join(directory, f'{os.getpid()}.json')) as f:
+                own = json.load(f)['qr_orders_submitted_total']['["sold_out"]']
+            # 別のワーカープロセスが書き出したファイル
+            with open(os.path.join(directory, '99999999.json'), 'w') as f:
+                json.dump({'qr_orders_submitted_total': {'["sold_out"]': 5}}, f)
+
+            samples = self.scrape()
+        self.assertEqual(samples['qr_orders_submitted_total{result="sold_out"}'], own + 5)
+
+    def test_flusher_is_started_only_by_workers(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS={'DIR': directory}), \
+                mock.patch('qr.metrics._flusher_pid', None), mock.patch('qr.metrics.threading.Thread') as thread:
+            # 記録しただけでは書き出しのスレッドを起動しない（preload_app のマスタープロセス）
+            ORDERS_SUBMITTED.inc(result='sold_out')
+            self.assertFalse(thread.called)
+            self.assertEqual(os.listdir(directory), [])
+            # ワーカーの post_fork で1回だけ起動する
+            start_flusher()
+            start_flusher()
+        self.assertEqual(thread.call_count, 1)
+
+
+@override_settings(TABLE_TOKENS={'REQUIRED': True})
+class TableTokenTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_table = Table.objects.create(store=self.store, table_number=2)
+        self.menu_item = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+
+    def submit_order(self, table, token, client_token=None):
+        return self.post_order([(self.menu_item, 1)], table=table, token=token, client_token=client_token)
+
+    def test_order_page_requires_valid_token(self):
+        token = make_table_token(self.table)
+        self.assertEqual(self.client.get('/s/default/order/1/', {'t': token}).status_code, 200)
+        self.assertEqual(self.client.get('/s/default/order/1/').status_code, 404)
+        # 他のテーブルのトークンでは開けない
+        self.assertEqual(self.client.get('/s/default/order/2/', {'t': token}).status_code, 404)
+
+    def test_invalid_token_is_rejected_without_queries(self):
+        self.client.get('/s/default/order/1/', {'t': make_table_token(self.table)})
+        # 送信IDがあっても、重複の確認より先にトークンで拒否する
+        with self.assertNumQueries(0):
+            response = self.submit_order(self.other_table, make_table_token(self.table), client_token='offline-1')
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertEqual(self.submit_order(self.table, make_table_token(self.table), 'offline-1').json()['status'], 'success')
+        # 正しいトークンでの再送は重複として扱う
+        response = self.submit_order(self.table, make_table_token(self.table), 'offline-1').json()
+        self.assertTrue(response['duplicate'])
+
+    def test_order_status_requires_table_token(self):
+        token = make_table_token(self.table)
+        order_id = self.submit_order(self.table, token).json()['order_id']
+        url = f'/s/default/order/1/status/{order_id}/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_X_TABLE_TOKEN=make_table_token(self.other_table)).status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_X_TABLE_TOKEN=token).json()['status'], 'pending')
+        self.assertEqual(self.client.get(f'/order/1/status/{order_id}/', {'t': token}).status_code, 200)
+        self.assertEqual(self.client.get(f'/order/1/status/{order_id}/').status_code, 404)
+
+    def test_rotated_token_invalidates_old_qr_code(self):
+        old_token = make_table_token(self.table)
+        # キャッシュに残っている再発行前のテーブルが使われないこと
+        self.assertEqual(self.client.get('/s/default/order/1/', {'t': old_token}).status_code, 200)
+        stale = Table.objects.get(pk=self.table.pk)
+        rotate_table_token(stale)
+        new_token = rotate_table_token(self.table)
+        self.assertEqual(self.table.token_version, 3)
+        with self.assertNumQueries(1):
+            # 古いトークンの送信はテーブルを読み込むだけで拒否される
+            self.assertEqual(self.submit_order(self.table, old_token, 'offline-2').json()['status'], 'error')
+        self.assertEqual(self.client.get('/s/default/order/1/', {'t': old_token}).status_code, 404)
+        self.assertEqual(self.client.get('/s/default/order/1/', {'t': new_token}).status_code, 200)
+
+
+class CheckoutTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.beer = MenuItem.objects.create(category=self.category, name='ビール', price=500)
+        self.cola = MenuItem.objects.create(category=self.category, name='コーラ', price=301)
+        self.beer_line = self.create_order(self.beer, 2, status='delivered')
+        self.cola_line = self.create_order(self.cola, 1)
+        self.login()
+
+    def create_order(self, menu_item, quantity, status='pending'):
+        order = Order.objects.create(
+            store=self.store, table=self.table, status=status, total_amount=menu_item.price * quantity,
+        )
+        return OrderItem.objects.create(order=order, menu_item=menu_item, quantity=quantity, unit_price=menu_item.price)
+
+    def test_split_evenly_gives_remainder_to_first_payers(self):
+        self.assertEqual(split_evenly(1301, 3), [434, 434, 433])
+        self.assertEqual(split_evenly(900, 3), [300, 300, 300])
+        with self.assertRaises(CheckoutError):
+            split_evenly(900, 0)
+
+    def test_settle_closes_tab_and_adds_to_daily_sales(self):
+        response = self.client.post(f'/hall/table/{self.table.id}/settle/', {'split_method': 'even', 'split_count': '3'})
+        checkout = Checkout.objects.get()
+        self.assertRedirects(response, f'/hall/checkout/{checkout.id}/')
+        self.assertEqual(checkout.total_amount, 1301)
+        self.assertEqual([payment['amount'] for payment in checkout.payments], [434, 434, 433])
+        self.assertFalse(Order.objects.filter(is_settled=False).exists())
+        self.assertEqual(Order.objects.filter(checkout=checkout).count(), 2)
+
+        rollup = DailySalesRollup.objects.get()
+        self.assertEqual((rollup.checkout_count, rollup.order_count, rollup.item_count, rollup.total_amount), (1, 2, 3, 1301))
+        # 次の会計は同じ日の集計に加算される
+        self.create_order(self.cola, 1, status='delivered')
+        checkout_table(self.table)
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.checkout_count, rollup.total_amount), (2, 1602))
+
+        self.assertContains(self.client.get(f'/hall/checkout/{checkout.id}/'), '¥434')
+        self.assertEqual(self.client.get(f'/hall/table/{self.table.id}/').context['summary']['total'], 0)
+
+    def test_table_with_checkouts_can_be_deleted(self):
+        checkout_table(self.table)
+        self.create_order(self.cola, 1)
+        self.table.delete()
+        self.assertFalse(Checkout.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_hall_overview_counts_only_unsettled_orders(self):
+        checkout_table(self.table)
+        self.create_order(self.cola, 1)
+        table = self.client.get('/hall/').context['tables'].get()
+        self.assertEqual((table.tab_total, table.tab_order_count, table.undelivered_count), (301, 1, 1))
+
+    def test_kitchen_keeps_settled_orders_until_finished(self):
+        # 先に会計したテーブル（コーラはまだ調理前、ビールは提供済み）
+        checkout_table(self.table)
+        orders = self.client.get('/kitchen_view/').context['orders']
+        self.assertEqual([order.id for order in orders], [self.cola_line.order_id])
+        dishes = self.client.get('/api/kitchen/by-dish/').json()['dishes']
+        self.assertEqual([dish['menu_item_id'] for dish in dishes], [self.cola.id])
+
+    def test_split_by_item(self):
+        checkout = checkout_table(self.table, 'item', assignments={self.beer_line.id: 2, self.cola_line.id: 1})
+        self.assertEqual(checkout.payments, [
+            {'amount': 301, 'lines': [self.cola_line.id]},
+            {'amount': 1000, 'lines': [self.beer_line.id]},
+        ])
+
+    def test_failed_checkout_changes_nothing(self):
+        response = self.client.post(
+            f'/hall/table/{self.table.id}/settle/',
+            {'split_method': 'item', f'payer_{self.beer_line.id}': '1'},
+        )
+        self.assertRedirects(response, f'/hall/table/{self.table.id}/')
+        self.assertFalse(Checkout.objects.exists())
+        self.assertFalse(DailySalesRollup.objects.exists())
+        self.assertEqual(Order.objects.filter(is_settled=False).count(), 2)
+
+
+class AllowedHostTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        config.server_ips.clear()
+
+    def test_server_ips_are_not_read_on_every_request(self):
+        with mock.patch('qr.config.get_server_ips', wraps=config.get_server_ips) as get_server_ips:
+            for _ in range(3):
+                self.client.get('/')
+        self.assertEqual(get_server_ips.call_count, 1)
+
+    def test_disallowed_hosts_refresh_server_ips_once_per_interval(self):
+        self.client.get('/')
+        with mock.patch('qr.config.get_server_ips', wraps=config.get_server_ips) as get_server_ips:
+            for _ in range(3):
+                self.assertEqual(self.client.get('/', HTTP_HOST='192.168.1.50').status_code, 400)
+        self.assertEqual(get_server_ips.call_count, 1)
+
+    def test_new_server_ip_is_allowed_immediately(self):
+        self.client.get('/')
+        self.assertEqual(self.client.get('/', HTTP_HOST='192.168.1.50').status_code, 400)
+        StoreSettings.objects.create(
+            store=self.store, wifi_ssid='ssid', wifi_password='pass', server_ip='192.168.1.50', password='admin',
+        )
+        self.assertNotEqual(self.client.get('/', HTTP_HOST='192.168.1.50').status_code, 400)
+
+
+class OrderAdminTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create(store=self.store, table=self.table)
+        self.model_admin = admin.site._registry[Order]
+
+    def save_status(self, status):
+        request = RequestFactory().post('/admin/')
+        request.user = User(is_superuser=True, is_staff=True)
+        request._messages = CookieStorage(request)
+        form = modelform_factory(Order, fields=['status'])({'status': status}, instance=self.order)
+        self.assertTrue(form.is_valid())
+        self.model_admin.save_model(request, form.save(commit=False), form, change=True)
+        self.order.refresh_from_db()
+        return [str(message) for message in get_messages(request)]
+
+    def test_status_change_goes_through_transitions(self):
+        self.save_status('delivered')
+        self.assertEqual(self.order.status, 'delivered')
+        transition = OrderStatusTransition.objects.get()
+        self.assertEqual((transition.from_status, transition.to_status), ('pending', 'delivered'))
+        self.assertEqual(get_cached_order_status(self.order.id)['status'], 'delivered')
+
+    def test_illegal_status_change_is_rejected(self):
+        self.save_status('delivered')
+        messages = self.save_status('pending')
+        self.assertEqual(self.order.status, 'delivered')
+        self.assertEqual(OrderStatusTransition.objects.count(), 1)
+        self.assertIn('ステータスを変更できませんでした', messages[0])
+
+
+class AdminChangeListTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.orders = [Order.objects.create(store=self.store, table=self.table) for _ in range(5)]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    @mock.patch('qr.paginators.COUNT_LIMIT', 3)
+    def test_count_is_capped_or_estimated(self):
+        # SQLite には統計情報がないので、絞り込みがなくても上限までしか数えない
+        self.assertIsNone(estimate_row_count(Order))
+        self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 2).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(store=self.store), 2).count, 3)
+        with mock.patch('qr.paginators.estimate_row_count', return_value=1000000):
+            self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 2).count, 1000000)
+            # 絞り込みがある場合は推定件数を使わない
+            self.assertEqual(EstimatedCountPaginator(Order.objects.filter(store=self.store), 2).count, 3)
+
+    def test_changelist_links_to_older_rows(self):
+        newest = [order.id for order in reversed(self.orders)]
+        with mock.patch.object(admin.site._registry[Order], 'list_per_page', 2):
+            response = self.client.get('/admin/qr/order/')
+            self.assertEqual([order.id for order in response.context['cl'].result_list], newest[:2])
+            self.assertContains(response, f'?id__lt={newest[1]}')
+            self.assertContains(response, 'これより古い注文を表示')
+
+            response = self.client.get('/admin/qr/order/', {'id__lt': newest[1]})
+            self.assertEqual([order.id for order in response.context['cl'].result_list], newest[2:4])
+
+            # 最後の行まで表示した場合はリンクを出さない
+            response = self.client.get('/admin/qr/order/', {'id__lt': newest[3]})
+            self.assertEqual([order.id for order in response.context['cl'].result_list], newest[4:])
+            self.assertNotContains(response, 'これより古い注文を表示')
+
+
+class StockTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cake = MenuItem.objects.create(category=self.category, name='ケーキ', price=400, stock=3)
+        self.tea = MenuItem.objects.create(category=self.category, name='紅茶', price=300, stock=5)
+
+    def submit_order(self, *items):
+        return self.post_order(items).json()
+
+    def test_over_quantity_order_is_sold_out(self):
+        response = self.submit_order((self.cake, 4))
+        self.assertEqual(response['sold_out'], [self.cake.id])
+        self.cake.refresh_from_db()
+        self.assertEqual(self.cake.stock, 3)
+        self.assertFalse(Order.objects.exists())
+
+    def test_last_stock_sells_out_item(self):
+        self.assertEqual(self.submit_order((self.cake, 2))['status'], 'success')
+        self.assertEqual(self.submit_order((self.cake, 2))['sold_out'], [self.cake.id])
+        self.assertEqual(self.submit_order((self.cake, 1))['status'], 'success')
+        self.cake.refresh_from_db()
+        self.assertEqual((self.cake.stock, self.cake.is_available), (0, False))
+        self.assertEqual(self.submit_order((self.cake, 1))['sold_out'], [self.cake.id])
+
+    def test_stock_taken_by_concurrent_order_is_not_oversold(self):
+        # 在庫を読んだ後、減らす前に別の注文が残りの在庫を確保した場合
+        def get_then_sell_out(model, **kwargs):
+            menu_item = model.objects.get(**kwargs)
+            model.objects.filter(id=menu_item.id).update(stock=1)
+            return menu_item
+
+        with mock.patch('qr.views.get_object_or_404', side_effect=get_then_sell_out):
+            response = self.submit_order((self.cake, 2))
+        self.assertEqual(response['sold_out'], [self.cake.id])
+        # （別の注文の確保もこの注文のトランザクション内で行っているので、一緒にロールバックされる）
+        self.assertFalse(Order.objects.exists())
+
+    def test_failed_order_rolls_back_earlier_lines(self):
+        response = self.submit_order((self.tea, 2), (self.cake, 5))
+        self.assertEqual(response['sold_out'], [self.cake.id])
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.stock, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class StatusTransitionTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.orders = [Order.objects.create(store=self.store, table=self.table) for _ in range(3)]
+        # 他の店舗の注文
+        other_store = Store.objects.create(name='別の店舗', slug='other')
+        self.other_order = Order.objects.create(
+            store=other_store, table=Table.objects.create(store=other_store, table_number=1),
+        )
+        self.login()
+
+    def update_statuses(self, *transitions):
+        return self.client.post(
+            '/update-order-status/batch/',
+            json.dumps({'transitions': [{'order_id': order.id, 'status': status} for order, status in transitions]}),
+            content_type='application/json',
+        ).json()
+
+    def test_batch_update_records_one_transition_per_changed_order(self):
+        first, second, third = self.orders
+        response = self.update_statuses((first, 'preparing'), (second, 'preparing'), (third, 'pending'))
+        self.assertEqual(response['status'], 'success')
+        # 変更のない注文（third）は更新も記録もしない
+        self.assertEqual(sorted(order['id'] for order in response['orders']), [first.id, second.id])
+        transitions = OrderStatusTransition.objects.order_by('order_id')
+        self.assertEqual(
+            [(t.order_id, t.from_status, t.to_status) for t in transitions],
+            [(first.id, 'pending', 'preparing'), (second.id, 'pending', 'preparing')],
+        )
+        self.assertEqual(get_cached_order_status(first.id)['status'], 'preparing')
+
+    def test_illegal_transition_is_rejected(self):
+        first, second, _ = self.orders
+        self.update_statuses((first, 'delivered'))
+        response = self.update_statuses((first, 'pending'), (second, 'ready'), (self.other_order, 'ready'))
+        self.assertEqual(response['status'], 'partial')
+        self.assertEqual(
+            sorted(error['order_id'] for error in response['errors']), sorted([first.id, self.other_order.id]),
+        )
+        first.refresh_from_db()
+        self.other_order.refresh_from_db()
+        self.assertEqual((first.status, self.other_order.status), ('delivered', 'pending'))
+        # 許可された遷移（second）だけが適用される
+        self.assertEqual(OrderStatusTransition.objects.filter(order=second).get().to_status, 'ready')
+        self.assertEqual(OrderStatusTransition.objects.filter(order=first).count(), 1)
+
+    def test_consecutive_transitions_are_logged_in_order(self):
+        first, _, _ = self.orders
+        updated_orders, errors = apply_status_transitions(
+            self.store, [(first.id, 'preparing'), (first.id, 'ready'), (self.other_order.id, 'ready')],
+        )
+        self.assertEqual(([order.id for order in updated_orders], len(errors)), ([first.id], 1))
+        transitions = OrderStatusTransition.objects.filter(order=first)
+        self.assertEqual(
+            [(t.from_status, t.to_status) for t in transitions], [('pending', 'preparing'), ('preparing', 'ready')],
+        )
+        # 同じ変更の履歴は同じ日時で記録する
+        self.assertEqual(len({t.created_at for t in transitions}), 1)
+        self.assertEqual(get_cached_order_status(first.id)['status'], 'ready')
+
+
+    def test_finished_order_status_expires_sooner(self):
+        first, second, _ = self.orders
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            apply_status_transitions(self.store, [(first.id, 'ready'), (second.id, 'delivered')])
+        timeouts = {call.args[1]['order_id']: call.args[2] for call in cache_set.call_args_list}
+        self.assertEqual(timeouts, {first.id: ORDER_STATUS_TIMEOUT, second.id: ORDER_STATUS_FINISHED_TIMEOUT})
+
+
+class TicketTimeTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cola = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+        self.noon = local_day_range(timezone.localdate())[0] + timedelta(hours=12)
+
+    def create_order(self, *history):
+        """注文日時（正午）からの秒数で (ステータス, 秒) の履歴を持つ注文を作る"""
+        order = Order.objects.create(store=self.store, table=self.table)
+        Order.objects.filter(id=order.id).update(created_at=self.noon)
+        OrderItem.objects.create(order=order, menu_item=self.cola, quantity=1, unit_price=300)
+        OrderStatusTransition.objects.bulk_create([
+            OrderStatusTransition(order=order, to_status=status, created_at=self.noon + timedelta(seconds=seconds))
+            for status, seconds in [('pending', 0), *history]
+        ])
+        return order
+
+    def test_percentile_interpolates_between_values(self):
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([60.0], 95), 60.0)
+        values = [60.0, 120.0, 180.0]
+        self.assertEqual([percentile(values, pct) for pct in (50, 90, 95)], [120.0, 168.0, 174.0])
+
+    def test_stats_per_hour_day_and_dish(self):
+        self.create_order(('confirmed', 60))
+        self.create_order(('confirmed', 120), ('confirmed', 150))
+        # 確認を飛ばして調理を始めた注文
+        self.create_order(('preparing', 180), ('ready', 480))
+        compute_ticket_time_stats(timezone.localdate(), timezone.localdate())
+
+        stats = TicketTimeStat.objects.filter(store=self.store, metric='confirm')
+        self.assertEqual(
+            {(stat.granularity, stat.menu_item_id) for stat in stats},
+            {('day', None), ('day', self.cola.id), ('hour', None), ('hour', self.cola.id)},
+        )
+        hour = stats.get(granularity='hour', menu_item=None)
+        self.assertEqual(timezone.localtime(hour.period_start), timezone.localtime(self.noon))
+        # 2回目の確認（150秒）ではなく最初に確認した時点までの時間
+        self.assertEqual(
+            (hour.sample_count, hour.p50, hour.p90, hour.p95, hour.max_seconds), (3, 120.0, 168.0, 174.0, 180.0),
+        )
+        cook = TicketTimeStat.objects.get(granularity='day', menu_item=None, metric='cook')
+        self.assertEqual((cook.sample_count, cook.p50), (1, 300.0))
+        # 提供していない注文は提供までの時間に含めない
+        self.assertFalse(TicketTimeStat.objects.filter(metric__in=['deliver', 'total']).exists())
+
+
+class KitchenBoardTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cola = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+        self.beer = MenuItem.objects.create(category=self.category, name='ビール', price=500)
+        self.cola_only = self.create_order((self.cola, 2))
+        self.mixed = self.create_order((self.cola, 1), (self.beer, 1))
+        # 他の店舗の注文
+        other_store = Store.objects.create(name='別の店舗', slug='other')
+        self.other_order = Order.objects.create(
+            store=other_store, table=Table.objects.create(store=other_store, table_number=1),
+        )
+        OrderItem.objects.create(order=self.other_order, menu_item=self.cola, quantity=1, unit_price=300)
+        self.login()
+
+    def create_order(self, *items):
+        order = Order.objects.create(store=self.store, table=self.table)
+        for menu_item, quantity in items:
+            OrderItem.objects.create(order=order, menu_item=menu_item, quantity=quantity, unit_price=menu_item.price)
+        return order
+
+    def update_dish(self, menu_item, status):
+        return self.client.post(f'/update-dish-status/{menu_item.id}/', {'status': status}).json()
+
+    def order_statuses(self):
+        return {order.id: order.status for order in Order.objects.all()}
+
+    def test_preparing_dish_starts_its_orders(self):
+        response = self.update_dish(self.cola, 'preparing')
+        self.assertEqual(response['updated_lines'], 2)
+        self.assertEqual(sorted(response['updated_orders']), [self.cola_only.id, self.mixed.id])
+        self.assertEqual(self.order_statuses(), {
+            self.cola_only.id: 'preparing', self.mixed.id: 'preparing', self.other_order.id: 'pending',
+        })
+        self.assertEqual(
+            sorted(OrderStatusTransition.objects.values_list('order_id', 'from_status', 'to_status')),
+            [(self.cola_only.id, 'pending', 'preparing'), (self.mixed.id, 'pending', 'preparing')],
+        )
+        self.assertEqual(self.other_order.items.get().status, 'waiting')
+        self.assertEqual(get_cached_order_status(self.mixed.id)['status'], 'preparing')
+
+    def test_order_is_ready_when_all_dishes_are_prepared(self):
+        response = self.update_dish(self.cola, 'prepared')
+        # ビールがまだの注文は準備完了にしない
+        self.assertEqual(response['updated_orders'], [self.cola_only.id])
+        self.assertEqual(self.order_statuses()[self.mixed.id], 'pending')
+
+        response = self.update_dish(self.beer, 'prepared')
+        self.assertEqual(response['updated_orders'], [self.mixed.id])
+        self.assertEqual(self.order_statuses()[self.mixed.id], 'ready')
+        self.assertEqual(OrderStatusTransition.objects.filter(order=self.mixed).get().from_status, 'pending')
+
+    def test_dish_status_only_moves_forward(self):
+        self.update_dish(self.cola, 'prepared')
+        response = self.update_dish(self.cola, 'preparing')
+        self.assertEqual((response['updated_lines'], response['updated_orders']), (0, []))
+        self.assertEqual(self.update_dish(self.cola, 'waiting')['status'], 'error')
+        self.assertEqual(set(self.cola_only.items.values_list('status', flat=True)), {'prepared'})
+
+
+# レート制限は各テストの ORDER_RATE_LIMIT で有効にする
+class RateLimitTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        ratelimit._buckets.clear()
+        self.tables = [self.table, Table.objects.create(store=self.store, table_number=2)]
+        self.menu_item = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+
+    def submit_order(self, table, ip):
+        return self.post_order([(self.menu_item, 1)], table=table, REMOTE_ADDR=ip)
+
+    def assert_rate_limited(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    # 補充しない設定にして、時間によって結果が変わらないようにする
+    @override_settings(ORDER_RATE_LIMIT={
+        'IP': {'CAPACITY': 2, 'PER_MINUTE': 0}, 'TABLE': {'CAPACITY': 100, 'PER_MINUTE': 0},
+    })
+    def test_ip_bucket(self):
+        for table in self.tables:
+            self.assertEqual(self.submit_order(table, '192.168.1.10').json()['status'], 'success')
+        self.assert_rate_limited(self.submit_order(self.tables[0], '192.168.1.10'))
+        # 他の端末からは送信できる
+        self.assertEqual(self.submit_order(self.tables[0], '192.168.1.11').json()['status'], 'success')
+
+    @override_settings(ORDER_RATE_LIMIT={
+        'IP': {'CAPACITY': 100, 'PER_MINUTE': 0}, 'TABLE': {'CAPACITY': 2, 'PER_MINUTE': 0},
+    })
+    def test_table_bucket(self):
+        for ip in ('192.168.1.10', '192.168.1.11'):
+            self.assertEqual(self.submit_order(self.tables[0], ip).json()['status'], 'success')
+        self.assert_rate_limited(self.submit_order(self.tables[0], '192.168.1.12'))
+        self.assertEqual(Order.objects.filter(table=self.tables[0]).count(), 2)
+        # 他のテーブルは制限されない
+        self.assertEqual(self.submit_order(self.tables[1], '192.168.1.12').json()['status'], 'success')
+
+
+class MenuImportTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        # 同じ名前のカテゴリ（ランチとディナーで分けている場合など）
+        self.lunch = self.category
+        self.dinner = MenuCategory.objects.create(store=self.store, name='ドリンク', order=1)
+        self.cola = MenuItem.objects.create(category=self.lunch, name='コーラ', price=300)
+        self.beer = MenuItem.objects.create(category=self.dinner, name='ビール', price=500, is_available=False)
+
+    def export_rows(self):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(write_menu_workbook(self.store))
+        sheet = workbook.active
+        return workbook, sheet, [dict(zip([key for key, _ in COLUMNS], row)) for row in sheet.iter_rows(values_only=True)][1:]
+
+    def reimport(self, workbook):
+        output = io.BytesIO()
+        workbook.save(output)
+        output.seek(0)
+        return compute_menu_diff(self.store, read_menu_workbook(output))
+
+    def test_export_import_round_trip_has_no_changes(self):
+        workbook, _, rows = self.export_rows()
+        self.assertEqual({row['category_id'] for row in rows}, {self.lunch.id, self.dinner.id})
+        self.assertFalse(self.reimport(workbook).has_changes)
+
+    def test_categories_are_matched_by_id(self):
+        workbook, sheet, rows = self.export_rows()
+        columns = [key for key, _ in COLUMNS]
+        # ディナーのカテゴリ名を変更し、ディナーにメニューを追加する
+        beer_row = next(index for index, row in enumerate(rows, start=2) if row['id'] == self.beer.id)
+        sheet.cell(beer_row, columns.index('category') + 1, 'ドリンク（夜）')
+        sheet.append([None, self.dinner.id, 'ドリンク（夜）', 2, 'ハイボール', '', '', 450, None, '○', 0])
+        apply_menu_diff(self.store, self.reimport(workbook))
+
+        self.dinner.refresh_from_db()
+        self.assertEqual(self.dinner.name, 'ドリンク（夜）')
+        self.assertEqual(MenuItem.objects.get(name='ハイボール').category, self.dinner)
+        self.assertEqual(MenuCategory.objects.count(), 2)
+
+    def test_ambiguous_category_name_requires_id(self):
+        workbook, sheet, _ = self.export_rows()
+        sheet.append([None, None, 'ドリンク', None, 'ハイボール', '', '', 450, None, '○', 0])
+        with self.assertRaises(MenuImportError) as context:
+            self.reimport(workbook)
+        self.assertIn('カテゴリIDを入力してください', context.exception.errors[0])
+
+    def test_blank_availability_keeps_current_value(self):
+        workbook, sheet, rows = self.export_rows()
+        columns = [key for key, _ in COLUMNS]
+        for index in range(len(rows)):
+            sheet.cell(index + 2, columns.index('is_available') + 1, None)
+        sheet.append([None, self.lunch.id, 'ドリンク', 1, '緑茶', '', '', 200, None, None, 0])
+        diff = self.reimport(workbook)
+        self.assertEqual(diff.summary()['update_items'], 0)
+        apply_menu_diff(self.store, diff)
+
+        self.beer.refresh_from_db()
+        self.assertFalse(self.beer.is_available)
+        self.assertTrue(MenuItem.objects.get(name='緑茶').is_available)
+
+
+class MenuSearchTests(QrTestCase):
+    def test_width_case_and_kana_are_normalized(self):
+        # 全角英数字・半角カタカナ（NFKC）、大文字、カタカナ、空白
+        self.assertEqual(normalize_search_text('ＣＯＬＡ　Zero'), 'colazero')
+        self.assertEqual(normalize_search_text('ｺｰﾗ'), 'こーら')
+        self.assertEqual(normalize_search_text('ヴァニラ アイス'), 'ゔぁにらあいす')
+        self.assertEqual(normalize_search_text(None), '')
+
+    def test_menu_is_found_by_reading(self):
+        MenuItem.objects.create(category=self.category, name='烏龍茶', reading='ウーロンチャ', price=300, description='')
+        item = build_menu_snapshot(self.store.id)[0]['items'][0]
+        self.assertEqual(item['search'], build_search_text('烏龍茶', 'ウーロンチャ'))
+        self.assertIn(normalize_search_text('ｳｰﾛﾝ'), item['search'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MenuImageTests(QrTestCase):
+    def test_menu_snapshot_does_not_open_image_files(self):
+        item = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+        # 画像の大きさが未作成で、画像ファイルもないメニュー
+        MenuItem.objects.filter(id=item.id).update(image='menu_images/missing.jpg')
+        snapshot = build_menu_snapshot(self.store.id)
+        self.assertIsNone(snapshot[0]['items'][0]['image_width'])
+
+
+@override_settings(TASK_QUEUE={'EAGER': False, 'RETRY_DELAY': 5})
+class TicketPrintingTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        self.menu_item = MenuItem.objects.create(category=self.category, name='コーラ', price=300)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        printer = self.settings(TICKET_PRINTER={'SINK': 'file', 'FORMAT': 'text', 'PATH': self.path, 'MAX_ATTEMPTS': 2})
+        printer.enable()
+        self.addCleanup(printer.disable)
+
+    def submit_order(self):
+        return self.post_order([(self.menu_item, 1)]).json()['order_id']
+
+    def printed(self):
+        return sorted(os.listdir(self.path))
+
+    def test_queued_tickets_are_printed_in_one_batch(self):
+        order_ids = [self.submit_order() for _ in range(3)]
+        self.assertEqual(Task.objects.filter(name='print_ticket', status='queued').count(), 3)
+        self.assertEqual(self.printed(), [])
+
+        with mock.patch.object(FileSink, 'write', autospec=True, side_effect=FileSink.write) as write:
+            run_worker(once=True)
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(self.printed(), [f'order_{order_id}.txt' for order_id in order_ids])
+        self.assertEqual(Task.objects.filter(name='print_ticket', status='succeeded').count(), 3)
+
+    def test_failed_print_is_retried_with_backoff(self):
+        self.submit_order()
+        self.submit_order()
+        with mock.patch.object(FileSink, 'write', side_effect=OSError('プリンターに接続できません')), \
+                self.assertLogs('qr.tasks', 'ERROR'):
+            run_worker(once=True)
+        # まとめて取り出した伝票も含めて、待ってから印刷し直す
+        for task_obj in Task.objects.filter(name='print_ticket'):
+            self.assertEqual((task_obj.status, task_obj.attempts, task_obj.locked_by), ('queued', 1, ''))
+            self.assertGreater(task_obj.run_at, timezone.now())
+            self.assertIn('プリンターに接続できません', task_obj.last_error)
+
+    def test_tickets_failed_after_max_attempts_can_be_reprinted(self):
+        order_id = self.submit_order()
+        with mock.patch.object(FileSink, 'write', side_effect=OSError('プリンターに接続できません')), \
+                self.assertLogs('qr.tasks', 'ERROR'):
+            run_worker(once=True)
+            Task.objects.update(run_at=timezone.now())
+            run_worker(once=True)
+        self.assertEqual(Task.objects.get().status, 'failed')
+
+        self.login()
+        response = self.client.get('/kitchen_view/')
+        self.assertEqual(response.context['failed_tickets'], [order_id])
+        self.assertContains(response, '伝票を印刷できませんでした')
+
+        self.client.post('/kitchen_view/reprint/')
+        self.assertEqual(Task.objects.get().status, 'queued')
+        run_worker(once=True)
+        self.assertEqual(self.printed(), [f'order_{order_id}.txt'])
+        self.assertEqual(self.client.get('/kitchen_view/').context['failed_tickets'], [])
+
+
+def failing_task():
+    raise ValueError('失敗しました')
+
+
+@override_settings(TASK_QUEUE={'EAGER': False, 'RETRY_DELAY': 10})
+class TaskQueueTests(QrTestCase):
+    def setUp(self):
+        super().setUp()
+        registry = mock.patch.dict(tasks._registry, {
+            'tests.echo': (lambda **kwargs: kwargs, None),
+            'tests.fail': (failing_task, 3),
+        })
+        registry.start()
+        self.addCleanup(registry.stop)
+
+    def test_task_is_claimed_by_one_worker(self):
+        task_obj = enqueue('tests.echo', value=1)
+        claimed = claim_task(task_obj.id, 'worker-1')
+        self.assertEqual((claimed.status, claimed.attempts, claimed.locked_by), ('running', 1, 'worker-1'))
+        self.assertIsNone(claim_task(task_obj.id, 'worker-2'))
+
+        run_task(claimed)
+        claimed.refresh_from_db()
+        self.assertEqual((claimed.status, claimed.result, claimed.locked_by), ('succeeded', {'value': 1}, ''))
+
+    def test_scheduled_task_waits_until_run_at(self):
+        later = enqueue('tests.echo', run_at=timezone.now() + timedelta(hours=1))
+        due = enqueue('tests.echo')
+        self.assertIsNone(claim_task(later.id, 'worker-1'))
+        self.assertEqual(claim_next('worker-1').id, due.id)
+        self.assertIsNone(claim_next('worker-1'))
+
+    def test_failed_task_backs_off_until_max_attempts(self):
+        task_obj = enqueue('tests.fail')
+        self.assertEqual(task_obj.max_attempts, 3)
+        delays = []
+        with self.assertLogs('qr.tasks', 'ERROR'):
+            for _ in range(3):
+                started = timezone.now()
+                task_obj = run_task(claim_task(task_obj.id, 'worker-1'))
+                if task_obj.status == 'queued':
+                    delays.append(round((task_obj.run_at - started).total_seconds()))
+                    Task.objects.filter(id=task_obj.id).update(run_at=timezone.now())
+        # 待ち時間は RETRY_DELAY から倍々に増える
+        self.assertEqual(delays, [10, 20])
+        self.assertEqual((task_obj.status, task_obj.attempts), ('failed', 3))
+        self.assertIn('失敗しました', task_obj.last_error)
+
+        self.assertTrue(retry_task(task_obj.id))
+        self.assertFalse(retry_task(task_obj.id))
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('queued', 0))
+
+    def test_unregistered_task_fails_without_retry(self):
+        task_obj = Task.objects.create(name='tests.removed')
+        with self.assertLogs('qr.tasks', 'ERROR'):
+            self.assertEqual(run_worker(once=True), 1)
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('failed', 1))
+
+    def test_stale_running_task_is_requeued(self):
+        task_obj = claim_task(enqueue('tests.echo').id, 'worker-1')
+        self.assertEqual(recover_stale_tasks(60), 0)
+        Task.objects.filter(id=task_obj.id).update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(recover_stale_tasks(60), 1)
+        self.assertEqual(run_worker(once=True), 1)
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('succeeded', 2))
@@ -0,0 +1,106 @@
+"""提供時間（注文から提供までの各段階の所要時間）の集計"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, OrderStatusTransition, TicketTimeStat
+
+# 指標ごとの（開始とみなすステータス, 終了とみなすステータス）
+# 厨房がステータスを飛ばすこともあるので、いずれかに最初に入った時点を使う
+METRIC_SPANS = {
+    'confirm': (['pending'], ['confirmed', 'preparing']),
+    'cook': (['preparing'], ['ready']),
+    'deliver': (['ready'], ['delivered']),
+    'total': (['pending'], ['delivered']),
+}
+
+
+def percentile(sorted_values, pct):
+    """ソート済みの値のパーセンタイル（線形補間）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def order_durations(entered_at):
+    """ステータスごとの最初の到達日時から、各指標の所要時間（秒）を計算"""
+    durations = {}
+    for metric, (start_statuses, end_statuses) in METRIC_SPANS.items():
+        starts = [entered_at[status] for status in start_statuses if status in entered_at]
+        ends = [entered_at[status] for status in end_statuses if status in entered_at]
+        if starts and ends and min(ends) >= min(starts):
+            durations[metric] = (min(ends) - min(starts)).total_seconds()
+    return durations
+
+
+def local_day_range(day):
+    """ローカル日付の [開始, 終了) を返す"""
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, start + timedelta(days=1)
+
+
+def compute_ticket_time_stats(first_day, last_day):
+    """指定した期間（ローカル日付・両端を含む）の集計を作り直す
+    
+    店舗ごとに、注文日時で1時間ごと・1日ごとに、全メニューとメニュー別の集計を作成する。
+    """
+    start, _ = local_day_range(first_day)
+    _, end = local_day_range(last_day)
+
+    entered = defaultdict(dict)
+    history = (
+        OrderStatusTransition.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+        .order_by('order_id', 'created_at', 'id')
+        .values_list('order_id', 'to_status', 'created_at')
+    )
+    for order_id, to_status, created_at in history:
+        entered[order_id].setdefault(to_status, created_at)
+
+    created = {
+        order_id: (created_at, store_id)
+        for order_id, created_at, store_id in Order.objects.filter(
+            created_at__gte=start, created_at__lt=end
+        ).values_list('id', 'created_at', 'store_id')
+    }
+    dishes = defaultdict(set)
+    for order_id, menu_item_id in OrderItem.objects.filter(order_id__in=list(created)).values_list('order_id', 'menu_item_id'):
+        dishes[order_id].add(menu_item_id)
+
+    samples = defaultdict(list)
+    for order_id, entered_at in entered.items():
+        if order_id not in created:
+            continue
+        created_at, store_id = created[order_id]
+        local_created = timezone.localtime(created_at)
+        hour = local_created.replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+        for metric, seconds in order_durations(entered_at).items():
+            for menu_item_id in [None] + sorted(dishes[order_id]):
+                samples[(store_id, 'hour', hour, menu_item_id, metric)].append(seconds)
+                samples[(store_id, 'day', day, menu_item_id, metric)].append(seconds)
+
+    stats = []
+    for (store_id, granularity, period_start, menu_item_id, metric), values in samples.items():
+        values.sort()
+        stats.append(TicketTimeStat(
+            store_id=store_id,
+            granularity=granularity,
+            period_start=period_start,
+            menu_item_id=menu_item_id,
+            metric=metric,
+            sample_count=len(values),
+            p50=percentile(values, 50),
+            p90=percentile(values, 90),
+            p95=percentile(values, 95),
+            max_seconds=values[-1],
+        ))
+
+    with transaction.atomic():
+        TicketTimeStat.objects.filter(period_start__gte=start, period_start__lt=end).delete()
+        TicketTimeStat.objects.bulk_create(stats)
+    return len(stats)
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     # 基本画面
     path('', views.index, name='index'),
+    path('s/<slug:store_slug>/', views.index, name='store_index'),
     path('initial-setup/', views.initial_setup, name='initial_setup'),
     path('logout/', views.logout, name='logout'),
     path('settings/', views.settings, name='settings'),
@@ -17,14 +18,46 @@ urlpatterns = [
     path('add-menu-item/', views.add_menu_item, name='add_menu_item'),
     path('edit-menu-item/<int:item_id>/', views.edit_menu_item, name='edit_menu_item'),
     path('delete-menu-item/<int:item_id>/', views.delete_menu_item, name='delete_menu_item'),
+    path('menu-management/import/', views.menu_import, name='menu_import'),
+    path('menu-management/export/', views.menu_export, name='menu_export'),
     path('table-management/', views.table_management, name='table_management'),
     path('generate-qr/<int:table_id>/', views.generate_qr_codes, name='generate_qr_codes'),
+    path('generate-qr/<int:table_id>/rotate/', views.rotate_table_qr_token, name='rotate_table_qr_token'),
+    
+    # バックグラウンドタスク
+    path('api/tasks/<int:task_id>/', views.task_status_api, name='task_status_api'),
+    path('api/tasks/<int:task_id>/retry/', views.retry_task_api, name='retry_task_api'),
     
     # 厨房画面
     path('kitchen_view/', views.kitchen_view, name='kitchen_view'),
+    path('kitchen_view/reprint/', views.reprint_tickets, name='reprint_tickets'),
     path('update-order-status/<int:order_id>/', views.update_order_status, name='update_order_status'),
+    path('update-order-status/batch/', views.update_order_status_batch, name='update_order_status_batch'),
+    path('kitchen_view/by-dish/', views.kitchen_by_dish, name='kitchen_by_dish'),
+    path('api/kitchen/by-dish/', views.kitchen_by_dish_api, name='kitchen_by_dish_api'),
+    path('update-dish-status/<int:menu_item_id>/', views.update_dish_status, name='update_dish_status'),
+    
+    path('ticket-metrics/', views.ticket_metrics, name='ticket_metrics'),
+    
+    # ホール画面
+    path('hall/', views.hall_overview, name='hall_overview'),
+    path('hall/table/<int:table_id>/', views.table_tab, name='table_tab'),
+    path('hall/table/<int:table_id>/settle/', views.settle_table, name='settle_table'),
+    path('hall/checkout/<int:checkout_id>/', views.checkout_detail, name='checkout_detail'),
+    path('api/table-tab/<int:table_id>/', views.table_tab_api, name='table_tab_api'),
     
     # 顧客用画面
-    path('order/<int:table_number>/', views.order_menu, name='order_menu'),
-    path('submit-order/', views.submit_order, name='submit_order'),
+    path('s/<slug:store_slug>/order/<int:table_number>/', views.order_menu, name='order_menu'),
+    path('s/<slug:store_slug>/submit-order/', views.submit_order, name='submit_order'),
+    path('s/<slug:store_slug>/order/<int:table_number>/status/<int:order_id>/', views.order_status, name='order_status'),
+    path('s/<slug:store_slug>/api/menu/', views.menu_api, name='menu_api'),
+    
+    # 店舗IDのない旧URL（印刷済みのQRコードや送信待ちの注文のため既定の店舗で受け付ける）
+    path('order/<int:table_number>/', views.legacy_order_menu, name='legacy_order_menu'),
+    path('submit-order/', views.submit_order, name='legacy_submit_order'),
+    path('order/<int:table_number>/status/<int:order_id>/', views.order_status, name='legacy_order_status'),
+    path('sw.js', views.service_worker, name='service_worker'),
+    
+    # 監視用
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
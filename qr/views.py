@@ -1,23 +1,62 @@
+import asyncio
 import json
-import qrcode
-import io
-import base64
+import math
+import posixpath
 import time
-from PIL import Image, ImageDraw, ImageFont
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.http import JsonResponse, HttpResponse, Http404, FileResponse
+from django.core.files.storage import default_storage
 from django.utils import timezone
-from django.db.models import Sum, Count
-from django.conf import settings
-from pathlib import Path
-from .models import StoreSettings, Table, MenuCategory, MenuItem, Order, OrderItem
-from .forms import LoginForm, StoreSettingsForm, TableForm, TableCountForm, MenuCategoryForm, MenuItemForm, OrderStatusForm
+from django.utils.crypto import constant_time_compare
+from django.views import static
+from django.db import IntegrityError, transaction
+from django.db.models import Sum, Count, Min, Q, F, FilteredRelation
+from django.db.models.functions import Coalesce
+# settings は店舗設定のビューの名前なので別名で読み込む
+from django.conf import settings as django_settings
+from .models import Store, StoreSettings, Table, MenuCategory, MenuItem, Order, OrderItem, OrderStatusTransition, TicketTimeStat, Checkout, DailySalesRollup
+from .caches import (
+    aget_order_status, aget_store, aget_table, get_menu_snapshot, get_menu_version, get_order_status,
+    get_store_settings, get_tables_version, invalidate_menu_cache, order_status_etag, refresh_order_statuses, set_order_status,
+)
+from .checkout import MAX_SPLIT_COUNT, CheckoutError, checkout_table
+from .forms import LoginForm, StoreSettingsForm, TableForm, TableCountForm, MenuCategoryForm, MenuImportForm, MenuItemForm, OrderStatusForm
+from .metrics import (
+    KITCHEN_POLLS, ORDERS_SUBMITTED, SUBMIT_ORDER_SECONDS, TABLE_TOKEN_REJECTED, get_metrics_settings, render_metrics,
+    timed,
+)
+from .menu_io import MenuImportError, apply_menu_diff, compute_menu_diff, read_menu_workbook, write_menu_workbook
+from .printing import enqueue_ticket, get_failed_tickets, reprint_failed_tickets
+from .qr_sheets import QR_SHEET_DIR, qr_sheet_path
+from .ratelimit import check_ip_rate, check_table_rate
+from .table_tokens import get_table_token_settings, make_table_token, parse_table_token, rotate_table_token
+from .tasks import enqueue, enqueue_once, get_task_status, retry_task
 
-# config.jsonのパス
-CONFIG_PATH = Path(settings.BASE_DIR) / "config.json"
+
+# 注文ステータスのロングポーリングの最大待ち時間（秒）と確認間隔
+ORDER_STATUS_MAX_WAIT = 25
+ORDER_STATUS_POLL_INTERVAL = 1
+
+# 店舗がまだない状態で初期設定をしたときに作る店舗の店舗ID
+DEFAULT_STORE_SLUG = 'default'
+
+# 注文画面で最初から描画するカテゴリ数（残りはスクロールして近づいたときに描画する）
+ORDER_MENU_EAGER_CATEGORIES = 2
+
+# サービスワーカーのキャッシュ名（キャッシュする内容を変えたら上げる）
+SERVICE_WORKER_CACHE_VERSION = 2
+
+class SoldOutError(Exception):
+    """注文された商品が品切れ・在庫不足"""
+    def __init__(self, menu_item):
+        super().__init__(f'「{menu_item.name}」は品切れです。')
+        self.menu_item = menu_item
 
 def get_client_ip(request):
     """クライアントのIPアドレスを取得"""
@@ -28,10 +67,10 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-def check_wifi_connection(request):
+def check_wifi_connection(request, store_id):
     """WiFi接続チェック"""
     try:
-        store_settings = StoreSettings.objects.first()
+        store_settings = get_store_settings(store_id)
         if not store_settings:
             return False
         
@@ -47,70 +86,105 @@ def check_wifi_connection(request):
     except:
         return False
 
-def index(request):
-    """トップページ（ログイン画面）"""
+def get_default_store():
+    """既定の店舗（店舗IDのない旧URL用。最初に作成した有効な店舗）"""
+    return Store.objects.filter(is_active=True).order_by('id').first()
+
+def get_session_store(request):
+    """セッションで選択中の店舗"""
+    store_id = request.session.get('store_id')
+    if store_id is None:
+        return None
+    return Store.objects.filter(id=store_id, is_active=True).first()
+
+def index(request, store_slug=None):
+    """トップページ（ログイン画面）
+    
+    /s/<店舗ID>/ から開くとその店舗を選択する。店舗IDがない場合は選択中の店舗か既定の店舗。
+    """
+    if store_slug is not None:
+        store = get_object_or_404(Store, slug=store_slug, is_active=True)
+        if request.session.get('store_id') != store.id:
+            # 別の店舗に切り替える場合はログインし直す
+            request.session.pop('authenticated', None)
+            request.session['store_id'] = store.id
+    else:
+        store = get_session_store(request) or get_default_store()
+    
     # 初期設定が済んでいるかチェック
-    if not StoreSettings.objects.exists():
+    store_settings = get_store_settings(store.id) if store else None
+    if not store_settings:
         return redirect('initial_setup')
     
     if request.method == 'POST':
         form = LoginForm(request.POST)
         if form.is_valid():
             password = form.cleaned_data['password']
-            store_settings = StoreSettings.objects.first()
             
-            if store_settings and store_settings.password == password:
+            if store_settings.password == password:
                 request.session['authenticated'] = True
+                request.session['store_id'] = store.id
                 return redirect('admin_dashboard')
             else:
                 messages.error(request, 'パスワードが正しくありません。')
     else:
         form = LoginForm()
     
-    return render(request, 'qr/login.html', {'form': form})
+    return render(request, 'qr/login.html', {'form': form, 'store': store})
 
 def initial_setup(request):
-    """初期設定画面"""
-    if StoreSettings.objects.exists():
+    """初期設定画面（店舗がまだない場合は既定の店舗を作成する）"""
+    store = get_session_store(request) or get_default_store()
+    if store and get_store_settings(store.id):
         return redirect('index')
     
     if request.method == 'POST':
         form = StoreSettingsForm(request.POST)
         if form.is_valid():
-            store_settings = form.save()
+            with transaction.atomic():
+                if store is None:
+                    store = Store.objects.create(name='店舗', slug=DEFAULT_STORE_SLUG)
+                store_settings = form.save(commit=False)
+                store_settings.store = store
+                store_settings.save()
+            request.session['store_id'] = store.id
             
-            # config.jsonにサーバーIPを保存
+            # config.jsonの保存はタスクキューで行う
+            # （ホスト名の検証は店舗設定も見るので、サーバーの再起動は不要）
             server_ip = form.cleaned_data['server_ip']
-            try:
-                with open(CONFIG_PATH, "w") as f:
-                    json.dump({"USER_IP": server_ip}, f)
-                
-                messages.success(request, '初期設定が完了しました。サーバーを再起動します...')
-                
-                # settings.pyのタイムスタンプを更新して自動再起動を促す
-                settings_file = Path(settings.BASE_DIR) / "kk1" / "settings.py"
-                if settings_file.exists():
-                    settings_file.touch()
-                
-                # 再起動待ち画面を表示
-                context = {
-                    'server_ip': server_ip,
-                    'new_url': f'http://{server_ip}:8000'
-                }
-                return render(request, 'qr/restart_wait.html', context)
-                
-            except Exception as e:
-                messages.error(request, f'設定の保存中にエラーが発生しました: {e}')
-                store_settings.delete()  # エラー時は設定を削除
+            enqueue('write_server_config', server_ip=server_ip)
+            
+            messages.success(request, '初期設定が完了しました。')
+            
+            # 新しいアドレスの画面へ移動
+            return redirect(f'http://{server_ip}:8000/s/{store.slug}/')
     else:
         form = StoreSettingsForm()
     
     return render(request, 'qr/initial_setup.html', {'form': form})
 
+def load_admin_store(request):
+    """ログイン中の店舗を request.store に設定（未ログインの場合は False）"""
+    if not request.session.get('authenticated'):
+        return False
+    request.store = get_session_store(request)
+    if request.store is None:
+        request.session.pop('authenticated', None)
+        return False
+    return True
+
 def admin_required(view_func):
-    """管理者認証デコレータ"""
+    """管理者認証デコレータ（ログイン中の店舗を request.store に設定する）"""
+    if asyncio.iscoroutinefunction(view_func):
+        async def async_wrapper(request, *args, **kwargs):
+            # セッションの読み込みはDBアクセスになるのでスレッドで行う
+            if not await sync_to_async(load_admin_store)(request):
+                return redirect('index')
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+    
     def wrapper(request, *args, **kwargs):
-        if not request.session.get('authenticated'):
+        if not load_admin_store(request):
             return redirect('index')
         return view_func(request, *args, **kwargs)
     return wrapper
@@ -118,53 +192,44 @@ def admin_required(view_func):
 @admin_required
 def admin_dashboard(request):
     """管理者ダッシュボード"""
-    total_tables = Table.objects.count()
-    total_menu_items = MenuItem.objects.count()
+    total_tables = Table.objects.filter(store=request.store).count()
+    total_menu_items = MenuItem.objects.filter(store=request.store).count()
     # 提供未了の注文件数（delivered と cancelled 以外）
-    today_orders = Order.objects.exclude(status__in=['delivered', 'cancelled']).count()
+    today_orders = Order.objects.filter(store=request.store).exclude(status__in=Order.FINISHED_STATUSES).count()
+    # 今日の売上（会計のたびに加算している集計を読むだけで、注文は集計しない）
+    today_sales = DailySalesRollup.objects.filter(store=request.store, date=timezone.localdate()).first()
     
     context = {
         'total_tables': total_tables,
         'total_menu_items': total_menu_items,
         'today_orders': today_orders,
+        'today_sales': today_sales,
     }
     return render(request, 'qr/admin_dashboard.html', context)
 
 @admin_required
 def settings(request):
     """システム設定"""
-    store_settings = StoreSettings.objects.first()
+    store_settings = StoreSettings.objects.filter(store=request.store).first()
     
     if request.method == 'POST':
         old_ip = store_settings.server_ip if store_settings else None
         form = StoreSettingsForm(request.POST, instance=store_settings)
         if form.is_valid():
-            store_settings = form.save()
+            store_settings = form.save(commit=False)
+            store_settings.store = request.store
+            store_settings.save()
             new_ip = store_settings.server_ip
             
-            # IPアドレスが変更された場合、config.jsonを更新
+            # IPアドレスが変更された場合、config.jsonの更新をタスクキューに登録
+            # （新しいIPは次のリクエストから受け付けるので、サーバーの再起動は不要）
             if old_ip != new_ip:
-                try:
-                    with open(CONFIG_PATH, "w") as f:
-                        json.dump({"USER_IP": new_ip}, f)
-                    
-                    # settings.pyのタイムスタンプを更新
-                    settings_file = Path(settings.BASE_DIR) / "kk1" / "settings.py"
-                    if settings_file.exists():
-                        settings_file.touch()
-                    
-                    messages.success(request, 'システム設定を更新しました。サーバーIPが変更されたため、サーバーを再起動してください。')
-                    
-                    # IPアドレス変更時の再起動待ち画面
-                    context = {
-                        'server_ip': new_ip,
-                        'new_url': f'http://{new_ip}:8000',
-                        'is_ip_change': True
-                    }
-                    return render(request, 'qr/restart_wait.html', context)
-                    
-                except Exception as e:
-                    messages.error(request, f'config.jsonの更新中にエラーが発生しました: {e}')
+                enqueue('write_server_config', server_ip=new_ip)
+                
+                messages.success(request, 'システム設定を更新しました。新しいアドレスに移動します。')
+                
+                # 以前のIPでは接続できなくなるため新しいアドレスの画面へ移動
+                return redirect(f'http://{new_ip}:8000/s/{request.store.slug}/')
             else:
                 messages.success(request, 'システム設定を更新しました。')
             
@@ -180,9 +245,16 @@ def settings(request):
 
 @admin_required
 def menu_management(request):
-    """メニュー管理"""
-    categories = MenuCategory.objects.prefetch_related('items').all()
-    return render(request, 'qr/menu_management.html', {'categories': categories})
+    """メニュー管理
+    
+    一覧はメニューのバージョンをキーにしてテンプレートの断片をキャッシュする
+    （変更がなければカテゴリ・メニューをDBから読み込まない）。
+    """
+    context = {
+        'categories': MenuCategory.objects.filter(store=request.store).prefetch_related('items'),
+        'menu_version': get_menu_version(request.store.id),
+    }
+    return render(request, 'qr/menu_management.html', context)
 
 @admin_required
 def add_category(request):
@@ -190,7 +262,9 @@ def add_category(request):
     if request.method == 'POST':
         form = MenuCategoryForm(request.POST)
         if form.is_valid():
-            form.save()
+            category = form.save(commit=False)
+            category.store = request.store
+            category.save()
             messages.success(request, 'カテゴリを追加しました。')
             return redirect('menu_management')
     else:
@@ -201,7 +275,7 @@ def add_category(request):
 @admin_required
 def edit_category(request, category_id):
     """カテゴリ編集"""
-    category = get_object_or_404(MenuCategory, id=category_id)
+    category = get_object_or_404(MenuCategory, id=category_id, store=request.store)
     
     if request.method == 'POST':
         form = MenuCategoryForm(request.POST, instance=category)
@@ -222,7 +296,7 @@ def edit_category(request, category_id):
 @admin_required
 def delete_category(request, category_id):
     """カテゴリ削除"""
-    category = get_object_or_404(MenuCategory, id=category_id)
+    category = get_object_or_404(MenuCategory, id=category_id, store=request.store)
     
     if request.method == 'POST':
         category_name = category.name
@@ -240,29 +314,29 @@ def delete_category(request, category_id):
 def add_menu_item(request):
     """メニュー項目追加"""
     if request.method == 'POST':
-        form = MenuItemForm(request.POST, request.FILES)
+        form = MenuItemForm(request.POST, request.FILES, store=request.store)
         if form.is_valid():
             form.save()
             messages.success(request, 'メニューを追加しました。')
             return redirect('menu_management')
     else:
-        form = MenuItemForm()
+        form = MenuItemForm(store=request.store)
     
     return render(request, 'qr/add_menu_item.html', {'form': form})
 
 @admin_required
 def edit_menu_item(request, item_id):
     """メニュー項目編集"""
-    menu_item = get_object_or_404(MenuItem, id=item_id)
+    menu_item = get_object_or_404(MenuItem, id=item_id, store=request.store)
     
     if request.method == 'POST':
-        form = MenuItemForm(request.POST, request.FILES, instance=menu_item)
+        form = MenuItemForm(request.POST, request.FILES, instance=menu_item, store=request.store)
         if form.is_valid():
             form.save()
             messages.success(request, 'メニューを更新しました。')
             return redirect('menu_management')
     else:
-        form = MenuItemForm(instance=menu_item)
+        form = MenuItemForm(instance=menu_item, store=request.store)
     
     context = {
         'form': form,
@@ -274,7 +348,7 @@ def edit_menu_item(request, item_id):
 @admin_required
 def delete_menu_item(request, item_id):
     """メニュー項目削除"""
-    menu_item = get_object_or_404(MenuItem, id=item_id)
+    menu_item = get_object_or_404(MenuItem, id=item_id, store=request.store)
     
     if request.method == 'POST':
         item_name = menu_item.name
@@ -287,10 +361,74 @@ def delete_menu_item(request, item_id):
     }
     return render(request, 'qr/delete_menu_item.html', context)
 
+@admin_required
+def menu_import(request):
+    """メニューの一括取り込み（Excel）
+    
+    ファイルを送ると差分を表示し、確認後に反映する。確認までの間、読み込んだ行はセッションに持つ。
+    """
+    if request.method == 'POST' and request.POST.get('action') == 'apply':
+        pending = request.session.get('menu_import')
+        if not pending or pending['store_id'] != request.store.id:
+            messages.error(request, '取り込むファイルをもう一度選択してください。')
+            return redirect('menu_import')
+        try:
+            # 確認中にメニューが変更されている場合もあるので差分は計算し直す
+            diff = compute_menu_diff(request.store, pending['rows'], disable_missing=pending['disable_missing'])
+        except MenuImportError as e:
+            for error in e.errors:
+                messages.error(request, error)
+            return redirect('menu_import')
+        summary = apply_menu_diff(request.store, diff)
+        del request.session['menu_import']
+        messages.success(
+            request,
+            'メニューを取り込みました（カテゴリ追加 {create_categories}件・変更 {update_categories}件、'
+            'メニュー追加 {create_items}件・変更 {update_items}件・提供停止 {disable_items}件）。'.format(**summary)
+        )
+        return redirect('menu_management')
+    
+    diff = None
+    if request.method == 'POST':
+        form = MenuImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            disable_missing = form.cleaned_data['disable_missing']
+            try:
+                rows = read_menu_workbook(form.cleaned_data['file'])
+                diff = compute_menu_diff(request.store, rows, disable_missing=disable_missing)
+            except MenuImportError as e:
+                for error in e.errors:
+                    form.add_error('file', error)
+            else:
+                request.session['menu_import'] = {
+                    'store_id': request.store.id,
+                    'rows': rows,
+                    'disable_missing': disable_missing,
+                }
+    else:
+        form = MenuImportForm()
+    
+    context = {
+        'form': form,
+        'diff': diff,
+    }
+    return render(request, 'qr/menu_import.html', context)
+
+@admin_required
+def menu_export(request):
+    """メニューの一括書き出し（Excel）"""
+    filename = f'menu_{request.store.slug}_{timezone.localdate():%Y%m%d}.xlsx'
+    return FileResponse(
+        write_menu_workbook(request.store),
+        as_attachment=True,
+        filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
 @admin_required
 def table_management(request):
     """テーブル管理"""
-    tables = Table.objects.all()
+    tables = Table.objects.filter(store=request.store)
     
     if request.method == 'POST':
         form = TableCountForm(request.POST)
@@ -298,12 +436,12 @@ def table_management(request):
             table_count = form.cleaned_data['table_count']
             
             # 既存のテーブル数を取得
-            existing_count = Table.objects.count()
+            existing_count = tables.count()
             
             if table_count > existing_count:
                 # テーブルを追加
                 for i in range(existing_count + 1, table_count + 1):
-                    Table.objects.create(table_number=i)
+                    Table.objects.create(store=request.store, table_number=i)
                 messages.success(request, f'テーブルを{table_count}個に設定しました。')
             else:
                 messages.info(request, f'現在のテーブル数は{existing_count}個です。')
@@ -312,272 +450,774 @@ def table_management(request):
     else:
         form = TableCountForm()
     
+    # 一覧はテーブルのバージョンをキーにしてテンプレートの断片をキャッシュする
     context = {
         'tables': tables,
         'form': form,
+        'tables_version': get_tables_version(request.store.id),
     }
     return render(request, 'qr/table_management.html', context)
 
 @admin_required
 def generate_qr_codes(request, table_id):
-    """QRコード生成"""
-    table = get_object_or_404(Table, id=table_id)
-    store_settings = StoreSettings.objects.first()
+    """QRコード生成
+    
+    画像の作成はタスクキューで行い、作成済みの画像があればそれを返す。
+    """
+    table = get_object_or_404(Table, id=table_id, store=request.store)
+    store_settings = get_store_settings(request.store.id)
     
     if not store_settings:
         messages.error(request, '店舗設定が完了していません。')
         return redirect('table_management')
     
-    # WiFi接続用QRコード（WIFI形式）
-    wifi_data = f"WIFI:T:{store_settings.wifi_security};S:{store_settings.wifi_ssid};P:{store_settings.wifi_password};;"
-    
-    # 注文用QRコード
-    order_url = f"http://{store_settings.server_ip}:8000/order/{table.table_number}/"
-    
-    # QRコード画像生成
-    wifi_qr = qrcode.QRCode(version=1, box_size=8, border=3)
-    wifi_qr.add_data(wifi_data)
-    wifi_qr.make(fit=True)
-    wifi_img = wifi_qr.make_image(fill_color="black", back_color="white")
+    path = qr_sheet_path(request.store, table, store_settings)
+    if not default_storage.exists(path):
+        task = enqueue_once('render_qr_sheet', table_id=table.id, path=path)
+        if not default_storage.exists(path):
+            # 作成が終わるまで待機画面を表示する
+            context = {
+                'table': table,
+                'task': task,
+            }
+            return render(request, 'qr/qr_sheet_wait.html', context)
     
-    order_qr = qrcode.QRCode(version=1, box_size=8, border=3)
-    order_qr.add_data(order_url)
-    order_qr.make(fit=True)
-    order_img = order_qr.make_image(fill_color="black", back_color="white")
-    
-    # キャンバスサイズ（A4サイズに近い比率）
-    img_width = 1000
-    img_height = 1400
-    
-    # 背景色（明るいグレー）
-    combined_img = Image.new('RGB', (img_width, img_height), '#f8f9fa')
-    draw = ImageDraw.Draw(combined_img)
-    
-    # タイトル背景（上部バー）
-    draw.rectangle([(0, 0), (img_width, 100)], fill='#4a90e2')
-    
-    # フォント設定
-    try:
-        # 日本語フォントの読み込みを試みる（環境に応じて調整が必要）
-        title_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 40)
-        large_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 32)
-        medium_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 28)
-        small_font = ImageFont.truetype("C:/Windows/Fonts/msgothic.ttc", 24)
-    except:
-        # フォントが見つからない場合はデフォルト
-        title_font = ImageFont.load_default()
-        large_font = ImageFont.load_default()
-        medium_font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
-    
-    # タイトル（テーブル番号）
-    title_text = f"テーブル {table.table_number}"
-    # テキストサイズを取得（PIL 10.0.0以降）
-    try:
-        title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-        title_width = title_bbox[2] - title_bbox[0]
-    except:
-        title_width = len(title_text) * 20
-    
-    draw.text(((img_width - title_width) // 2, 30), title_text, fill='white', font=title_font)
-    
-    # メインメッセージ
-    y_pos = 130
-    message1 = "当店では、QRコードによる注文も可能です。"
-    message2 = "下記の手順でスマホから注文できます。"
-    
-    try:
-        msg1_bbox = draw.textbbox((0, 0), message1, font=medium_font)
-        msg1_width = msg1_bbox[2] - msg1_bbox[0]
-        msg2_bbox = draw.textbbox((0, 0), message2, font=medium_font)
-        msg2_width = msg2_bbox[2] - msg2_bbox[0]
-    except:
-        msg1_width = len(message1) * 12
-        msg2_width = len(message2) * 12
-    
-    draw.text(((img_width - msg1_width) // 2, y_pos), message1, fill='#333333', font=medium_font)
-    draw.text(((img_width - msg2_width) // 2, y_pos + 40), message2, fill='#333333', font=medium_font)
-    
-    # STEP 1 セクション
-    y_pos = 230
-    # 背景ボックス
-    draw.rectangle([(80, y_pos), (img_width - 80, y_pos + 500)], fill='white', outline='#4a90e2', width=3)
-    
-    # STEP 1 ラベル
-    draw.ellipse([(120, y_pos + 20), (200, y_pos + 100)], fill='#ff6b6b')
-    step1_text = "STEP"
-    step1_num = "1"
-    try:
-        step_bbox = draw.textbbox((0, 0), step1_text, font=small_font)
-        step_width = step_bbox[2] - step_bbox[0]
-        num_bbox = draw.textbbox((0, 0), step1_num, font=large_font)
-        num_width = num_bbox[2] - num_bbox[0]
-    except:
-        step_width = 40
-        num_width = 20
-    
-    draw.text(((160 - step_width // 2), y_pos + 35), step1_text, fill='white', font=small_font)
-    draw.text(((160 - num_width // 2), y_pos + 55), step1_num, fill='white', font=large_font)
-    
-    # STEP 1 説明
-    step1_desc = "まずは、下のQRコードを読み込んで店のWiFiに"
-    step1_desc2 = "接続してください"
-    draw.text((230, y_pos + 40), step1_desc, fill='#333333', font=medium_font)
-    draw.text((230, y_pos + 70), step1_desc2, fill='#333333', font=medium_font)
-    
-    # WiFi QRコード配置
-    wifi_img = wifi_img.resize((375, 375))
-    combined_img.paste(wifi_img, ((img_width - 375) // 2, y_pos + 110))
-    
-    # SSID表示 いらない
-    #ssid_text = f"WiFi名: {store_settings.wifi_ssid}"
-    #try:
-    #    ssid_bbox = draw.textbbox((0, 0), ssid_text, font=small_font)
-    #    ssid_width = ssid_bbox[2] - ssid_bbox[0]
-    #except:
-    #    ssid_width = len(ssid_text) * 10
-    #
-    #draw.text(((img_width - ssid_width) // 2, y_pos + 390), ssid_text, fill='#666666', font=small_font)
-    
-    # STEP 2 セクション
-    y_pos = 750
-    # 背景ボックス
-    draw.rectangle([(80, y_pos), (img_width - 80, y_pos + 500)], fill='white', outline='#4a90e2', width=3)
-    
-    # STEP 2 ラベル
-    draw.ellipse([(120, y_pos + 20), (200, y_pos + 100)], fill='#51cf66')
-    step2_num = "2"
-    try:
-        num2_bbox = draw.textbbox((0, 0), step2_num, font=large_font)
-        num2_width = num2_bbox[2] - num2_bbox[0]
-    except:
-        num2_width = 20
-    
-    draw.text(((160 - step_width // 2), y_pos + 35), step1_text, fill='white', font=small_font)
-    draw.text(((160 - num2_width // 2), y_pos + 55), step2_num, fill='white', font=large_font)
-    
-    # STEP 2 説明
-    step2_desc = "次に注文用の下のQRコードを読み取って"
-    step2_desc2 = "注文してください"
-    draw.text((230, y_pos + 40), step2_desc, fill='#333333', font=medium_font)
-    draw.text((230, y_pos + 70), step2_desc2, fill='#333333', font=medium_font)
-    
-    # 注文用QRコード配置
-    order_img = order_img.resize((375, 375))
-    combined_img.paste(order_img, ((img_width - 375) // 2, y_pos + 110))
-    
-    # 注意事項セクション
-    y_pos = 1280
+    # 画像をレスポンスとして返す
+    return FileResponse(
+        default_storage.open(path, 'rb'),
+        as_attachment=True,
+        filename=f'table_{table.table_number}_qr.png',
+        content_type='image/png',
+    )
 
-    draw.rectangle([(80, y_pos), (img_width - 80, y_pos + 80)], fill='#fff9e6', outline='#ffd43b', width=2)
+@admin_required
+def rotate_table_qr_token(request, table_id):
+    """テーブルのQRコードを再発行（これまでに印刷したQRコードからは注文できなくなる）"""
+    if request.method != 'POST':
+        return redirect('table_management')
     
-    notice_icon = "※"
-    notice_text = "※送信した注文をキャンセルしたい場合は店員にお申し付けください。"
-    notice_text2 = ""
+    table = get_object_or_404(Table, id=table_id, store=request.store)
+    store_settings = get_store_settings(request.store.id)
+    old_path = qr_sheet_path(request.store, table, store_settings) if store_settings else None
+    rotate_table_token(table)
+    if old_path and default_storage.exists(old_path):
+        default_storage.delete(old_path)
     
-    #draw.text((120, y_pos + 20), notice_icon, fill='#ff6b6b', font=large_font)
-    draw.text((110, y_pos + 30), notice_text, fill='#666666', font=small_font)
-    #draw.text((160, y_pos + 60), notice_text2, fill='#666666', font=small_font)
+    messages.success(request, f'テーブル {table.table_number} のQRコードを再発行しました。新しいQRコードを印刷してください。')
+    return redirect('table_management')
+
+@admin_required
+def task_status_api(request, task_id):
+    """バックグラウンドタスクの状態API"""
+    task = get_task_status(task_id)
+    if task is None:
+        return JsonResponse({'status': 'error', 'message': 'タスクが見つかりません'}, status=404)
+    return JsonResponse({'status': 'success', 'task': task})
+
+@admin_required
+def retry_task_api(request, task_id):
+    """失敗したバックグラウンドタスクの再実行"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'})
     
-    # フッター　いらない
-    #footer_text = "ご不明な点がございましたら、お気軽にスタッフまでお声がけください。"
-    #try:
-    #    footer_bbox = draw.textbbox((0, 0), footer_text, font=small_font)
-    #    footer_width = footer_bbox[2] - footer_bbox[0]
-    #except:
-    #    footer_width = len(footer_text) * 10
-    #
-    #draw.text(((img_width - footer_width) // 2, 1320), footer_text, fill='#999999', font=small_font)
+    if not retry_task(task_id):
+        return JsonResponse({'status': 'error', 'message': '再実行できるタスクではありません'}, status=400)
+    return JsonResponse({'status': 'success', 'task': get_task_status(task_id)})
+
+async def get_request_store(store_slug):
+    """URLの店舗IDから店舗を取得（店舗IDのない旧URLでは既定の店舗。見つからなければ404）"""
+    if store_slug is None:
+        store = await Store.objects.filter(is_active=True).order_by('id').values('id', 'slug', 'name').afirst()
+    else:
+        store = await aget_store(store_slug)
+    if store is None:
+        raise Http404('Store not found')
+    return store
+
+async def get_active_table(store_id, table_number, token, view):
+    """URLのトークンを検証して有効なテーブルを取得（見つからなければ404）
     
-    # 画像をレスポンスとして返す
-    response = HttpResponse(content_type="image/png")
-    combined_img.save(response, "PNG")
+    トークンの署名はDBを見ずに検証するので、テーブル番号を書き換えたURLはここで拒否される。
+    """
+    try:
+        table_number = int(table_number)
+    except (ValueError, TypeError):
+        raise Http404('Table not found')
     
-    response['Content-Disposition'] = f'attachment; filename="table_{table.table_number}_qr.png"'
+    required = get_table_token_settings()['REQUIRED']
+    version = parse_table_token(store_id, table_number, token)
+    if version is None and required:
+        TABLE_TOKEN_REJECTED.inc(view=view)
+        raise Http404('Table not found')
     
-    return response
+    table = await aget_table(store_id, table_number)
+    if table is None:
+        raise Http404('Table not found')
+    if required and version != table.token_version:
+        # 再発行する前のQRコード
+        TABLE_TOKEN_REJECTED.inc(view=view)
+        raise Http404('Table not found')
+    return table
 
-def order_menu(request, table_number):
+async def order_menu(request, store_slug, table_number):
     """注文画面"""
+    store = await get_request_store(store_slug)
     # WiFi接続チェック
-    #if not check_wifi_connection(request):
+    #if not check_wifi_connection(request, store['id']):
     #    return render(request, 'qr/wifi_error.html')
     
-    table = get_object_or_404(Table, table_number=table_number, is_active=True)
-    categories = MenuCategory.objects.filter(is_active=True).prefetch_related('items').all()
+    table = await get_active_table(store['id'], table_number, request.GET.get('t'), 'order_menu')
+    categories = await sync_to_async(get_menu_snapshot)(store['id'])
     
     context = {
+        'store': store,
         'table': table,
+        'table_token': make_table_token(table),
         'categories': categories,
+        'eager_categories': ORDER_MENU_EAGER_CATEGORIES,
+        # 検索用の索引 [メニューID, カテゴリID, 正規化した文字列]
+        'search_index': [
+            [item['id'], category['id'], item['search']]
+            for category in categories
+            for item in category['items']
+        ],
     }
-    return render(request, 'qr/order_menu.html', context)
+    # テンプレートでセッションを参照するので描画はスレッドで行う
+    return await sync_to_async(render)(request, 'qr/order_menu.html', context)
+
+async def legacy_order_menu(request, table_number):
+    """店舗IDのない旧URLの注文画面（既定の店舗の注文画面へ移動）"""
+    store = await get_request_store(None)
+    url = reverse('order_menu', kwargs={'store_slug': store['slug'], 'table_number': table_number})
+    if request.GET.get('t'):
+        url += '?' + urlencode({'t': request.GET['t']})
+    return redirect(url)
 
-@csrf_exempt
-def submit_order(request):
+async def menu_api(request, store_slug):
+    """注文画面用のメニューAPI（サービスワーカーがオフライン用に保存する）"""
+    store = await get_request_store(store_slug)
+    categories = await sync_to_async(get_menu_snapshot)(store['id'])
+    response = JsonResponse({'status': 'success', 'categories': categories})
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def service_worker(request):
+    """注文画面のサービスワーカー（スコープをサイト全体にするためルートで配信する）"""
+    response = render(request, 'qr/sw.js', {'cache_version': SERVICE_WORKER_CACHE_VERSION}, content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def create_order(table, items, notes, client_token=None):
+    """注文を作成（在庫の引き当てを含めて1トランザクションで行う）"""
+    with transaction.atomic():
+        # 注文作成
+        order = Order.objects.create(
+            store_id=table.store_id,
+            table=table,
+            notes=notes,
+            client_token=client_token
+        )
+        
+        total_amount = 0
+        stocked_item_ids = []
+        for item_data in items:
+            menu_item = get_object_or_404(MenuItem, id=item_data['id'], store_id=table.store_id)
+            quantity = int(item_data['quantity'])
+            if quantity < 1:
+                raise ValueError('数量が正しくありません。')
+            if not menu_item.is_available:
+                raise SoldOutError(menu_item)
+            
+            # 在庫管理している商品は、在庫が足りる場合のみ条件付きUPDATEで減らす
+            # （行ロックを取らずに同時注文でも在庫がマイナスにならない）
+            if menu_item.stock is not None:
+                updated = MenuItem.objects.filter(
+                    id=menu_item.id, stock__gte=quantity
+                ).update(stock=F('stock') - quantity)
+                if not updated:
+                    raise SoldOutError(menu_item)
+                stocked_item_ids.append(menu_item.id)
+            
+            OrderItem.objects.create(
+                order=order,
+                menu_item=menu_item,
+                quantity=quantity,
+                unit_price=menu_item.price,
+                notes=item_data.get('notes', '')
+            )
+            
+            total_amount += menu_item.price * quantity
+        
+        order.total_amount = total_amount
+        order.save()
+        OrderStatusTransition.objects.create(
+            order=order, to_status=order.status, created_at=order.created_at
+        )
+        
+        # 厨房伝票は注文と同じトランザクションで印刷タスクに登録する（印刷はワーカーで行う）
+        enqueue_ticket(order)
+        
+        if stocked_item_ids:
+            # 在庫が0になった商品は自動的に品切れにする
+            MenuItem.objects.filter(id__in=stocked_item_ids, stock=0).update(is_available=False)
+            transaction.on_commit(lambda: invalidate_menu_cache(table.store_id))
+    
+    set_order_status(order)
+    return order
+
+async def find_order_by_client_token(client_token):
+    """送信IDから登録済みの注文IDを取得"""
+    return await Order.objects.filter(client_token=client_token).values_list('id', flat=True).afirst()
+
+def rate_limited_response(retry_after):
+    """送信が多すぎる場合の応答（429）"""
+    response = JsonResponse(
+        {'status': 'error', 'message': '注文の送信が集中しています。しばらくしてからもう一度お試しください。'},
+        status=429,
+    )
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+@timed(SUBMIT_ORDER_SECONDS)
+async def submit_order(request, store_slug=None):
     """注文送信"""
     if request.method == 'POST':
+        # 1つの端末・テーブルからの大量の送信で他のテーブルの注文が詰まらないようにする
+        retry_after = check_ip_rate(request)
+        if retry_after:
+            ORDERS_SUBMITTED.inc(result='rate_limited')
+            return rate_limited_response(retry_after)
+        
         try:
             data = json.loads(request.body)
             table_number = data.get('table_number')
             items = data.get('items', [])
             notes = data.get('notes', '')
             
-            table = get_object_or_404(Table, table_number=table_number, is_active=True)
+            # オフライン時に送信待ちになった注文は再送されるので、送信IDで重複を防ぐ
+            client_token = str(data.get('client_token') or '')[:64] or None
             
-            # 注文作成
-            order = Order.objects.create(
-                table=table,
-                notes=notes
-            )
+            store = await get_request_store(store_slug)
+            # トークンの検証が先（不正なトークンの送信ではDBに問い合わせない）
+            table = await get_active_table(store['id'], table_number, data.get('table_token'), 'submit_order')
             
-            total_amount = 0
-            for item_data in items:
-                menu_item = get_object_or_404(MenuItem, id=item_data['id'])
-                quantity = int(item_data['quantity'])
-                
-                OrderItem.objects.create(
-                    order=order,
-                    menu_item=menu_item,
-                    quantity=quantity,
-                    unit_price=menu_item.price,
-                    notes=item_data.get('notes', '')
-                )
-                
-                total_amount += menu_item.price * quantity
+            if client_token:
+                order_id = await find_order_by_client_token(client_token)
+                if order_id:
+                    ORDERS_SUBMITTED.inc(result='duplicate')
+                    return JsonResponse({'status': 'success', 'order_id': order_id, 'duplicate': True})
+            
+            retry_after = check_table_rate(table)
+            if retry_after:
+                ORDERS_SUBMITTED.inc(result='rate_limited')
+                return rate_limited_response(retry_after)
             
-            order.total_amount = total_amount
-            order.save()
+            try:
+                order = await sync_to_async(create_order)(table, items, notes, client_token)
+            except IntegrityError:
+                # 同じ送信IDの注文が同時に届いた場合は先に登録された注文を返す
+                order_id = await find_order_by_client_token(client_token)
+                if not order_id:
+                    raise
+                ORDERS_SUBMITTED.inc(result='duplicate')
+                return JsonResponse({'status': 'success', 'order_id': order_id, 'duplicate': True})
             
+            ORDERS_SUBMITTED.inc(result='success')
             return JsonResponse({'status': 'success', 'order_id': order.id})
             
+        except SoldOutError as e:
+            # 品切れになった商品が画面に残らないようにメニューを作り直させる
+            await sync_to_async(invalidate_menu_cache)(e.menu_item.store_id)
+            ORDERS_SUBMITTED.inc(result='sold_out')
+            return JsonResponse({'status': 'error', 'message': str(e), 'sold_out': [e.menu_item.id]})
         except Exception as e:
+            ORDERS_SUBMITTED.inc(result='error')
             return JsonResponse({'status': 'error', 'message': str(e)})
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request'})
 
+# Django 4.1 の csrf_exempt は同期関数で包んでしまうため、非同期ビューには属性を直接付ける
+submit_order.csrf_exempt = True
+
+async def order_status(request, table_number, order_id, store_slug=None):
+    """注文ステータス（顧客用・キャッシュから返す）
+    
+    If-None-Match で変化がなければ304を返す。?wait=秒 を指定すると
+    ステータスが変わるまで最大 ORDER_STATUS_MAX_WAIT 秒待つ（ロングポーリング）。
+    待っている間はワーカーを占有しない。
+    テーブルのトークン（X-Table-Token ヘッダーか ?t=）が必要で、注文画面と同じように検証する
+    （注文IDを書き換えて他のテーブルの注文を見られないように）。
+    """
+    store = await get_request_store(store_slug)
+    token = request.headers.get('X-Table-Token') or request.GET.get('t')
+    try:
+        await get_active_table(store['id'], table_number, token, 'order_status')
+    except Http404:
+        return JsonResponse({'status': 'error', 'message': 'Order not found'}, status=404)
+    data = await aget_order_status(order_id)
+    if data is None or data.get('store_id') != store['id'] or data['table_number'] != table_number:
+        return JsonResponse({'status': 'error', 'message': 'Order not found'}, status=404)
+    
+    client_etag = request.headers.get('If-None-Match')
+    try:
+        wait = min(max(int(request.GET.get('wait', 0)), 0), ORDER_STATUS_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    
+    deadline = time.monotonic() + wait
+    # 1回の確認はキャッシュの読み込み1回（ファイルの場合で0.15ms程度）。スレッドプールで読むので
+    # ORM のスレッド（DBアクセス）を待たず、待っている端末が多くても他のリクエストを遅らせない
+    while client_etag == order_status_etag(data) and time.monotonic() < deadline:
+        await asyncio.sleep(ORDER_STATUS_POLL_INTERVAL)
+        data = await aget_order_status(order_id) or data
+    
+    etag = order_status_etag(data)
+    if client_etag == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse({
+            'order_id': data['order_id'],
+            'status': data['status'],
+            'status_display': data['status_display'],
+        })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 @admin_required
 def kitchen_view(request):
     """厨房画面"""
-    orders = Order.objects.select_related('table').prefetch_related('items__menu_item').order_by('created_at')
+    KITCHEN_POLLS.inc(view='kitchen_view')
+    # 提供済み・キャンセルの注文は今日のもので、会計前のものだけ表示する
+    # （キャンセルした注文は会計されないので、日付で区切らないと増え続ける）
+    # 先に会計した注文も、提供が終わるまでは表示する
+    start_of_today = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+    orders = (
+        Order.objects.filter(store=request.store)
+        .exclude(is_settled=True, status__in=Order.FINISHED_STATUSES)
+        .filter(Q(status__in=Order.OPEN_STATUSES) | Q(updated_at__gte=start_of_today))
+        .select_related('table').prefetch_related('items__menu_item').order_by('created_at')
+    )
     
     context = {
         'orders': orders,
+        'status_choices': Order.ORDER_STATUS_CHOICES,
+        'failed_tickets': [task_obj.kwargs['order_id'] for task_obj in get_failed_tickets(request.store.id)],
     }
     return render(request, 'qr/kitchen_view.html', context)
 
+@admin_required
+def reprint_tickets(request):
+    """印刷できなかった厨房伝票を印刷し直す"""
+    if request.method != 'POST':
+        return redirect('kitchen_view')
+    
+    count = reprint_failed_tickets(request.store.id)
+    if count:
+        messages.success(request, f'{count}件の伝票を印刷し直します。')
+    else:
+        messages.info(request, '印刷できなかった伝票はありません。')
+    return redirect('kitchen_view')
+
+def get_kitchen_board(store):
+    """料理ごとの調理待ち数量を集計（1クエリ）"""
+    rows = (
+        OrderItem.objects.filter(order__store=store, order__status__in=Order.KITCHEN_STATUSES)
+        # 厨房画面（kitchen_view）と同じく、会計済みでも調理が終わっていない注文は表示する
+        .exclude(order__is_settled=True, order__status__in=Order.FINISHED_STATUSES)
+        .values('menu_item_id', 'menu_item__name')
+        .annotate(
+            waiting=Coalesce(Sum('quantity', filter=Q(status='waiting')), 0),
+            preparing=Coalesce(Sum('quantity', filter=Q(status='preparing')), 0),
+            prepared=Coalesce(Sum('quantity', filter=Q(status='prepared')), 0),
+            order_count=Count('order', distinct=True),
+            oldest_order_at=Min('order__created_at'),
+        )
+        .order_by('oldest_order_at')
+    )
+    return [
+        {
+            'menu_item_id': row['menu_item_id'],
+            'name': row['menu_item__name'],
+            'waiting': row['waiting'],
+            'preparing': row['preparing'],
+            'prepared': row['prepared'],
+            'order_count': row['order_count'],
+            'oldest_order_at': row['oldest_order_at'],
+        }
+        for row in rows
+    ]
+
+@admin_required
+def kitchen_by_dish(request):
+    """厨房画面（料理ごと）"""
+    context = {
+        'dishes': get_kitchen_board(request.store),
+    }
+    return render(request, 'qr/kitchen_by_dish.html', context)
+
+@admin_required
+async def kitchen_by_dish_api(request):
+    """厨房画面（料理ごと・JSON）"""
+    KITCHEN_POLLS.inc(view='kitchen_by_dish_api')
+    dishes = await sync_to_async(get_kitchen_board)(request.store)
+    for dish in dishes:
+        dish['oldest_order_at'] = dish['oldest_order_at'].isoformat()
+    return JsonResponse({'dishes': dishes})
+
+@admin_required
+def update_dish_status(request, menu_item_id):
+    """料理ごとの調理状況を一括更新"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'})
+    
+    new_status = request.POST.get('status')
+    # 調理状況は先にしか進めない
+    previous_statuses = {
+        'preparing': ['waiting'],
+        'prepared': ['waiting', 'preparing'],
+    }.get(new_status)
+    if previous_statuses is None:
+        return JsonResponse({'status': 'error', 'message': 'Invalid status'})
+    
+    now = timezone.now()
+    with transaction.atomic():
+        lines = OrderItem.objects.filter(
+            menu_item_id=menu_item_id,
+            order__store=request.store,
+            order__status__in=Order.KITCHEN_STATUSES,
+            status__in=previous_statuses,
+        )
+        order_ids = set(lines.values_list('order_id', flat=True))
+        updated = lines.update(status=new_status)
+        
+        # 調理を始めた注文は「調理中」に、全品調理済みになった注文は「準備完了」にする
+        if new_status == 'preparing':
+            changed_orders = Order.objects.filter(id__in=order_ids, status__in=['pending', 'confirmed'])
+            next_order_status = 'preparing'
+        else:
+            changed_orders = Order.objects.filter(
+                id__in=order_ids, status__in=Order.KITCHEN_STATUSES
+            ).exclude(items__status__in=['waiting', 'preparing'])
+            next_order_status = 'ready'
+        changed = list(changed_orders.values_list('id', 'status'))
+        changed_order_ids = [order_id for order_id, _ in changed]
+        Order.objects.filter(id__in=changed_order_ids).update(status=next_order_status, updated_at=now)
+        OrderStatusTransition.objects.bulk_create([
+            OrderStatusTransition(
+                order_id=order_id, from_status=from_status, to_status=next_order_status, created_at=now
+            )
+            for order_id, from_status in changed
+        ])
+    
+    refresh_order_statuses(changed_order_ids)
+    
+    return JsonResponse({
+        'status': 'success',
+        'updated_lines': updated,
+        'updated_orders': changed_order_ids,
+    })
+
+def get_table_tab(table):
+    """テーブルの伝票（未会計の注文）と合計金額を取得"""
+    orders = (
+        table.orders.filter(status__in=Order.TAB_STATUSES, is_settled=False)
+        .prefetch_related('items__menu_item')
+        .order_by('created_at')
+    )
+    summary = orders.aggregate(
+        total=Coalesce(Sum('total_amount'), 0),
+        order_count=Count('id'),
+        undelivered_count=Count('id', filter=Q(status__in=Order.OPEN_STATUSES)),
+    )
+    return orders, summary
+
+@admin_required
+def hall_overview(request):
+    """ホール画面（全テーブルの伝票一覧）"""
+    # テーブルごとの集計を1クエリで取得する
+    # 未会計の条件は JOIN の条件に入れる（会計済みの注文を結合しないので、未会計の注文のインデックスだけを読む）
+    tables = Table.objects.filter(store=request.store, is_active=True).annotate(
+        tab_orders=FilteredRelation(
+            'orders',
+            condition=Q(orders__is_settled=False, orders__status__in=Order.TAB_STATUSES),
+        ),
+    ).annotate(
+        tab_total=Coalesce(Sum('tab_orders__total_amount'), 0),
+        tab_order_count=Count('tab_orders'),
+        undelivered_count=Count('tab_orders', filter=Q(tab_orders__status__in=Order.OPEN_STATUSES)),
+        first_order_at=Min('tab_orders__created_at'),
+    )
+    
+    context = {
+        'tables': tables,
+    }
+    return render(request, 'qr/hall_overview.html', context)
+
+@admin_required
+def table_tab(request, table_id):
+    """テーブル別の伝票画面"""
+    table = get_object_or_404(Table, id=table_id, store=request.store)
+    orders, summary = get_table_tab(table)
+    
+    context = {
+        'table': table,
+        'orders': orders,
+        'summary': summary,
+        'split_choices': Checkout.SPLIT_CHOICES,
+        'max_split_count': MAX_SPLIT_COUNT,
+    }
+    return render(request, 'qr/table_tab.html', context)
+
+@admin_required
+def table_tab_api(request, table_id):
+    """テーブル別の伝票（JSON）"""
+    table = get_object_or_404(Table, id=table_id, store=request.store)
+    orders, summary = get_table_tab(table)
+    
+    return JsonResponse({
+        'table_number': table.table_number,
+        'total': summary['total'],
+        'order_count': summary['order_count'],
+        'undelivered_count': summary['undelivered_count'],
+        'orders': [
+            {
+                'id': order.id,
+                'status': order.status,
+                'status_display': order.get_status_display(),
+                'total_amount': order.total_amount,
+                'created_at': order.created_at.isoformat(),
+                'items': [
+                    {
+                        'name': item.menu_item.name,
+                        'quantity': item.quantity,
+                        'unit_price': item.unit_price,
+                    }
+                    for item in order.items.all()
+                ],
+            }
+            for order in orders
+        ],
+    })
+
+@admin_required
+def settle_table(request, table_id):
+    """テーブルの伝票を会計する（一括・均等割り・品目ごと）"""
+    table = get_object_or_404(Table, id=table_id, store=request.store)
+    
+    if request.method == 'POST':
+        split_method = request.POST.get('split_method', 'none')
+        # 品目ごとの場合は payer_<注文項目ID> に支払う人の番号が入っている
+        assignments = {}
+        try:
+            split_count = int(request.POST.get('split_count') or 1)
+            for key, value in request.POST.items():
+                if key.startswith('payer_') and value:
+                    assignments[int(key[len('payer_'):])] = int(value)
+            checkout = checkout_table(table, split_method, split_count, assignments)
+        except ValueError:
+            messages.error(request, '人数・支払う人は数字で入力してください。')
+        except CheckoutError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(
+                request,
+                f'テーブル{table.table_number}の会計を完了しました（{checkout.order_count}件・¥{checkout.total_amount:,}）。',
+            )
+            return redirect('checkout_detail', checkout_id=checkout.id)
+    
+    return redirect('table_tab', table_id=table.id)
+
+@admin_required
+def checkout_detail(request, checkout_id):
+    """会計の内容（会計時点の明細と支払いの内訳）"""
+    checkout = get_object_or_404(Checkout.objects.select_related('table'), id=checkout_id, store=request.store)
+    lines = {line['order_item_id']: line for line in checkout.lines}
+    payments = [
+        {
+            'number': number,
+            'amount': payment['amount'],
+            'lines': [lines[line_id] for line_id in payment['lines'] if line_id in lines],
+        }
+        for number, payment in enumerate(checkout.payments, start=1)
+    ]
+    
+    context = {
+        'checkout': checkout,
+        'payments': payments,
+    }
+    return render(request, 'qr/checkout_detail.html', context)
+
+def apply_status_transitions(store, transitions):
+    """注文ステータスをまとめて変更する
+    
+    transitions は (order_id, status) のリスト（store 以外の店舗の注文は見つからない扱い）。許可されていない遷移は適用せずに
+    エラーとして返し、それ以外は1トランザクションで bulk_update する。
+    遷移履歴も同じトランザクションで記録する。
+    """
+    valid_statuses = dict(Order.ORDER_STATUS_CHOICES)
+    errors = []
+    updated_orders = []
+    history = []
+    now = timezone.now()
+    
+    with transaction.atomic():
+        order_ids = [order_id for order_id, _ in transitions]
+        orders = Order.objects.select_for_update().select_related('table').filter(store=store).in_bulk(order_ids)
+        for order_id, status in transitions:
+            order = orders.get(order_id)
+            if order is None:
+                errors.append({'order_id': order_id, 'message': '注文が見つかりません。'})
+            elif status not in valid_statuses:
+                errors.append({'order_id': order_id, 'message': 'ステータスが正しくありません。'})
+            elif order.status == status:
+                continue
+            elif not order.can_transition_to(status):
+                errors.append({
+                    'order_id': order_id,
+                    'message': f'「{order.get_status_display()}」から「{valid_statuses[status]}」には変更できません。',
+                })
+            else:
+                history.append(OrderStatusTransition(
+                    order=order, from_status=order.status, to_status=status, created_at=now
+                ))
+                order.status = status
+                order.updated_at = now
+                if order not in updated_orders:
+                    updated_orders.append(order)
+        Order.objects.bulk_update(updated_orders, ['status', 'updated_at'])
+        OrderStatusTransition.objects.bulk_create(history)
+    
+    for order in updated_orders:
+        set_order_status(order)
+    return updated_orders, errors
+
+@admin_required
+def update_order_status_batch(request):
+    """注文ステータスの一括更新（JSON）"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'})
+    
+    try:
+        data = json.loads(request.body)
+        transitions = [
+            (int(transition['order_id']), transition['status'])
+            for transition in data.get('transitions', [])
+        ]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
+    
+    updated_orders, errors = apply_status_transitions(request.store, transitions)
+    
+    return JsonResponse({
+        'status': 'success' if not errors else 'partial',
+        'orders': [
+            {
+                'id': order.id,
+                'table_number': order.table.table_number,
+                'status': order.status,
+                'status_display': order.get_status_display(),
+                'status_color': order.get_status_display_color(),
+                'updated_at': order.updated_at.isoformat(),
+            }
+            for order in updated_orders
+        ],
+        'errors': errors,
+    })
+
 @admin_required
 def update_order_status(request, order_id):
     """注文ステータス更新"""
     if request.method == 'POST':
-        order = get_object_or_404(Order, id=order_id)
+        order = get_object_or_404(Order, id=order_id, store=request.store)
         form = OrderStatusForm(request.POST, instance=order)
         if form.is_valid():
-            form.save()
-            return JsonResponse({'status': 'success'})
+            _, errors = apply_status_transitions(request.store, [(order.id, form.cleaned_data['status'])])
+            if not errors:
+                return JsonResponse({'status': 'success'})
     
     return JsonResponse({'status': 'error'})
 
+@admin_required
+def ticket_metrics(request):
+    """提供時間の分析（事前計算した集計を表示）"""
+    try:
+        target_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        target_date = timezone.localdate()
+    
+    day_start = timezone.make_aware(datetime.combine(target_date, datetime.min.time()))
+    day_end = day_start + timedelta(days=1)
+    stats = TicketTimeStat.objects.filter(
+        store=request.store, period_start__gte=day_start, period_start__lt=day_end
+    ).select_related('menu_item')
+    
+    metrics = [value for value, _ in TicketTimeStat.METRIC_CHOICES]
+    hourly = {}
+    by_dish = {}
+    for stat in stats:
+        if stat.granularity == 'hour' and stat.menu_item_id is None:
+            hourly.setdefault(stat.period_start, {})[stat.metric] = stat
+        elif stat.granularity == 'day' and stat.menu_item_id is not None:
+            by_dish.setdefault(stat.menu_item.name, {})[stat.metric] = stat
+    
+    context = {
+        'target_date': target_date,
+        'metric_choices': TicketTimeStat.METRIC_CHOICES,
+        'hourly_rows': [
+            (period_start, [hourly[period_start].get(metric) for metric in metrics])
+            for period_start in sorted(hourly)
+        ],
+        'dish_rows': [
+            (name, [by_dish[name].get(metric) for metric in metrics])
+            for name in sorted(by_dish, key=lambda name: -(by_dish[name].get('total').p90 if by_dish[name].get('total') else 0))
+        ],
+    }
+    return render(request, 'qr/ticket_metrics.html', context)
+
 def logout(request):
     """ログアウト"""
     request.session.flush()
-    return redirect('index')
\ No newline at end of file
+    return redirect('index')
+
+def metrics(request):
+    """動作状況のメトリクス（Prometheus のテキスト形式）
+    
+    settings.METRICS['TOKEN'] を指定した場合は Authorization: Bearer <TOKEN> が必要。
+    指定していない場合はサーバー自身（127.0.0.1）からのアクセスだけを許可する。
+    """
+    options = get_metrics_settings()
+    if not options['ENABLED']:
+        raise Http404('Metrics are disabled')
+    
+    if options['TOKEN']:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {options['TOKEN']}")
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+    if not allowed:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def serve_media(request, path):
+    """アップロードされたファイル（メニュー画像など）の配信
+    
+    settings.MEDIA_ACCEL_REDIRECT を指定した場合はファイルの送信を前段の nginx に任せる。
+    QRコード画像にはWiFiのパスワードが含まれるので、ここからは配信しない（generate_qr_codes で取得する）。
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    if path.startswith('..') or path.startswith(f'{QR_SHEET_DIR}/'):
+        raise Http404('File not found')
+    
+    if django_settings.MEDIA_ACCEL_REDIRECT:
+        if not default_storage.exists(path):
+            raise Http404('File not found')
+        response = HttpResponse()
+        # Content-Type は nginx がファイル名から決める
+        del response['Content-Type']
+        response['X-Accel-Redirect'] = django_settings.MEDIA_ACCEL_REDIRECT + quote(path)
+    else:
+        # If-Modified-Since に対しては 304 を返す
+        response = static.serve(request, path, document_root=django_settings.MEDIA_ROOT)
+    response['Cache-Control'] = f'public, max-age={django_settings.MEDIA_CACHE_MAX_AGE}'
+    return response
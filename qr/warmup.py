@@ -0,0 +1,80 @@
+"""サーバー起動時の事前読み込み（ウォームアップ）
+
+gunicorn を preload_app で起動すると、ワーカーを起動（fork）する前にマスタープロセスで warm_up() を
+実行する（gunicorn.conf.py の when_ready）。URLの解決表・テンプレート・よく使うキャッシュを
+用意してからワーカーを起動するので、ワーカーの起動直後の最初のリクエストも遅くならない。
+キャッシュはファイルで全ワーカーに共有されるので、preload しない場合も
+python manage.py warm_up で同じ準備ができる。
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+from .caches import get_menu_snapshot, get_server_ips, get_store, get_store_settings, get_table
+from .metrics import reset_metrics
+from .models import Store, Table
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / 'templates'
+
+
+def warm_urls():
+    """URLの解決表を作成（最初の reverse / resolve で作られるもの）"""
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return len(resolver.url_patterns)
+
+
+def warm_templates():
+    """このアプリのテンプレートを読み込む（キャッシュするローダーの場合はコンパイル結果が残る）"""
+    count = 0
+    for path in sorted(TEMPLATE_DIR.rglob('*')):
+        if not path.is_file():
+            continue
+        name = path.relative_to(TEMPLATE_DIR).as_posix()
+        try:
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+            logger.warning('テンプレート %s を読み込めませんでした: %s', name, e)
+            continue
+        count += 1
+    return count
+
+
+def warm_caches():
+    """有効な店舗のメニュー・店舗設定・テーブルをキャッシュに読み込む"""
+    get_server_ips()
+    stores = list(Store.objects.filter(is_active=True).values_list('id', 'slug'))
+    for store_id, slug in stores:
+        get_store(slug)
+        get_store_settings(store_id)
+        get_menu_snapshot(store_id)
+        table_numbers = Table.objects.filter(store_id=store_id, is_active=True).values_list('table_number', flat=True)
+        for table_number in table_numbers:
+            get_table(store_id, table_number)
+    return len(stores)
+
+
+def warm_up():
+    """URL・テンプレート・キャッシュを用意する（fork する前に呼ぶ場合はDB接続を閉じて終わる）"""
+    start = time.perf_counter()
+    try:
+        urls = warm_urls()
+        templates = warm_templates()
+        stores = warm_caches()
+    finally:
+        # 開いたDB接続をワーカーに引き継がない
+        connections.close_all()
+        # ウォームアップ中のキャッシュの参照回数を各ワーカーの値に含めない
+        reset_metrics()
+    logger.info(
+        'ウォームアップ完了: URL %d件・テンプレート %d件・店舗 %d件（%.2f秒）',
+        urls, templates, stores, time.perf_counter() - start,
+    )
+    return {'urls': urls, 'templates': templates, 'stores': stores}
@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
-import json
 from pathlib import Path
 import dj_database_url # データベースの切替えを上手く管理できるモジュールらしい（pip install dj-database-url）
 
@@ -26,22 +25,21 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-e=#a%mfo&34e5j4g3pun6$az8$ygihk5(o1fjv$6w2=cop19xv')
 
+# 実行環境（QR_ENV=production で本番用の設定になる）
+# 本番では DEBUG を無効にする（DEBUG の場合はリクエストごとに全SQLを connection.queries に保持する）
+QR_ENV = os.environ.get('QR_ENV', 'development')
+PRODUCTION = QR_ENV == 'production'
+
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '0' if PRODUCTION else '1') == '1'
 
 CONFIG_PATH = BASE_DIR / "config.json"
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1', '.onrender.com']
-
-if CONFIG_PATH.exists():
-    try:
-        with open(CONFIG_PATH, "r") as f:
-            config = json.load(f)
-            user_ip = config.get("USER_IP")
-            if user_ip:
-                ALLOWED_HOSTS.append(user_ip)
-    except Exception as e:
-        print(f"config.json 読み込みエラー: {e}")
+# 許可するホスト名
+# config.json と店舗設定のサーバーIPは実行中に変わるため、ホスト名の検証は
+# qr.middleware.allowed_hosts_middleware で行う（IP変更時にサーバーの再起動は不要）。
+QR_ALLOWED_HOSTS = ['localhost', '127.0.0.1', '.onrender.com']
+ALLOWED_HOSTS = ['*']
 
 
 # Application definition
@@ -57,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'qr.middleware.allowed_hosts_middleware',  # ホスト名の検証（最初に置く）
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # 追加
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -69,11 +68,17 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'qr_order.urls'
 
+# テンプレートはコンパイル結果をプロセス内にキャッシュする（cached.Loader）
+# DEBUG の場合も runserver がテンプレートの変更を検知するとキャッシュを破棄するので、編集はすぐ反映される
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -81,6 +86,9 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+            ],
         },
     },
 ]
@@ -95,6 +103,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 本番ではDB接続を使い回す（リクエストごとに接続し直さない）
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '600' if PRODUCTION else '0')),
+        'CONN_HEALTH_CHECKS': PRODUCTION,
     }
 }
 
@@ -132,6 +143,9 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Bootstrap / Font Awesome / jQuery は qr/static/qr/vendor/ に同梱（店内LANでインターネットがなくても表示できる）
+# collectstatic 時にハッシュ付きファイル名と gzip / brotli（Brotli パッケージがある場合）を生成し、
+# WhiteNoise がハッシュ付きファイルを immutable（長期キャッシュ）で配信する
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -140,15 +154,92 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# アップロードされたファイル（メニュー画像）は qr.views.serve_media で配信する
+# 前段に nginx がある場合は内部URLを指定すると、ファイルの送信を nginx に任せる（X-Accel-Redirect）
+#   location /protected-media/ { internal; alias /path/to/media/; }
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT') or None
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24  # 1日（画像はファイル名を変えて保存されるので長めでよい）
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 厨房伝票の印刷（qr/printing.py）
+# 伝票は印刷タスクとして登録し、タスクのワーカー（python manage.py run_tasks）が印刷する
+# TICKET_PRINTER_SINK: '' (印刷しない) / 'file' / 'socket' / 'console'
+TICKET_PRINTER = {
+    'SINK': os.environ.get('TICKET_PRINTER_SINK', ''),
+    'FORMAT': os.environ.get('TICKET_PRINTER_FORMAT', 'escpos'),  # 'escpos' / 'text'
+    'PATH': BASE_DIR / 'tickets',
+    'HOST': os.environ.get('TICKET_PRINTER_HOST', '127.0.0.1'),
+    'PORT': int(os.environ.get('TICKET_PRINTER_PORT', '9100')),
+    'ENCODING': 'cp932',
+    'MAX_ATTEMPTS': 8,  # 印刷を試みる回数（使い切った伝票は厨房画面から印刷し直す）
+    'BATCH_SIZE': 10,  # 1回の接続でまとめて送る伝票の数
+}
+
+# バックグラウンドタスク（qr/tasks.py）
+# EAGER が True の場合はワーカー（python manage.py run_tasks）を使わずにその場で実行する
+TASK_QUEUE = {
+    'EAGER': os.environ.get('TASK_QUEUE_EAGER', '1' if DEBUG else '0') == '1',
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 5,
+}
+
+# 注文送信のレート制限（qr/ratelimit.py）
+# テーブルごと・送信元IPごとに CAPACITY 件まで連続で受け付け、1分あたり PER_MINUTE 件ずつ回復する
+ORDER_RATE_LIMIT = {
+    'ENABLED': True,
+    'TABLE': {'CAPACITY': 10, 'PER_MINUTE': 10},
+    'IP': {'CAPACITY': 20, 'PER_MINUTE': 30},
+    'IP_HEADER': os.environ.get('ORDER_RATE_LIMIT_IP_HEADER') or None,
+}
+
+# 注文画面のURLのテーブルトークン（qr/table_tokens.py）
+# 印刷済みのトークンなしのQRコードから移行する間は TABLE_TOKEN_REQUIRED=0 にする
+TABLE_TOKENS = {
+    'REQUIRED': os.environ.get('TABLE_TOKEN_REQUIRED', '1') == '1',
+}
+
+# 動作状況のメトリクス（qr/metrics.py。/metrics から Prometheus の形式で取得する）
+# DIR を指定すると複数のワーカープロセスの値を合計する（gunicorn.conf.py で指定している）
+METRICS = {
+    'ENABLED': True,
+    'DIR': os.environ.get('QR_METRICS_DIR') or None,
+    'TOKEN': os.environ.get('QR_METRICS_TOKEN') or None,
+}
+
+# キャッシュ（qr/caches.py）
+# QR_CACHE_BACKEND: 'file'（既定。gunicorn の全ワーカーで共有される）/ 'locmem'（プロセスごと。開発・テスト用）
+# ワーカーごとのキャッシュだと、メニューなどを変更した際に他のワーカーのキャッシュが破棄されない
+if os.environ.get('QR_CACHE_BACKEND', 'file') == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'qr',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('QR_CACHE_DIR') or str(BASE_DIR / '.cache'),
+            'TIMEOUT': 300,
+            # ファイルのキャッシュは書き込みのたびにファイル数を数え、MAX_ENTRIES を超えると
+            # 1/CULL_FREQUENCY をまとめて削除する。数えるのはディレクトリの一覧なので、上限は
+            # 実際に使う件数（店舗ごとのメニュー・テーブル・設定と、ポーリング中の注文ステータス）に合わせて小さくしておく
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('QR_CACHE_MAX_ENTRIES', '2000')),
+                'CULL_FREQUENCY': 4,
+            },
+        }
+    }
+
 # セッション設定
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 86400  # 24時間
 
-# セキュリティ設定
-if not DEBUG:
+# セキュリティ設定（HTTPSで公開する場合）
+# 店内LANで http://<サーバーIP>:8000 のまま運用する場合は QR_HTTPS=0 にする
+if not DEBUG and os.environ.get('QR_HTTPS', '1') == '1':
     CSRF_COOKIE_SECURE = True
     SESSION_COOKIE_SECURE = True
     SECURE_SSL_REDIRECT = True